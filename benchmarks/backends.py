@@ -0,0 +1,154 @@
+"""Compares the SavedModel with its TensorFlow Lite and ONNX conversions (quantized_model).
+
+Usage:
+    python -m benchmarks.backends --images test-images --repeat 5
+    python -m benchmarks.backends --backends saved_model,tflite:int8,onnx:int8
+
+Each backend runs in a fresh process, so that its memory is measured on its own: the peak RSS
+increase covers importing the runtime and loading the model, as well as running it. Conversions
+are cached (see QUANTIZED_MODEL_CACHE_DIR), and timed separately on the first run. Latency is
+measured one image at a time, throughput on batches of --batch-size images, and top-1 agreement
+and the largest probability difference are measured against the SavedModel's outputs on the
+same images.
+"""
+import argparse
+import glob
+import os
+import resource
+from multiprocessing import get_context
+from time import perf_counter
+from typing import Dict, List
+
+import numpy as np
+
+from benchmarks.common import percentile, write_json
+
+BACKENDS = [
+    "saved_model",
+    "tflite:fp32",
+    "tflite:fp16",
+    "tflite:int8",
+    "onnx:fp32",
+    "onnx:fp16",
+    "onnx:int8",
+]
+
+
+def max_rss_kb() -> int:
+    """Returns this process' peak resident set size in kB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(backend: str, paths: List[str], repeat: int, batch_size: int) -> Dict:
+    """Loads one backend and runs it over every image, returning its timings, memory use and
+    per-image probabilities."""
+    # pylint: disable=import-outside-toplevel
+    import importlib
+
+    results: Dict = {"conversion_s": 0.0}
+    if backend == "saved_model":
+        module_name = "ml_trained_model"
+    else:
+        module_name = "quantized_model"
+        model_format, precision = backend.split(":")
+        os.environ["QUANTIZED_MODEL_FORMAT"] = model_format
+        os.environ["QUANTIZED_MODEL_PRECISION"] = precision
+    module = importlib.import_module(f"ml_rest_api.ml_trained_model.{module_name}")
+    samples = np.stack([module.preprocess({"image": path}) for path in paths])
+    samples = samples.astype(np.float32)
+    if module_name == "quantized_model":
+        start = perf_counter()
+        module.ensure_artifact(*module.model_settings())  # converts if not cached
+        results["conversion_s"] = perf_counter() - start
+    baseline = max_rss_kb()
+
+    start = perf_counter()
+    module.init()
+    results["load_s"] = perf_counter() - start
+    module.warmup(1)
+    module.warmup(batch_size)
+
+    latencies = []
+    probabilities = []
+    for _ in range(repeat):
+        probabilities = []
+        for sample in samples:
+            start = perf_counter()
+            probabilities.append(module.predict(sample[np.newaxis])[0])
+            latencies.append(perf_counter() - start)
+    results["p50_ms"] = percentile(latencies, 0.50) * 1000
+    results["p95_ms"] = percentile(latencies, 0.95) * 1000
+
+    batches = [samples[i : i + batch_size] for i in range(0, len(samples), batch_size)]
+    start = perf_counter()
+    for _ in range(repeat):
+        for batch in batches:
+            module.predict(batch)
+    results["batch_images_per_s"] = repeat * len(samples) / (perf_counter() - start)
+    results["peak_rss_increase_mb"] = (max_rss_kb() - baseline) / 1024
+    results["probabilities"] = np.asarray(probabilities).tolist()
+    return results
+
+
+def compare(results: Dict[str, Dict], reference: str) -> None:
+    """Adds each backend's top-1 agreement with the reference backend and the largest
+    absolute difference between their probabilities."""
+    expected = np.asarray(results[reference]["probabilities"])
+    for row in results.values():
+        actual = np.asarray(row["probabilities"])
+        row["top1_agreement"] = float(
+            np.mean(actual.argmax(axis=1) == expected.argmax(axis=1))
+        )
+        row["max_probability_diff"] = float(np.abs(actual - expected).max())
+
+
+def print_results(results: Dict[str, Dict]) -> None:
+    """Prints one row per backend."""
+    columns = [
+        "conversion_s",
+        "load_s",
+        "p50_ms",
+        "p95_ms",
+        "batch_images_per_s",
+        "peak_rss_increase_mb",
+        "top1_agreement",
+        "max_probability_diff",
+    ]
+    print(f"{'':<16}" + "".join(f"{column:>22}" for column in columns))
+    for name, row in results.items():
+        print(
+            f"{name:<16}"
+            + "".join(f"{row.get(column, 0):>22.4f}" for column in columns)
+        )
+
+
+def main() -> None:
+    """Parses the command line and prints the comparison table."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--images", default="test-images")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument(
+        "--backends",
+        default=",".join(BACKENDS),
+        help="comma-separated backends, saved_model or FORMAT:PRECISION",
+    )
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.images, "*")))
+    backends = [backend.strip() for backend in args.backends.split(",")]
+    results: Dict[str, Dict] = {}
+    for backend in backends:
+        with get_context("spawn").Pool(1) as pool:
+            results[backend] = pool.apply(
+                measure, (backend, paths, args.repeat, args.batch_size)
+            )
+    compare(results, "saved_model" if "saved_model" in results else backends[0])
+    print_results(results)
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
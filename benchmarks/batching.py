@@ -0,0 +1,110 @@
+"""Compares one-at-a-time inference with MicroBatcher under concurrent load.
+
+Usage:
+    python -m benchmarks.batching --clients 16 --requests 20
+    python -m benchmarks.batching --module ml_trained_model --clients 16
+
+Without --module a synthetic cost model stands in for the network: every forward pass costs
+--overhead-ms plus --per-item-ms per sample and at most --cores passes run at the same time,
+which is how TFSMLayer calls behave when they fight over the cores of a small VM.
+"""
+import argparse
+from threading import BoundedSemaphore, Thread
+from time import perf_counter, sleep
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from benchmarks.common import print_table, summarise, write_json
+from ml_rest_api.batching import MicroBatcher
+
+INPUT_SHAPE = (224, 224, 3)
+
+
+def synthetic_predict(
+    overhead_ms: float, per_item_ms: float, cores: int
+) -> Callable[[np.ndarray], np.ndarray]:
+    """Returns a predict() stand-in with a fixed per-call cost plus a per-sample cost."""
+    slots = BoundedSemaphore(cores)
+
+    def predict(batch: np.ndarray) -> np.ndarray:
+        with slots:
+            sleep((overhead_ms + per_item_ms * len(batch)) / 1000)
+        return np.tile(np.linspace(0, 1, 10, dtype=np.float32), (len(batch), 1))
+
+    return predict
+
+
+def module_predict(module_name: str) -> Callable[[np.ndarray], np.ndarray]:
+    """Loads and initialises a trained model module, returning its predict() function."""
+    from ml_rest_api.ml_trained_model.wrapper import (  # pylint: disable=import-outside-toplevel
+        TrainedModelWrapper,
+    )
+
+    wrapper = TrainedModelWrapper()
+    wrapper.load(module_name)
+    wrapper.init()
+    if not wrapper.supports_batching():
+        raise SystemExit(
+            f"{module_name} does not expose preprocess/predict/postprocess"
+        )
+    return wrapper.module.predict  # type: ignore
+
+
+def drive(call: Callable[[np.ndarray], object], clients: int, requests: int) -> Dict:
+    """Runs `requests` calls on each of `clients` threads and summarises the latencies."""
+    sample = np.random.default_rng(0).random(INPUT_SHAPE, dtype=np.float32) * 255
+    latencies: List[float] = []
+
+    def client() -> None:
+        for _ in range(requests):
+            start = perf_counter()
+            call(sample)
+            latencies.append(perf_counter() - start)
+
+    threads = [Thread(target=client) for _ in range(clients)]
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarise(latencies, perf_counter() - start)
+
+
+def main() -> None:
+    """Parses the command line and prints the comparison table."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--module", help="trained model module to benchmark")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=20, help="requests per client")
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=5)
+    parser.add_argument("--overhead-ms", type=float, default=20)
+    parser.add_argument("--per-item-ms", type=float, default=4)
+    parser.add_argument("--cores", type=int, default=1)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    if args.module:
+        predict = module_predict(args.module)
+    else:
+        predict = synthetic_predict(args.overhead_ms, args.per_item_ms, args.cores)
+    batcher = MicroBatcher(predict, args.max_batch_size, args.max_wait_ms / 1000)
+
+    results = {
+        "one_at_a_time": drive(
+            lambda sample: predict(np.expand_dims(sample, axis=0))[0],
+            args.clients,
+            args.requests,
+        ),
+        f"micro_batched(max={args.max_batch_size})": drive(
+            batcher.submit, args.clients, args.requests
+        ),
+    }
+    print_table(results)
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
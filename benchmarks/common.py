@@ -0,0 +1,41 @@
+"""Helpers shared by the benchmark scripts."""
+import json
+from typing import Dict, List, Sequence
+
+
+def percentile(values: Sequence[float], fraction: float) -> float:
+    """Returns the nearest-rank percentile of values (fraction between 0 and 1)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarise(latencies: List[float], elapsed: float) -> Dict[str, float]:
+    """Summarises per-request latencies (seconds) measured over elapsed wall-clock seconds."""
+    return {
+        "requests": len(latencies),
+        "throughput_rps": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+    }
+
+
+def print_table(rows: Dict[str, Dict[str, float]]) -> None:
+    """Prints one summarise() result per row as an aligned table."""
+    columns = ["requests", "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "mean_ms"]
+    print(f"{'':<28}" + "".join(f"{column:>16}" for column in columns))
+    for name, row in rows.items():
+        print(
+            f"{name:<28}"
+            + "".join(f"{row.get(column, 0):>16.2f}" for column in columns)
+        )
+
+
+def write_json(path: str, results: Dict) -> None:
+    """Writes results as pretty-printed JSON."""
+    with open(path, mode="w", encoding="utf-8") as output:
+        json.dump(results, output, indent=2, sort_keys=True)
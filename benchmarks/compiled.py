@@ -0,0 +1,80 @@
+"""Compares calling the SavedModel through a TFSMLayer with the compiled batch size buckets.
+
+Usage:
+    python -m benchmarks.compiled --batch-sizes 1,3,8 --calls 200
+
+Each mode (eager TFSMLayer, compiled, compiled with XLA) runs in a fresh process on random
+inputs, after warming up every batch size. The difference between the eager and compiled
+latencies is the per-call overhead of Keras layer dispatch and signature checks that compiling
+removes; batch sizes between buckets show what padding costs.
+"""
+import argparse
+import os
+from multiprocessing import get_context
+from time import perf_counter
+from typing import Dict, List
+
+from benchmarks.common import print_table, summarise, write_json
+
+MODES = {
+    "eager_tfsmlayer": {"MODEL_COMPILE": "0", "MODEL_JIT_COMPILE": "0"},
+    "compiled": {"MODEL_COMPILE": "1", "MODEL_JIT_COMPILE": "0"},
+    "compiled_xla": {"MODEL_COMPILE": "1", "MODEL_JIT_COMPILE": "1"},
+}
+
+
+def measure(mode: str, batch_sizes: List[int], calls: int) -> Dict[int, List[float]]:
+    """Loads the model in one mode and returns the latencies of calls predict() calls per batch
+    size."""
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+
+    os.environ.update(MODES[mode])
+    from ml_rest_api.ml_trained_model import ml_trained_model
+
+    ml_trained_model.init()
+    rng = np.random.default_rng(0)
+    batches = {
+        size: rng.uniform(0, 255, (size, *ml_trained_model.INPUT_SHAPE)).astype(
+            np.float32
+        )
+        for size in batch_sizes
+    }
+    for batch in batches.values():
+        for _ in range(3):
+            ml_trained_model.predict(batch)
+    latencies: Dict[int, List[float]] = {}
+    for size, batch in batches.items():
+        latencies[size] = []
+        for _ in range(calls):
+            start = perf_counter()
+            ml_trained_model.predict(batch)
+            latencies[size].append(perf_counter() - start)
+    return latencies
+
+
+def main() -> None:
+    """Parses the command line and prints the comparison table."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--batch-sizes", default="1,3,8")
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--buckets", default="1,8", help="MODEL_BATCH_BUCKETS")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    os.environ["MODEL_BATCH_BUCKETS"] = args.buckets
+    batch_sizes = [int(size) for size in args.batch_sizes.split(",")]
+    results: Dict[str, Dict[str, float]] = {}
+    for mode in args.modes.split(","):
+        with get_context("spawn").Pool(1) as pool:
+            latencies = pool.apply(measure, (mode, batch_sizes, args.calls))
+        for size, values in latencies.items():
+            results[f"{mode} batch={size}"] = summarise(values, sum(values))
+    print_table(results)
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
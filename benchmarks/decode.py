@@ -0,0 +1,100 @@
+"""Compares the old temp-file image loading path with the in-memory draft-mode decoder.
+
+Usage:
+    python -m benchmarks.decode --images test-images --repeat 5
+
+Each method runs in a fresh process so that its peak RSS increase can be measured on its own.
+"""
+import argparse
+import glob
+import os
+import resource
+import tempfile
+import uuid
+from io import BytesIO
+from multiprocessing import get_context
+from time import perf_counter
+from typing import Dict, List, Tuple
+
+from benchmarks.common import print_table, summarise, write_json
+
+
+def temp_file_path(img_bytes: bytes) -> None:
+    """The previous /model/predict path: write, full decode + resize via load_img(), unlink."""
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+
+    temp_file = os.path.join(tempfile.gettempdir(), f"{uuid.uuid4()}.jpg")
+    with open(temp_file, mode="wb") as jpg:
+        jpg.write(img_bytes)
+    try:
+        with Image.open(temp_file) as image:
+            image.convert("RGB").resize((224, 224), Image.Resampling.NEAREST)
+    finally:
+        os.remove(temp_file)
+
+
+def in_memory_path(img_bytes: bytes) -> None:
+    """The current path: draft-mode decode straight from the upload bytes."""
+    from ml_rest_api.imaging import (  # pylint: disable=import-outside-toplevel
+        to_model_input,
+    )
+
+    to_model_input(img_bytes)
+
+
+METHODS = {"temp_file": temp_file_path, "in_memory": in_memory_path}
+
+
+def max_rss_kb() -> int:
+    """Returns this process' peak resident set size in kB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(method: str, paths: List[str], repeat: int) -> Tuple[List[float], int]:
+    """Runs one method over every image `repeat` times, returning latencies and the peak RSS
+    increase in kB."""
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+
+    images = []
+    for path in paths:
+        with open(path, mode="rb") as image_file:
+            images.append(image_file.read())
+    warmup = BytesIO()
+    Image.new("RGB", (32, 32)).save(warmup, format="JPEG")
+    METHODS[method](
+        warmup.getvalue()
+    )  # import and warm up before taking the RSS baseline
+    baseline = max_rss_kb()
+    latencies = []
+    for _ in range(repeat):
+        for img_bytes in images:
+            start = perf_counter()
+            METHODS[method](img_bytes)
+            latencies.append(perf_counter() - start)
+    return latencies, max_rss_kb() - baseline
+
+
+def main() -> None:
+    """Parses the command line and prints the comparison table."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--images", default="test-images")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.images, "*")))
+    results: Dict[str, Dict[str, float]] = {}
+    for method in METHODS:
+        with get_context("spawn").Pool(1) as pool:
+            latencies, rss_kb = pool.apply(measure, (method, paths, args.repeat))
+        results[method] = summarise(latencies, sum(latencies))
+        results[method]["peak_rss_increase_mb"] = rss_kb / 1024
+    print_table(results)
+    for method, row in results.items():
+        print(f"{method:<28}peak RSS increase: {row['peak_rss_increase_mb']:.1f} MB")
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Compares background removal with masks computed at full resolution and on scaled-down copies.
+
+Usage:
+    python -m benchmarks.mask_resolution --resolutions 320,640,1024 --repeat 3
+    python -m benchmarks.mask_resolution --model u2netp --images test-images
+
+Every image is decoded at full size and run through RembgSessionPool.remove() once at full
+resolution, the reference, then with each max_resolution, with and without refine_edges. The
+latency covers remove() only: the output is a full-size image either way, so encoding it costs
+the same. The IoU compares each output's foreground (alpha above 127) with the reference's.
+"""
+import argparse
+import glob
+import os
+from time import perf_counter
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from benchmarks.common import percentile, write_json
+
+
+def foreground(image) -> np.ndarray:
+    """Returns the boolean foreground mask of an RGBA image."""
+    return np.asarray(image.getchannel("A")) > 127
+
+
+def iou(mask: np.ndarray, reference: np.ndarray) -> float:
+    """Returns the intersection over union of two boolean masks (1 if both are empty)."""
+    union = np.logical_or(mask, reference).sum()
+    return float(np.logical_and(mask, reference).sum() / union) if union else 1.0
+
+
+def main() -> None:
+    """Parses the command line and prints the comparison table."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--images", default="test-images")
+    parser.add_argument("--model", default="u2net")
+    parser.add_argument("--resolutions", default="320,640,1024,2048")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=0, help="REMBG_INTRA_OP_THREADS")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    # The references are full-size photos, whatever the upload limit
+    os.environ.setdefault("UPLOAD_MAX_PIXELS", "0")
+    # pylint: disable=import-outside-toplevel
+    from ml_rest_api.imaging import decode_full
+    from ml_rest_api.rembg_sessions import RembgSessionPool, new_session
+
+    session = new_session(args.model, args.threads)
+    paths = sorted(glob.glob(os.path.join(args.images, "*")))
+    images = [decode_full(path, max_side=0) for path in paths]
+    modes: List[Tuple[int, bool]] = [(0, False), (0, True)] + [
+        (int(resolution), refine)
+        for resolution in args.resolutions.split(",")
+        for refine in (False, True)
+    ]
+
+    references = []
+    for image in images:
+        RembgSessionPool.remove(image, session)  # warms up at this image size
+        references.append(foreground(RembgSessionPool.remove(image, session)))
+
+    results: Dict[str, Dict[str, float]] = {}
+    for max_resolution, refine_edges in modes:
+        latencies: List[float] = []
+        ious: List[float] = []
+        for image, reference in zip(images, references):
+            for _ in range(args.repeat):
+                start = perf_counter()
+                output = RembgSessionPool.remove(
+                    image, session, max_resolution, refine_edges
+                )
+                latencies.append(perf_counter() - start)
+            ious.append(iou(foreground(output), reference))
+        name = f"{max_resolution or 'full'}{' refined' if refine_edges else ''}"
+        results[name] = {
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "mean_iou": float(np.mean(ious)),
+            "min_iou": float(np.min(ious)),
+        }
+
+    columns = ["p50_ms", "p95_ms", "mean_iou", "min_iou"]
+    print(f"{len(images)} images, model {args.model}")
+    print(f"{'max_resolution':<16}" + "".join(f"{column:>12}" for column in columns))
+    for name, row in results.items():
+        print(f"{name:<16}" + "".join(f"{row[column]:>12.4f}" for column in columns))
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Compares the memory footprint of gunicorn workers that each load the models on their own with
+that of pre-fork mode (ml_rest_api/gunicorn_prefork.py). Linux only.
+
+Usage:
+    python -m benchmarks.prefork_memory --workers 4
+
+Each mode starts gunicorn, waits until every worker has written its startup report (i.e. has
+loaded its model), then reads the unique (USS), shared and proportional (PSS) memory of the
+master and of each worker. The sum of PSS is what the whole server really uses.
+"""
+import argparse
+import glob
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+from time import monotonic, sleep
+from typing import Dict, List
+
+from benchmarks.common import write_json
+from ml_rest_api.memory import memory_report
+
+MODES = {
+    "per_worker": ["--worker-class=gthread", "ml_rest_api.app:APP"],
+    "prefork": ["-c", "python:ml_rest_api.gunicorn_prefork", "ml_rest_api.app:APP"],
+}
+
+
+def children(pid: int) -> List[int]:
+    """Returns the IDs of the direct child processes of pid."""
+    pids = []
+    for stat_path in glob.glob("/proc/[0-9]*/stat"):
+        try:
+            with open(stat_path, encoding="ascii") as stat_file:
+                fields = stat_file.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            pids.append(int(stat_path.split("/")[2]))
+    return sorted(pids)
+
+
+def worker_ready(report_dir: str, pid: int) -> bool:
+    """Returns whether a worker has written a startup report showing its model as loaded."""
+    try:
+        with open(
+            os.path.join(report_dir, f"startup-{pid}.json"), encoding="utf-8"
+        ) as report_file:
+            report = json.load(report_file)
+    except (OSError, ValueError):
+        return False
+    return any(phase["phase"] == "model_init" for phase in report["phases"])
+
+
+def measure(mode: str, workers: int, port: int, timeout: float) -> Dict:
+    """Starts gunicorn in one mode and returns the memory of the master and its workers."""
+    with tempfile.TemporaryDirectory() as report_dir:
+        env = dict(
+            os.environ,
+            STARTUP_REPORT_PATH=os.path.join(report_dir, "startup-{pid}.json"),
+            PREFORK_INIT=str(mode == "prefork"),
+        )
+        command = [sys.executable, "-m", "gunicorn", "-w", str(workers)]
+        command += ["-b", f"127.0.0.1:{port}"] + MODES[mode]
+        with subprocess.Popen(
+            command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        ) as server:
+            try:
+                deadline = monotonic() + timeout
+                pids: List[int] = []
+                while monotonic() < deadline:
+                    pids = children(server.pid)
+                    if len(pids) == workers and all(
+                        worker_ready(report_dir, pid) for pid in pids
+                    ):
+                        break
+                    sleep(0.5)
+                else:
+                    print(
+                        f"{mode}: workers not ready after {timeout}s, measuring anyway"
+                    )
+                sleep(1)  # let the workers settle after writing their reports
+                result = {
+                    "master": memory_report(server.pid),
+                    "workers": [memory_report(pid) for pid in pids],
+                }
+            finally:
+                server.send_signal(signal.SIGTERM)
+                server.wait()
+    processes = [result["master"]] + result["workers"]
+    result["total_pss_mb"] = round(sum(p.get("pss_mb", 0) for p in processes), 1)
+    result["total_uss_mb"] = round(sum(p.get("uss_mb", 0) for p in processes), 1)
+    return result
+
+
+def main() -> None:
+    """Parses the command line and prints the comparison."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--port", type=int, default=8899)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    results = {
+        mode: measure(mode, args.workers, args.port, args.timeout) for mode in MODES
+    }
+    columns = ["rss_mb", "uss_mb", "shared_mb", "pss_mb"]
+    print(f"{'':<28}" + "".join(f"{column:>16}" for column in columns))
+    for mode, result in results.items():
+        rows = [("master", result["master"])] + [
+            (f"worker {index}", worker)
+            for index, worker in enumerate(result["workers"])
+        ]
+        for name, row in rows:
+            print(
+                f"{mode + ' ' + name:<28}"
+                + "".join(f"{row.get(column, 0):>16.1f}" for column in columns)
+            )
+        print(
+            f"{mode + ' total':<28}{'':>16}{result['total_uss_mb']:>16.1f}"
+            f"{'':>16}{result['total_pss_mb']:>16.1f}"
+        )
+    if args.json:
+        write_json(args.json, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+"""Replays captured traffic against a running instance or in-process through the Flask app.
+
+Usage:
+    python -m benchmarks.replay --url http://localhost:8888 --concurrency 4 --duration 60
+    python -m benchmarks.replay --url http://localhost:8888 --rates 0.5,1,2,4 --duration 60
+    python -m benchmarks.replay --in-process --stub --rates 1,2,4,8 --json curve.json
+
+The capture (benchmarks/capture.jsonl by default) holds one request per line:
+
+    {"offset_s": 0.4, "method": "POST", "path": "/api/model/predict",
+     "form": {"classifiers": ["['glass', 'paper']"]}, "files": {"file": "cans.jpeg"}}
+
+Captures don't hold image data: every uploaded file is substituted from --images, by name if
+that image exists there, otherwise (e.g. "*") round-robin. A list of names uploads several files
+under the same field. The capture is cycled through until --duration or --requests runs out.
+
+Closed loop (--concurrency) keeps N requests in flight, each client sending its next request as
+soon as the previous one returns: the server never sees more than N requests, so queueing delay
+stays hidden. Open loop (--rates, or --timestamps to use the captured offsets) sends requests at
+their scheduled arrival times whether or not earlier ones have returned, and measures latency
+from the scheduled time, so queueing delay shows up. Several rates give a throughput-versus-
+latency curve: the knee is the most traffic an instance can take within a latency target.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count, cycle
+from threading import Lock, local
+from time import perf_counter, sleep
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from benchmarks.common import percentile, write_json
+
+CaptureType = List[Dict[str, Any]]
+# Sends a request; returns the status code (0 if it could not be sent) and an error message
+SenderType = Callable[[Dict[str, Any]], Tuple[int, str]]
+
+
+def load_capture(path: str) -> CaptureType:
+    """Reads a capture file, skipping blank lines."""
+    with open(path, encoding="utf-8") as capture_file:
+        return [json.loads(line) for line in capture_file if line.strip()]
+
+
+class ImageSubstitution:  # pylint: disable=too-few-public-methods
+    """Supplies the bytes of the uploaded files from a directory of images."""
+
+    def __init__(self, directory: str) -> None:
+        """Reads every image in the directory."""
+        self.images: Dict[str, bytes] = {}
+        for path in sorted(glob.glob(os.path.join(directory, "*"))):
+            with open(path, mode="rb") as image_file:
+                self.images[os.path.basename(path)] = image_file.read()
+        if not self.images:
+            raise SystemExit(f"No images in {directory}")
+        self._round_robin = cycle(sorted(self.images))
+        self._lock = Lock()
+
+    def get(self, name: str) -> Tuple[str, bytes]:
+        """Returns the named image if there is one, otherwise the next one in turn."""
+        if name not in self.images:
+            with self._lock:
+                name = next(self._round_robin)
+        return name, self.images[name]
+
+
+def files_of(
+    entry: Dict[str, Any], images: ImageSubstitution
+) -> List[Tuple[str, str, bytes]]:
+    """Returns (field, file name, bytes) for each file uploaded by a captured request."""
+    files = []
+    for field, names in (entry.get("files") or {}).items():
+        for name in names if isinstance(names, list) else [names]:
+            files.append((field, *images.get(str(name))))
+    return files
+
+
+def http_sender(url: str, images: ImageSubstitution, timeout: float) -> SenderType:
+    """Returns a sender that makes real HTTP requests, with one connection pool per thread."""
+    import requests  # pylint: disable=import-outside-toplevel
+
+    sessions = local()
+
+    def send(entry: Dict[str, Any]) -> Tuple[int, str]:
+        if not hasattr(sessions, "session"):
+            sessions.session = requests.Session()
+        files = [
+            (field, (name, data, "image/jpeg"))
+            for field, name, data in files_of(entry, images)
+        ]
+        try:
+            response = sessions.session.request(
+                entry.get("method", "GET"),
+                url.rstrip("/") + entry["path"],
+                data=entry.get("form"),
+                files=files or None,
+                timeout=timeout,
+            )
+            response.content  # pylint: disable=pointless-statement
+        except requests.RequestException as exception:
+            return 0, type(exception).__name__
+        return response.status_code, "" if response.ok else response.text[:200]
+
+    return send
+
+
+def in_process_sender(images: ImageSubstitution) -> SenderType:
+    """Returns a sender that calls the Flask app in this process through its test client."""
+    from ml_rest_api.app import APP  # pylint: disable=import-outside-toplevel
+    from io import BytesIO  # pylint: disable=import-outside-toplevel
+
+    clients = local()
+
+    def send(entry: Dict[str, Any]) -> Tuple[int, str]:
+        if not hasattr(clients, "client"):
+            clients.client = APP.test_client()
+        data: Dict[str, Any] = dict(entry.get("form") or {})
+        for field, name, img_bytes in files_of(entry, images):
+            data.setdefault(field, []).append((BytesIO(img_bytes), name))
+        response = clients.client.open(
+            entry["path"], method=entry.get("method", "GET"), data=data
+        )
+        body = response.get_data()
+        response.close()
+        return response.status_code, "" if response.status_code < 400 else str(
+            body[:200]
+        )
+
+    return send
+
+
+class Recorder:
+    """Collects one record per request, thread-safely."""
+
+    def __init__(self) -> None:
+        """Starts empty."""
+        self.records: List[Dict[str, Any]] = []
+        self._lock = Lock()
+
+    def timed(
+        self, send: SenderType, entry: Dict[str, Any], scheduled: float, origin: float
+    ) -> None:
+        """Sends one request. Latency is counted from the scheduled time, service time from
+        when the request was actually sent."""
+        started = perf_counter()
+        status, error = send(entry)
+        finished = perf_counter()
+        with self._lock:
+            self.records.append(
+                {
+                    "path": entry["path"],
+                    "scheduled_s": scheduled - origin,
+                    "latency_ms": (finished - scheduled) * 1000,
+                    "service_ms": (finished - started) * 1000,
+                    "status": status,
+                    "error": error,
+                }
+            )
+
+
+def closed_loop(
+    send: SenderType,
+    capture: CaptureType,
+    concurrency: int,
+    duration: float,
+    requests: Optional[int],
+) -> Tuple[Recorder, float]:
+    """Runs `concurrency` clients back to back until the duration or request count is
+    reached. Returns the records and the elapsed time."""
+    recorder = Recorder()
+    entries = cycle(capture)
+    numbers = count()
+    lock = Lock()
+    origin = perf_counter()
+
+    def client() -> None:
+        while perf_counter() - origin < duration:
+            with lock:
+                if requests is not None and next(numbers) >= requests:
+                    return
+                entry = next(entries)
+            recorder.timed(send, entry, perf_counter(), origin)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for _ in range(concurrency):
+            executor.submit(client)
+    return recorder, perf_counter() - origin
+
+
+def arrival_times(
+    capture: CaptureType,
+    rate: Optional[float],
+    duration: float,
+    requests: Optional[int],
+    speed: float,
+) -> Iterator[Tuple[float, Dict[str, Any]]]:
+    """Yields (seconds after start, request) for an open-loop run: Poisson arrivals at `rate`
+    requests per second, or the captured offsets (looped, divided by `speed`) if rate is None.
+    """
+    rng = np.random.default_rng(0)
+    span = max((entry.get("offset_s", 0.0) for entry in capture), default=0.0) + 1.0
+    when = 0.0
+    for number, entry in enumerate(cycle(capture)):
+        if requests is not None and number >= requests:
+            return
+        if rate:
+            when += rng.exponential(1 / rate)
+        else:
+            loop, index = divmod(number, len(capture))
+            when = (loop * span + capture[index].get("offset_s", 0.0)) / speed
+        if when >= duration:
+            return
+        yield when, entry
+
+
+def open_loop(
+    send: SenderType,
+    schedule: Iterator[Tuple[float, Dict[str, Any]]],
+    max_in_flight: int,
+) -> Tuple[Recorder, float]:
+    """Sends each request at its scheduled time on a pool of up to max_in_flight threads.
+    Returns the records and the elapsed time (until the last response)."""
+    recorder = Recorder()
+    origin = perf_counter()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        for when, entry in schedule:
+            delay = origin + when - perf_counter()
+            if delay > 0:
+                sleep(delay)
+            executor.submit(recorder.timed, send, entry, origin + when, origin)
+    return recorder, perf_counter() - origin
+
+
+def summarise_run(records: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    """Summarises a run: achieved throughput, latency percentiles and errors, overall and per
+    path."""
+
+    def stats(subset: List[Dict[str, Any]]) -> Dict[str, Any]:
+        ok = [record for record in subset if 0 < record["status"] < 400]
+        latencies = [record["latency_ms"] for record in ok]
+        return {
+            "requests": len(subset),
+            "errors": len(subset) - len(ok),
+            "throughput_rps": len(ok) / elapsed if elapsed > 0 else 0.0,
+            "p50_ms": percentile(latencies, 0.50),
+            "p95_ms": percentile(latencies, 0.95),
+            "p99_ms": percentile(latencies, 0.99),
+            "mean_service_ms": (
+                sum(record["service_ms"] for record in ok) / len(ok) if ok else 0.0
+            ),
+        }
+
+    paths = sorted({record["path"] for record in records})
+    return {
+        **stats(records),
+        "paths": {
+            path: stats([record for record in records if record["path"] == path])
+            for path in paths
+        },
+    }
+
+
+def print_runs(runs: Dict[str, Dict[str, Any]]) -> None:
+    """Prints one line per run, e.g. the points of a throughput-versus-latency curve."""
+    columns = ["requests", "errors", "throughput_rps", "p50_ms", "p95_ms", "p99_ms"]
+    print(f"{'':<20}" + "".join(f"{column:>16}" for column in columns))
+    for name, run in runs.items():
+        print(f"{name:<20}" + "".join(f"{run[column]:>16.2f}" for column in columns))
+
+
+def main() -> None:
+    """Parses the command line, replays the capture and prints the results."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--capture", default="benchmarks/capture.jsonl")
+    parser.add_argument("--images", default="test-images")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="base URL of a running instance")
+    target.add_argument(
+        "--in-process", action="store_true", help="call the app through its test client"
+    )
+    parser.add_argument(
+        "--stub", action="store_true", help="in-process: use the stub model"
+    )
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--concurrency", type=int, help="closed loop with N clients")
+    mode.add_argument("--rates", help="open loop at these requests/s, comma-separated")
+    mode.add_argument(
+        "--timestamps", action="store_true", help="open loop at the captured offsets"
+    )
+    parser.add_argument("--speed", type=float, default=1.0, help="--timestamps speedup")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds per run")
+    parser.add_argument("--requests", type=int, help="maximum requests per run")
+    parser.add_argument("--max-in-flight", type=int, default=256)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--json", help="write the summaries to this file")
+    parser.add_argument(
+        "--records", help="write every request as JSON lines to this file"
+    )
+    args = parser.parse_args()
+
+    capture = load_capture(args.capture)
+    images = ImageSubstitution(args.images)
+    if args.in_process:
+        if args.stub:
+            os.environ["TRAINED_MODEL_MODULE_NAME"] = "stub_model"
+        os.environ.setdefault("MULTITHREADED_INIT", "False")
+        send = in_process_sender(images)
+    else:
+        send = http_sender(args.url, images, args.timeout)
+
+    runs: Dict[str, Tuple[Recorder, float]] = {}
+    if args.rates:
+        for rate in (float(rate) for rate in args.rates.split(",")):
+            print(f"Open loop at {rate} requests/s...", file=sys.stderr)
+            schedule = arrival_times(
+                capture, rate, args.duration, args.requests, args.speed
+            )
+            runs[f"rate={rate:g}/s"] = open_loop(send, schedule, args.max_in_flight)
+    elif args.timestamps:
+        schedule = arrival_times(
+            capture, None, args.duration, args.requests, args.speed
+        )
+        runs[f"timestamps x{args.speed:g}"] = open_loop(
+            send, schedule, args.max_in_flight
+        )
+    else:
+        concurrency = args.concurrency or 1
+        runs[f"concurrency={concurrency}"] = closed_loop(
+            send, capture, concurrency, args.duration, args.requests
+        )
+
+    summaries = {
+        name: summarise_run(recorder.records, elapsed)
+        for name, (recorder, elapsed) in runs.items()
+    }
+    for name, (recorder, _) in runs.items():
+        failed = [r for r in recorder.records if not 0 < r["status"] < 400]
+        if failed:
+            print(
+                f"{name}: {len(failed)} failed requests, e.g. {failed[0]['path']}"
+                f" {failed[0]['status']} {failed[0]['error']}",
+                file=sys.stderr,
+            )
+    print_runs(summaries)
+    if args.json:
+        write_json(args.json, summaries)
+    if args.records:
+        with open(args.records, mode="w", encoding="utf-8") as records_file:
+            for name, (recorder, _) in runs.items():
+                for record in recorder.records:
+                    records_file.write(json.dumps({"run": name, **record}) + "\n")
+
+
+if __name__ == "__main__":
+    main()
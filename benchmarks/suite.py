@@ -0,0 +1,329 @@
+"""Offline benchmark suite: drives every image endpoint through Flask's test client, no server
+needed.
+
+Usage:
+    python -m benchmarks.suite --json benchmarks/results.json --baseline benchmarks/baseline.json
+    python -m benchmarks.suite --save-baseline benchmarks/baseline.json
+
+The deterministic stub model (ml_rest_api/ml_trained_model/stub_model.py) stands in for the
+TensorFlow network, while image decoding and background removal use the real code paths on the
+bundled test images. Result caches are disabled so that every request does the full work. For
+each endpoint the suite reports throughput and latency percentiles, overall and per stage (read
+from the Server-Timing header). Compared with a baseline, it lists the changes beyond
+--tolerance and exits with status 1 if any of them is a regression. Baselines are only
+comparable on the same machine.
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import sys
+import tempfile
+from threading import Thread
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Tuple
+
+from benchmarks.common import percentile, print_table, summarise, write_json
+
+CLASSIFIERS = "['cardboard', 'glass', 'metal', 'paper', 'plastic', 'trash']"
+LATENCY_METRICS = ("p50_ms", "p95_ms", "p99_ms")
+
+RequestType = Callable[[Any], Any]  # takes a test client, returns a response
+
+
+def configure(rembg_model: str) -> None:
+    """Sets up the app's settings for the suite. Must run before the app is imported."""
+    os.environ.update(
+        {
+            "TRAINED_MODEL_MODULE_NAME": "stub_model",
+            "MULTITHREADED_INIT": "False",  # load everything before the first request
+            "REMBG_MODELS": rembg_model,
+            "PREDICTION_CACHE_MAX_ENTRIES": "0",
+            "SEGMENTATION_CACHE_MAX_ENTRIES": "0",
+            "SERVER_TIMING": "True",
+            "RESULT_STORE_DIR": tempfile.mkdtemp(prefix="ml_rest_api_suite_"),
+        }
+    )
+
+
+def endpoint_cases(
+    images: List[Tuple[str, bytes]], rembg: bool, compressions: List[str]
+) -> Dict[str, List]:
+    """Returns, per endpoint, the requests making up one pass over the test images.
+    Background removal is also run for each output format but png, named
+    background_removal:{format}, and for png and webp at each of the compression levels,
+    named background_removal:{format}:c{level}."""
+
+    def upload(url: str, img_name: str, img_bytes: bytes, **form: str) -> RequestType:
+        return lambda client: client.post(
+            url,
+            data={"file": (io.BytesIO(img_bytes), img_name), **form},
+            content_type="multipart/form-data",
+        )
+
+    def batch_upload(client):
+        files = [(io.BytesIO(img_bytes), name) for name, img_bytes in images]
+        return client.post(
+            "/api/model/predict_batch",
+            data={"files": files, "classifiers": CLASSIFIERS},
+            content_type="multipart/form-data",
+        )
+
+    cases: Dict[str, List] = {
+        "predict": [
+            upload("/api/model/predict", *image, classifiers=CLASSIFIERS)
+            for image in images
+        ],
+        "predict_batch": [batch_upload],
+    }
+    if rembg:
+        cases["background_removal"] = [
+            upload("/api/segmentation/background_removal", *image) for image in images
+        ]
+        # pylint: disable=import-outside-toplevel
+        from ml_rest_api.output_formats import OUTPUT_FORMATS
+
+        variants = [(output_format, "") for output_format in OUTPUT_FORMATS[1:]] + [
+            (output_format, level)
+            for output_format in ("png", "webp")
+            for level in compressions
+        ]
+        for output_format, level in variants:
+            name = f"background_removal:{output_format}"
+            form = {"output_format": output_format}
+            if level:
+                name += f":c{level}"
+                form["compression"] = level
+            cases[name] = [
+                upload("/api/segmentation/background_removal", *image, **form)
+                for image in images
+            ]
+        cases["background_removal_predict"] = [
+            upload(
+                "/api/model/background_removal_predict",
+                *image,
+                classifiers=CLASSIFIERS,
+                return_processed_image="false",
+            )
+            for image in images
+        ]
+    return cases
+
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    """Returns {stage: milliseconds} from a Server-Timing header."""
+    timings: Dict[str, float] = {}
+    for entry in filter(None, (part.strip() for part in header.split(","))):
+        name, *params = entry.split(";")
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "dur":
+                timings[name.strip()] = float(value)
+    return timings
+
+
+def run_endpoint(app: Any, requests: List, repeat: int, clients: int) -> Dict:
+    """Runs the requests `repeat` times on each of `clients` threads, after one untimed pass,
+    and summarises their latencies and stage timings."""
+    latencies: List[float] = []
+    sizes: List[int] = []
+    stages: Dict[str, List[float]] = {}
+    errors: List[str] = []
+
+    def client_loop(timed: bool, passes: int) -> None:
+        client = app.test_client()
+        for _ in range(passes):
+            for request in requests:
+                start = perf_counter()
+                response = request(client)
+                body = response.get_data()
+                elapsed = perf_counter() - start
+                response.close()
+                if response.status_code != 200:
+                    errors.append(f"{response.status_code} {response.get_data()[:200]}")
+                elif timed:
+                    latencies.append(elapsed)
+                    sizes.append(len(body))
+                    timings = response.headers.get("Server-Timing", "")
+                    for stage, ms in parse_server_timing(timings).items():
+                        stages.setdefault(stage, []).append(ms / 1000)
+
+    client_loop(timed=False, passes=1)
+    threads = [Thread(target=client_loop, args=(True, repeat)) for _ in range(clients)]
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result = summarise(latencies, perf_counter() - start)
+    result["errors"] = len(errors)
+    result["mean_kb"] = sum(sizes) / len(sizes) / 1024 if sizes else 0.0
+    result["stages"] = {
+        stage: {
+            f"p{int(fraction * 100)}_ms": percentile(values, fraction) * 1000
+            for fraction in (0.50, 0.95, 0.99)
+        }
+        for stage, values in sorted(stages.items())
+    }
+    if errors:
+        print(f"  {len(errors)} failed requests, e.g. {errors[0]}", file=sys.stderr)
+    return result
+
+
+def compare(
+    results: Dict, baseline: Dict, tolerance: float, min_delta_ms: float
+) -> List[Dict]:
+    """Returns the endpoint (and stage) metrics that moved by more than `tolerance` (a
+    fraction) from the baseline, flagging slower latencies, lower throughput or larger
+    responses as regressions. Latencies that moved by less than min_delta_ms are ignored as
+    noise."""
+
+    def changes(name: str, current: Dict, previous: Dict, metrics) -> List[Dict]:
+        found = []
+        for metric in metrics:
+            before, after = previous.get(metric), current.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            if metric in LATENCY_METRICS and abs(after - before) < min_delta_ms:
+                continue
+            if abs(change) > tolerance:
+                worse = change < 0 if metric == "throughput_rps" else change > 0
+                found.append(
+                    {
+                        "name": name,
+                        "metric": metric,
+                        "baseline": before,
+                        "current": after,
+                        "change": change,
+                        "regression": worse,
+                    }
+                )
+        return found
+
+    found: List[Dict] = []
+    for endpoint, current in results.items():
+        previous = baseline.get(endpoint)
+        if not previous:
+            continue
+        found += changes(
+            endpoint, current, previous, ("throughput_rps", "mean_kb") + LATENCY_METRICS
+        )
+        for stage, timings in current.get("stages", {}).items():
+            found += changes(
+                f"{endpoint}/{stage}",
+                timings,
+                previous.get("stages", {}).get(stage, {}),
+                LATENCY_METRICS,
+            )
+    return found
+
+
+def print_stages(results: Dict) -> None:
+    """Prints the per-stage latency percentiles of each endpoint."""
+    print(f"\n{'stage':<44}" + "".join(f"{m:>12}" for m in LATENCY_METRICS))
+    for endpoint, result in results.items():
+        for stage, timings in result["stages"].items():
+            print(
+                f"{endpoint + '/' + stage:<44}"
+                + "".join(f"{timings[m]:>12.2f}" for m in LATENCY_METRICS)
+            )
+
+
+def print_outputs(results: Dict) -> None:
+    """Prints the mean response size and encoding time of each background removal output."""
+    columns = ["mean_kb", "encode_p50_ms", "encode_p95_ms"]
+    print(f"\n{'output':<44}" + "".join(f"{column:>14}" for column in columns))
+    for endpoint, result in results.items():
+        if endpoint.split(":")[0] != "background_removal":
+            continue
+        encode = next(
+            (
+                timings
+                for stage, timings in result["stages"].items()
+                if stage.endswith("_encode")
+            ),
+            {},
+        )
+        print(
+            f"{endpoint:<44}{result['mean_kb']:>14.1f}"
+            + "".join(f"{encode.get(m, 0.0):>14.2f}" for m in ("p50_ms", "p95_ms"))
+        )
+
+
+def main() -> None:
+    """Parses the command line, runs the suite and compares it with the baseline."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--images", default="test-images")
+    parser.add_argument("--repeat", type=int, default=5, help="timed passes per client")
+    parser.add_argument("--clients", type=int, default=1)
+    parser.add_argument(
+        "--rembg-model", default="u2netp", help='"" skips background removal'
+    )
+    parser.add_argument(
+        "--compressions",
+        default="1,9",
+        help="compression levels png and webp outputs are also run at",
+    )
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="compare with the results in this file")
+    parser.add_argument("--save-baseline", help="write results as a new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument(
+        "--min-delta-ms", type=float, default=1.0, help="ignore smaller latency changes"
+    )
+    args = parser.parse_args()
+
+    configure(args.rembg_model)
+    # pylint: disable=import-outside-toplevel
+    from ml_rest_api.app import APP
+    from ml_rest_api.rembg_sessions import rembg_session_pool
+
+    images = []
+    for path in sorted(glob.glob(os.path.join(args.images, "*.jpeg"))):
+        with open(path, mode="rb") as image_file:
+            images.append((os.path.basename(path), image_file.read()))
+    if not images:
+        raise SystemExit(f"No .jpeg images in {args.images}")
+    rembg = rembg_session_pool.ready() and bool(rembg_session_pool.sessions)
+    if not rembg:
+        print(
+            "rembg sessions unavailable, skipping background removal", file=sys.stderr
+        )
+
+    results: Dict[str, Dict] = {}
+    compressions = [level for level in args.compressions.split(",") if level]
+    for endpoint, requests in endpoint_cases(images, rembg, compressions).items():
+        print(f"Running {endpoint}...", file=sys.stderr)
+        results[endpoint] = run_endpoint(APP, requests, args.repeat, args.clients)
+    print_table(results)
+    print_stages(results)
+    if rembg:
+        print_outputs(results)
+
+    if args.json:
+        write_json(args.json, results)
+    if args.save_baseline:
+        write_json(args.save_baseline, results)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            found = compare(
+                results, json.load(baseline_file), args.tolerance, args.min_delta_ms
+            )
+        print(f"\nChanges beyond {args.tolerance:.0%} against {args.baseline}:")
+        for row in found:
+            print(
+                f"{'REGRESSION' if row['regression'] else 'improvement':<12}"
+                f"{row['name'] + ' ' + row['metric']:<56}"
+                f"{row['baseline']:>10.2f} -> {row['current']:>10.2f}"
+                f" ({row['change']:+.0%})"
+            )
+        if not found:
+            print("none")
+        if any(row["regression"] for row in found):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
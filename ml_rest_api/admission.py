@@ -0,0 +1,225 @@
+"""This module implements the AdmissionQueue class and request deadlines."""
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from logging import Logger, getLogger
+from threading import Event, Lock
+from time import monotonic
+from typing import AsyncIterator, Callable, Deque, Dict, Iterator, Optional, Tuple
+from ml_rest_api.metrics import LabelValuesType, stage
+from ml_rest_api.settings import get_float, get_int
+
+DEADLINE_HEADER = "X-Request-Timeout-Ms"
+
+log: Logger = getLogger(__name__)
+
+
+class Overloaded(Exception):
+    """Raised when a request finds its endpoint's admission queue full."""
+
+    def __init__(self, queue: str, retry_after: int) -> None:
+        """retry_after is the number of seconds clients are asked to wait before retrying."""
+        super().__init__(f"Too many requests queued for {queue}")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request's deadline passes before its work has started."""
+
+
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+_dropped: Dict[Tuple[str, str], int] = {}
+_dropped_lock = Lock()
+
+
+def set_deadline(header: Optional[str]) -> None:
+    """Sets the deadline of the current request from its X-Request-Timeout-Ms header (a number
+    of milliseconds from now), or from REQUEST_TIMEOUT_MS if it has none or it isn't a number.
+    0 means no deadline."""
+    try:
+        timeout_ms = float(header) if header else get_float("REQUEST_TIMEOUT_MS")
+    except ValueError:
+        log.warning("Ignoring invalid %s header: %r", DEADLINE_HEADER, header)
+        timeout_ms = get_float("REQUEST_TIMEOUT_MS")
+    _deadline.set(monotonic() + timeout_ms / 1000 if timeout_ms > 0 else None)
+
+
+def deadline() -> Optional[float]:
+    """Returns the current request's deadline in time.monotonic() seconds, if it has one."""
+    return _deadline.get()
+
+
+def count_dropped(queue: str, reason: str) -> None:
+    """Counts a request dropped from a queue, reason being "shed" or "expired"."""
+    with _dropped_lock:
+        _dropped[(queue, reason)] = _dropped.get((queue, reason), 0) + 1
+
+
+def dropped_stats() -> Dict[LabelValuesType, float]:
+    """Returns the number of requests dropped per (queue, reason)."""
+    with _dropped_lock:
+        return {key: float(count) for key, count in _dropped.items()}
+
+
+def check_deadline(queue: str, expires: Optional[float] = None) -> None:
+    """Raises DeadlineExceeded (and counts it against queue) if the current request's
+    deadline, or expires if given, has passed."""
+    expires = deadline() if expires is None else expires
+    if expires is not None and monotonic() >= expires:
+        count_dropped(queue, "expired")
+        raise DeadlineExceeded(f"Deadline passed while queued for {queue}")
+
+
+class _Waiter:  # pylint: disable=too-few-public-methods
+    """A request waiting for a slot, and how to wake it up once it is granted one."""
+
+    def __init__(self, notify: Callable[[], object]) -> None:
+        """notify is called, with the queue's lock held, when the slot is granted. What it
+        returns is ignored."""
+        self.notify = notify
+        self.granted = False
+
+
+class AdmissionQueue:
+    """AdmissionQueue lets at most concurrency requests of an endpoint do their work at a time,
+    and up to max_queued more wait for a slot in arrival order. Requests that find the queue
+    full are shed with Overloaded right away instead of adding to everyone's latency, and those
+    whose deadline passes while they wait are dropped with DeadlineExceeded. Slots are used from
+    request threads with admit() and from coroutines with admit_async(). A concurrency of 0
+    admits everything.
+    """
+
+    def __init__(self, name: str, concurrency: int, max_queued: int) -> None:
+        """name labels the queue's metrics."""
+        self.name = name
+        self.concurrency = max(0, concurrency)
+        self.max_queued = max(0, max_queued)
+        self.running: int = 0
+        self._waiters: Deque[_Waiter] = deque()
+        self._lock = Lock()
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the number of requests running and waiting."""
+        with self._lock:
+            return {"running": self.running, "queued": len(self._waiters)}
+
+    def _enter(self, notify: Callable[[], object]) -> Optional[_Waiter]:
+        """Takes a free slot and returns None, or queues a waiter for the next one. Raises
+        Overloaded if the queue is full and DeadlineExceeded if the deadline has passed.
+        """
+        check_deadline(self.name)
+        with self._lock:
+            if self.running < self.concurrency and not self._waiters:
+                self.running += 1
+                return None
+            if len(self._waiters) >= self.max_queued:
+                count_dropped(self.name, "shed")
+                raise Overloaded(self.name, get_int("ADMISSION_RETRY_AFTER_SECONDS"))
+            waiter = _Waiter(notify)
+            self._waiters.append(waiter)
+            return waiter
+
+    def _give_up(self, waiter: _Waiter) -> None:
+        """Called by a waiter whose deadline passed (or that was cancelled): leaves the queue,
+        or hands its slot on if it was granted one in the meantime."""
+        with self._lock:
+            if not waiter.granted:
+                self._waiters.remove(waiter)
+                return
+        self.release()
+
+    def _expired(self) -> DeadlineExceeded:
+        """Counts a waiter that gave up at its deadline and returns the error to raise."""
+        count_dropped(self.name, "expired")
+        return DeadlineExceeded(f"Deadline passed while queued for {self.name}")
+
+    def release(self) -> None:
+        """Frees a slot, handing it to the longest waiting request if there is one."""
+        if not self.concurrency:
+            return
+        with self._lock:
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.granted = True  # the slot changes hands, running stays the same
+                waiter.notify()
+            else:
+                self.running -= 1
+
+    def acquire(self) -> None:
+        """Blocks until the calling request holds a slot. Call release() once it is done."""
+        if not self.concurrency:
+            return
+        event = Event()
+        waiter = self._enter(event.set)
+        if waiter is None:
+            return
+        expires = deadline()
+        with stage("admission_wait"):
+            timeout = None if expires is None else max(0.0, expires - monotonic())
+            if event.wait(timeout):
+                return
+        self._give_up(waiter)
+        raise self._expired()
+
+    @contextmanager
+    def admit(self) -> Iterator[None]:
+        """Context manager holding a slot for the enclosed block."""
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def admit_async(self) -> AsyncIterator[None]:
+        """Context manager holding a slot for the enclosed block of a coroutine. Waiting for
+        the slot doesn't block the event loop."""
+        if not self.concurrency:
+            yield
+            return
+        loop = asyncio.get_running_loop()
+        granted: asyncio.Future = loop.create_future()
+
+        def resolve() -> None:
+            if not granted.done():
+                granted.set_result(None)
+
+        waiter = self._enter(lambda: loop.call_soon_threadsafe(resolve))
+        if waiter is not None:
+            expires = deadline()
+            try:
+                with stage("admission_wait"):
+                    await asyncio.wait_for(
+                        asyncio.shield(granted),
+                        None if expires is None else max(0.0, expires - monotonic()),
+                    )
+            except asyncio.TimeoutError:
+                # Timers may fire a little before expires: the waiter has given up either way
+                self._give_up(waiter)
+                raise self._expired() from None
+            except asyncio.CancelledError:
+                self._give_up(waiter)
+                raise
+        try:
+            yield
+        finally:
+            self.release()
+
+
+def admission_queue(name: str) -> AdmissionQueue:
+    """Returns a queue sized by the ADMISSION_CONCURRENCY and ADMISSION_QUEUE_SIZE settings."""
+    return AdmissionQueue(
+        name, get_int("ADMISSION_CONCURRENCY"), get_int("ADMISSION_QUEUE_SIZE")
+    )
+
+
+admission_queues: Dict[str, AdmissionQueue] = {  # pylint: disable=invalid-name
+    name: admission_queue(name)
+    for name in (
+        "predict",
+        "predict_batch",
+        "background_removal",
+        "background_removal_predict",
+    )
+}
@@ -0,0 +1,130 @@
+"""This module implements the DebugProfile class and the request hooks it profiles through."""
+import hmac
+from flask import Response, g, request
+from flask_restx import Resource, inputs, reqparse
+from ml_rest_api.api.restx import api, blueprint
+from ml_rest_api.profiling import (
+    PROFILE_MODES,
+    ProfileBusy,
+    ProfileSession,
+    finish_request,
+    profile,
+    start_request,
+)
+from ml_rest_api.settings import get_bool, get_float, get_value
+
+TOKEN_HEADER = "X-Debug-Token"
+
+profile_parser = reqparse.RequestParser()
+profile_parser.add_argument(
+    "mode",
+    location="args",
+    choices=PROFILE_MODES,
+    default="sample",
+    help="sample: stacks of every thread, as collapsed stacks for flame graphs. cprofile: "
+    "every call on the requests' own threads, as a pstats table",
+)
+profile_parser.add_argument(
+    "requests",
+    location="args",
+    type=inputs.natural,
+    default=0,
+    help="Stop once this many requests have completed (0 for a time window only)",
+)
+profile_parser.add_argument(
+    "seconds",
+    location="args",
+    type=float,
+    help="Stop after this many seconds (by default 10, or DEBUG_PROFILE_MAX_SECONDS with "
+    "requests), at most DEBUG_PROFILE_MAX_SECONDS",
+)
+profile_parser.add_argument(
+    "interval_ms",
+    location="args",
+    type=inputs.int_range(1, 1000),
+    default=10,
+    help="Sampling period",
+)
+profile_parser.add_argument(
+    "idle",
+    location="args",
+    type=inputs.boolean,
+    default=False,
+    help="Also sample threads waiting for work",
+)
+profile_parser.add_argument(
+    "tracemalloc",
+    location="args",
+    type=inputs.boolean,
+    default=False,
+    help="Also report the largest allocations made during the profile, by line",
+)
+profile_parser.add_argument(
+    "format",
+    location="args",
+    choices=("json", "text"),
+    default="json",
+    help="text returns the collapsed stacks or the pstats table alone",
+)
+
+ns = api.namespace(
+    "debug",
+    description="Diagnostics of the worker serving the request (see DEBUG_PROFILE).",
+)
+
+
+@blueprint.before_request
+def start_request_profile() -> None:
+    """Runs the request under cProfile while a cprofile session is active."""
+    request_profile = start_request()
+    if request_profile is not None:
+        g.request_profile = request_profile
+
+
+@blueprint.teardown_request
+def finish_request_profile(_exception) -> None:
+    """Adds the request's profile, if it has one, to the active session."""
+    request_profile = g.pop("request_profile", None)
+    if request_profile is not None:
+        finish_request(request_profile)
+
+
+@ns.route("/profile")
+class DebugProfile(Resource):
+    """Implements the /debug/profile POST method."""
+
+    @staticmethod
+    @ns.expect(profile_parser)
+    @ns.doc(
+        responses={
+            200: "Success",
+            400: "Input Validation Error",
+            403: "Disabled",
+            409: "Already Profiling",
+        }
+    )
+    def post():
+        """
+        Profiles the worker serving this request over its next requests or a time window,
+        then returns the profile
+        """
+        if not get_bool("DEBUG_PROFILE"):
+            return {"message": "Profiling is disabled (see DEBUG_PROFILE)"}, 403
+        token = str(get_value("DEBUG_PROFILE_TOKEN") or "")
+        if token and not hmac.compare_digest(
+            request.headers.get(TOKEN_HEADER, ""), token
+        ):
+            return {"message": f"Missing or invalid {TOKEN_HEADER} header"}, 403
+        args = profile_parser.parse_args()
+        max_seconds = get_float("DEBUG_PROFILE_MAX_SECONDS")
+        seconds = args["seconds"] or (max_seconds if args["requests"] else 10)
+        session = ProfileSession(
+            args["mode"], args["interval_ms"] / 1000, args["idle"], args["tracemalloc"]
+        )
+        try:
+            profile(session, args["requests"], max(0.0, min(seconds, max_seconds)))
+        except ProfileBusy as exception:
+            return {"message": str(exception)}, 409
+        if args["format"] == "text":
+            return Response(session.text(), mimetype="text/plain")
+        return session.report(), 200
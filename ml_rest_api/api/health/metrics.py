@@ -0,0 +1,190 @@
+"""This module implements the HealthMetrics class and the request hooks that feed its metrics."""
+from threading import Lock
+from time import perf_counter
+from typing import Dict
+from flask import Response, g, request
+from flask_restx import Resource
+from ml_rest_api.admission import admission_queues, dropped_stats
+from ml_rest_api.api.restx import api, blueprint
+from ml_rest_api.metrics import (
+    REQUEST_SECONDS,
+    STAGE_SECONDS,
+    CallbackMetric,
+    LabelValuesType,
+    metrics_registry,
+    render,
+    start_recording,
+    stop_recording,
+)
+from ml_rest_api.model_registry import model_registry
+from ml_rest_api.rembg_sessions import rembg_session_pool
+from ml_rest_api.request_logging import (
+    REQUEST_ID_HEADER,
+    dropped_records,
+    log_request,
+    start_request_log,
+    stop_request_log,
+)
+from ml_rest_api.result_cache import prediction_cache, segmentation_cache
+from ml_rest_api.settings import get_bool
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+CACHE_COUNTERS = ("hits", "misses", "coalesced", "evictions", "expirations")
+
+_in_flight: int = 0  # pylint: disable=invalid-name
+_in_flight_lock = Lock()
+
+
+def endpoint_label() -> str:
+    """Returns the route of the current request (e.g. /api/model/predict), which unlike the
+    path doesn't include parameters such as a file name."""
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+
+def count_in_flight(delta: int) -> None:
+    """Adds to the number of requests in flight."""
+    global _in_flight  # pylint: disable=global-statement,invalid-name
+    with _in_flight_lock:
+        _in_flight += delta
+
+
+@blueprint.before_request
+def start_request_metrics() -> None:
+    """Starts timing the request and its stages, and tags its log records with its ID."""
+    count_in_flight(1)
+    g.metrics_start = perf_counter()
+    g.metrics_stages = start_recording()
+    g.request_id = start_request_log(
+        endpoint_label(), request.headers.get(REQUEST_ID_HEADER)
+    )
+
+
+@blueprint.after_request
+def record_request_metrics(response: Response) -> Response:
+    """Records the request duration and the time spent in each stage once the response has
+    been sent in full: a streamed response is still running stages at this point, and logs
+    it. With SERVER_TIMING, also returns the stage timings in a Server-Timing header."""
+    start, recorder = g.metrics_start, g.metrics_stages
+    endpoint, status = endpoint_label(), str(response.status_code)
+    response.headers[REQUEST_ID_HEADER] = g.request_id
+    if get_bool("SERVER_TIMING") and recorder.seconds:
+        # Stages still running while a streamed response is sent are not included
+        response.headers["Server-Timing"] = ", ".join(
+            f"{stage};dur={seconds * 1000:.3f}"
+            for stage, seconds in recorder.seconds.items()
+        )
+
+    def record() -> None:
+        stop_recording()
+        elapsed = perf_counter() - start
+        REQUEST_SECONDS.observe(elapsed, endpoint, status)
+        for stage, seconds in recorder.seconds.items():
+            STAGE_SECONDS.observe(seconds, stage, endpoint, status)
+        log_request(endpoint, response.status_code, elapsed, recorder.seconds)
+        stop_request_log()
+        count_in_flight(-1)
+
+    response.call_on_close(record)
+    return response
+
+
+def readiness() -> Dict[LabelValuesType, float]:
+    """Returns 1 for each component that is ready (loaded and warmed up), 0 otherwise."""
+    return {
+        ("model",): float(model_registry.ready()),
+        ("rembg",): float(rembg_session_pool.ready()),
+    }
+
+
+def cache_stats(kind: str) -> Dict[LabelValuesType, float]:
+    """Returns the result cache counters (kind "counter") or sizes (kind "gauge")."""
+    samples: Dict[LabelValuesType, float] = {}
+    for cache_name, cache in (
+        ("prediction", prediction_cache),
+        ("segmentation", segmentation_cache),
+    ):
+        for key, value in cache.stats().items():
+            if (key in CACHE_COUNTERS) == (kind == "counter"):
+                samples[(cache_name, key)] = value
+    return samples
+
+
+def admission_stats() -> Dict[LabelValuesType, float]:
+    """Returns the number of requests running and queued in each admission queue."""
+    return {
+        (name, measure): value
+        for name, queue in admission_queues.items()
+        for measure, value in queue.stats().items()
+    }
+
+
+metrics_registry.extend(
+    [
+        CallbackMetric(
+            "ml_rest_api_requests_in_flight",
+            "Requests being handled by this worker",
+            "gauge",
+            (),
+            lambda: {(): _in_flight},
+        ),
+        CallbackMetric(
+            "ml_rest_api_ready",
+            "Whether a component is loaded and warmed up",
+            "gauge",
+            ("component",),
+            readiness,
+        ),
+        CallbackMetric(
+            "ml_rest_api_cache_events_total",
+            "Result cache lookups and removals",
+            "counter",
+            ("cache", "event"),
+            lambda: cache_stats("counter"),
+        ),
+        CallbackMetric(
+            "ml_rest_api_cache_size",
+            "Result cache entries and size_bytes",
+            "gauge",
+            ("cache", "measure"),
+            lambda: cache_stats("gauge"),
+        ),
+        CallbackMetric(
+            "ml_rest_api_admission_requests",
+            "Requests running and queued per admission queue",
+            "gauge",
+            ("queue", "measure"),
+            admission_stats,
+        ),
+        CallbackMetric(
+            "ml_rest_api_requests_dropped_total",
+            "Requests shed because a queue was full or expired while queued",
+            "counter",
+            ("queue", "reason"),
+            dropped_stats,
+        ),
+        CallbackMetric(
+            "ml_rest_api_log_records_dropped_total",
+            "Log records dropped because the logging queue was full",
+            "counter",
+            (),
+            lambda: {(): dropped_records()},
+        ),
+    ]
+)
+
+
+@api.default_namespace.route("/metrics")
+class HealthMetrics(Resource):
+    """Implements the /metrics GET method."""
+
+    @staticmethod
+    @api.doc(
+        responses={
+            200: "Success",
+        }
+    )
+    def get() -> Response:
+        """
+        Returns the metrics of the worker that serves the request, in Prometheus text format
+        """
+        return Response(render(), content_type=PROMETHEUS_CONTENT_TYPE)
@@ -1,7 +1,27 @@
 """This module implements the HealthReadiness class."""
 from flask_restx import Resource
 from ml_rest_api.api.restx import api, FlaskApiReturnType
-from ml_rest_api.ml_trained_model.wrapper import trained_model_wrapper
+from ml_rest_api.model_registry import model_registry
+from ml_rest_api.rembg_sessions import rembg_session_pool
+from ml_rest_api.thread_budget import thread_report
+
+
+def readiness_report() -> FlaskApiReturnType:
+    """Returns the readiness status, the warmup of each component and the threads of each
+    pool, with 200 if every component is ready or 503 otherwise."""
+    _ready = model_registry.ready() and rembg_session_pool.ready()
+    return {
+        "Ready": _ready,
+        "warmup": {
+            "model": model_registry.default_wrapper.warmup.report(),
+            "models": {
+                name: entry.wrapper.warmup.report()
+                for name, entry in list(model_registry.entries.items())
+            },
+            "rembg": rembg_session_pool.warmup.report(),
+        },
+        "threads": thread_report(),
+    }, 200 if _ready else 503
 
 
 @api.default_namespace.route("/readiness")
@@ -17,7 +37,7 @@ class HealthReadiness(Resource):
     )
     def get() -> FlaskApiReturnType:
         """
-        Returns readiness status
+        Returns readiness status: ready once the model and the rembg sessions are loaded and
+        warmed up
         """
-        _ready = trained_model_wrapper.ready()
-        return {"Ready": _ready}, 200 if _ready else 503
+        return readiness_report()
@@ -1,21 +1,59 @@
 """This module implements the SegmentationMasking and ModelPredict classes."""
+from typing import BinaryIO, Dict, Optional
 from flask import request, send_file, jsonify
-from flask_restx import Resource, reqparse
+from flask_restx import Resource, inputs, reqparse
 from PIL import Image
-import io
-import os
-import tempfile
-from typing import Dict
 from werkzeug.datastructures import FileStorage
-from ml_rest_api.api.restx import api
-from ml_rest_api.ml_trained_model.ml_trained_model import full_path
+from ml_rest_api.admission import Overloaded, admission_queues
+from ml_rest_api.api.restx import api, MLRestAPINotReadyException
+from ml_rest_api.executors import encode_executor
+from ml_rest_api.imaging import decode_full
+from ml_rest_api.metrics import background_stage, stage
 from ml_rest_api.ml_trained_model.wrapper import trained_model_wrapper
-from rembg import remove
+from ml_rest_api.model_registry import model_registry
+from ml_rest_api.rembg_sessions import rembg_session_pool
+from ml_rest_api.result_cache import cache_key, prediction_cache, segmentation_cache
+from ml_rest_api.result_store import result_store
+from ml_rest_api.settings import get_float, get_int
 
 # Define the request parsers
 upload_parser = reqparse.RequestParser()
-upload_parser.add_argument('file', location='files', type=FileStorage, required=True)
-upload_parser.add_argument('classifiers', required=True, action='append', help="['battery', 'biological', 'cardboard', 'clothes', 'glass', 'metal', 'paper','plastic','shoes','trash']")
+upload_parser.add_argument("file", location="files", type=FileStorage, required=True)
+upload_parser.add_argument(
+    "classifiers",
+    required=True,
+    action="append",
+    help="['battery', 'biological', 'cardboard', 'clothes', 'glass', 'metal', 'paper','plastic','shoes','trash']",
+)
+upload_parser.add_argument(
+    "rembg_model",
+    choices=rembg_session_pool.model_names,
+    default=rembg_session_pool.default_model,
+    help="Lighter models (e.g. u2netp, silueta) trade quality for speed",
+)
+upload_parser.add_argument(
+    "max_resolution",
+    type=inputs.natural,
+    default=get_int("REMBG_MAX_RESOLUTION"),
+    help="Compute the mask on a copy scaled down to this many pixels per side, then scale "
+    "it up to the image's size (0 computes it at full size)",
+)
+upload_parser.add_argument(
+    "refine_edges",
+    type=inputs.boolean,
+    default=False,
+    help="Smooth the mask's edges before applying it",
+)
+upload_parser.add_argument(
+    "return_processed_image",
+    type=inputs.boolean,
+    default=True,
+    help="Set to false to skip encoding the processed image and its download URL",
+)
+upload_parser.add_argument(
+    "model",
+    help="Name of the model to use (see /model/registry), the default model if omitted",
+)
 
 ns = api.namespace(
     "model",
@@ -23,6 +61,23 @@ ns = api.namespace(
     validate=bool(trained_model_wrapper.sample()),
 )
 
+
+def save_processed_image(image: Image.Image, endpoint: str) -> Optional[str]:
+    """Stores the image as a PNG for download and returns its entry name. The PNG is encoded
+    on the encode pool, off the response path; a download that arrives before it is done
+    waits for it. Returns None if the encode pool is full, since the image is optional.
+    """
+
+    def write_png(result_file: BinaryIO) -> None:
+        with background_stage("png_encode", endpoint):
+            image.save(result_file, format="PNG")
+
+    try:
+        return result_store.save_in_background(write_png, encode_executor)
+    except Overloaded:
+        return None
+
+
 @ns.route("/background_removal_predict")
 class BackgroundRemovalPredict(Resource):
     """Implements the /model/background_removal_predict POST method."""
@@ -32,64 +87,105 @@ class BackgroundRemovalPredict(Resource):
         responses={
             200: "Success",
             400: "Input Validation Error",
+            413: "Upload Too Large",
             500: "Internal Server Error",
+            503: "Overloaded",
+            504: "Deadline Exceeded",
         }
     )
     def post(self):
         """
         Removes the background of the image and returns a prediction using the model.
         """
-        if 'file' not in request.files:
-            return {'error': 'No file part in request'}, 400
+        with stage("upload_read"):  # request.files receives and parses the upload
+            if "file" not in request.files:
+                return {"error": "No file part in request"}, 400
 
-        file = request.files['file']
-        if file.filename == '':
-            return {'error': 'No selected file'}, 400
+            file = request.files["file"]
+            if file.filename == "":
+                return {"error": "No selected file"}, 400
+            upload = file.stream  # decoded from the request's buffer
 
-        img_bytes = file.read()
-        input_image = Image.open(io.BytesIO(img_bytes)).convert("RGBA")
+        args = upload_parser.parse_args()
+        session = rembg_session_pool.get(args["rembg_model"])
+        if session is None:
+            raise MLRestAPINotReadyException()
 
-        # Use rembg to remove the background
-        output_image = remove(input_image)
+        queue = admission_queues["background_removal_predict"]
+        # Everything that changes the processed image, and so the prediction
+        rembg_params = (
+            args["rembg_model"],
+            args["max_resolution"],
+            args["refine_edges"],
+        )
 
-        # Save the result image temporarily
-        result_file = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
-        result_file.close()
+        def remove_background() -> Image.Image:
+            with queue.admit():
+                return rembg_session_pool.remove(
+                    decode_full(upload),
+                    session,
+                    args["max_resolution"],
+                    args["refine_edges"],
+                )
 
-        output_image.save(result_file.name, format="PNG")
+        # Use rembg to remove the background, unless this image was processed recently
+        output_image = segmentation_cache.get_or_compute(
+            cache_key(upload, *rembg_params), remove_background
+        )
 
-        # Ensure the correct filename with .png extension
-        original_filename = file.filename
-        base_filename = os.path.splitext(original_filename)[0]
-        download_filename = f"bg_removed_{base_filename}.png"
+        # Perform prediction on the processed image straight from memory: the RGBA output of
+        # remove() is converted to RGB and resized by the model's preprocessing, no PNG round trip
+        model_dict: Dict = {"image": output_image, "classifiers": args["classifiers"]}
+        with model_registry.use(args["model"]) as model:
 
-        # Save the processed image for prediction
-        temp_file = full_path("temp/upload.png")
-        output_image.save(temp_file, format="PNG")
+            def predict() -> Dict:
+                with queue.admit():
+                    return model.wrapper.run(model_dict)
 
-        # Perform prediction using the processed image
-        args = upload_parser.parse_args()
-        model_dict: Dict = {
-            "image": temp_file,
-            "classifiers": args['classifiers']
-        }
-        prediction_result = trained_model_wrapper.run(model_dict)
+            prediction_result = prediction_cache.get_or_compute(
+                cache_key(upload, args["classifiers"], *rembg_params, model.cache_id),
+                predict,
+            )
+
+        response = {"prediction": prediction_result}
+        if args["return_processed_image"]:
+            result_name = save_processed_image(output_image, request.url_rule.rule)
+            if result_name is not None:
+                response["processed_image_url"] = (
+                    request.host_url
+                    + "api/model/download_processed_image/"
+                    + result_name
+                )
+        return jsonify(response)
 
-        return jsonify({
-            'prediction': prediction_result,
-            'processed_image_url': request.host_url + 'api/model/download_processed_image/' + os.path.basename(result_file.name)
-        })
 
 @ns.route("/download_processed_image/<filename>")
 class DownloadProcessedImage(Resource):
     """Serves the processed image for download."""
 
+    @ns.doc(
+        responses={
+            200: "Success",
+            304: "Not Modified",
+            404: "File not found",
+        }
+    )
     def get(self, filename):
         """
-        Returns the processed image file.
+        Returns the processed image file. Supports If-None-Match and Range requests.
         """
-        file_path = os.path.join(tempfile.gettempdir(), filename)
-        if os.path.exists(file_path):
-            return send_file(file_path, mimetype='image/png', as_attachment=True, download_name=filename)
-        else:
-            return {'error': 'File not found'}, 404
\ No newline at end of file
+        result = result_store.get(
+            filename, wait=get_float("RESULT_STORE_PENDING_WAIT_SECONDS")
+        )
+        if result is None:
+            return {"error": "File not found"}, 404
+        # send_file streams the file and answers conditional requests with 304
+        return send_file(
+            result.path,
+            mimetype="image/png",
+            as_attachment=True,
+            download_name=result.name,
+            etag=result.name,
+            conditional=True,
+            max_age=int(result_store.ttl),
+        )
@@ -1,24 +1,28 @@
 """This module implements the ModelPredict class."""
-import json
-from typing import Type, Dict
-import uuid;
-from aniso8601 import parse_date, parse_datetime
+from typing import Dict
 from flask import request
-from flask_restx import Resource, Model, fields, reqparse
-from ml_rest_api.api.restx import api, FlaskApiReturnType, MLRestAPINotReadyException
-from ml_rest_api.ml_trained_model.wrapper import trained_model_wrapper
-from ml_rest_api.ml_trained_model.ml_trained_model import full_path
+from flask_restx import Resource, reqparse
 from werkzeug.datastructures import FileStorage
-import os;
+from ml_rest_api.admission import admission_queues
+from ml_rest_api.api.restx import api
+from ml_rest_api.metrics import stage
+from ml_rest_api.ml_trained_model.wrapper import trained_model_wrapper
+from ml_rest_api.model_registry import model_registry
+from ml_rest_api.result_cache import cache_key, prediction_cache
 
-"""
-This will be used to validate input and automatically generate the Swagger prototype.
-"""
+# Define the request parser, which validates the input and generates the Swagger documentation
 upload_parser = reqparse.RequestParser()
-upload_parser.add_argument('file', location='files',
-                           type=FileStorage, required=True)
-upload_parser.add_argument('classifiers',
-                           required=True, action='append', help="['cardboard', 'glass', 'metal', 'paper','plastic', 'trash']")
+upload_parser.add_argument("file", location="files", type=FileStorage, required=True)
+upload_parser.add_argument(
+    "classifiers",
+    required=True,
+    action="append",
+    help="['cardboard', 'glass', 'metal', 'paper','plastic', 'trash']",
+)
+upload_parser.add_argument(
+    "model",
+    help="Name of the model to use (see /model/registry), the default model if omitted",
+)
 
 
 ns = api.namespace(  # pylint: disable=invalid-name
@@ -38,8 +42,10 @@ class ModelPredict(Resource):
         responses={
             200: "Success",
             400: "Input Validation Error",
+            413: "Upload Too Large",
             500: "Internal Server Error",
-            503: "Server Not Ready",
+            503: "Server Not Ready or Overloaded",
+            504: "Deadline Exceeded",
         }
     )
     def post(self):
@@ -48,31 +54,32 @@ class ModelPredict(Resource):
         """
         # if not trained_model_wrapper.ready():
         #     raise MLRestAPINotReadyException()
-        if 'file' not in request.files:
-            return { 'error': 'No file part in request' }, 400
+        with stage("upload_read"):  # request.files receives and parses the upload
+            if "file" not in request.files:
+                return {"error": "No file part in request"}, 400
+
+            if request.files["file"].filename == "":
+                return {"message": "No selected file"}, 400
 
-        if request.files['file'].filename == '':
-            return { "message": 'No selected file'}, 400
+            upload = request.files["file"].stream
+        args = upload_parser.parse_args()
+        model_dict: Dict = {
+            # The upload is decoded from the request's buffer, on disk if large (see
+            # SpooledRequest)
+            "image": upload,
+            "classifiers": args["classifiers"],
+        }
+        with model_registry.use(args["model"]) as model:
 
-        filename = f"{uuid.uuid4()}.jpg"
-        temp_file = full_path(f"temp/{filename}")
-        file = request.files['file']
-        if file.filename == '':
-            return { 'error': 'No selected file' }, 400
-        img_bytes = file.read()
-        with open(temp_file, mode="wb") as jpg:
-            jpg.write(img_bytes)
-        
-        try:
-            args = upload_parser.parse_args()
-            model_dict: Dict = {
-                "image": temp_file,
-                "classifiers": args['classifiers']
-            }
-            ret = trained_model_wrapper.run(model_dict)
-        finally:
-            # Ensure the temporary file is deleted even if an error occurs
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
+            def predict() -> Dict:
+                # Cache hits don't queue: only the requests that run the model do
+                with admission_queues["predict"].admit():
+                    return model.wrapper.run(model_dict)
 
-        return ret, 200
+            return (
+                prediction_cache.get_or_compute(
+                    cache_key(upload, args["classifiers"], model.cache_id),
+                    predict,
+                ),
+                200,
+            )
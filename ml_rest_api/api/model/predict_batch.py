@@ -0,0 +1,224 @@
+"""This module implements the ModelPredictBatch class."""
+import json
+import os
+import tarfile
+import zipfile
+from tempfile import SpooledTemporaryFile
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+from flask import Response, request, stream_with_context
+from flask_restx import Resource, inputs
+from werkzeug.datastructures import FileStorage
+from ml_rest_api.admission import admission_queues
+from ml_rest_api.api.model.predict import ns, upload_parser
+from ml_rest_api.executors import decode_executor
+from ml_rest_api.metrics import stage
+from ml_rest_api.model_registry import model_registry
+from ml_rest_api.settings import get_int
+from ml_rest_api.uploads import max_upload_bytes, spool_bytes
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif", ".tif", ".tiff")
+COPY_CHUNK_BYTES = 64 * 1024
+
+# Same semantics as /model/predict, but many files (or one archive) instead of one file
+batch_upload_parser = upload_parser.copy()
+batch_upload_parser.remove_argument("file")
+batch_upload_parser.add_argument(
+    "files", location="files", type=FileStorage, action="append"
+)
+batch_upload_parser.add_argument(
+    "archive",
+    location="files",
+    type=FileStorage,
+    help="A zip or tar archive of images, as an alternative to files",
+)
+batch_upload_parser.add_argument(
+    "stream",
+    type=inputs.boolean,
+    default=False,
+    help="Stream one NDJSON line per image as soon as its batch is done",
+)
+
+
+def is_image_name(name: str) -> bool:
+    """Returns whether an archive member looks like an image (and not e.g. macOS metadata)."""
+    basename = os.path.basename(name)
+    return (
+        not basename.startswith(".")
+        and "__MACOSX" not in name
+        and basename.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+class ArchiveSpooler:
+    """Copies archive members, one at a time, into buffers that move to temporary files beyond
+    UPLOAD_SPOOL_MB (like uploaded files), counting the bytes they expand to so that a small
+    archive can't expand into more than UPLOAD_MAX_MB in total."""
+
+    def __init__(self, max_bytes: Optional[int]) -> None:
+        """Starts with nothing spooled. max_bytes is the total limit, None for no limit."""
+        self.max_bytes = max_bytes
+        self.total = 0
+
+    def check(self, name: str, size: int) -> None:
+        """Raises ValueError if a member of the declared size would exceed the total limit."""
+        if self.max_bytes is not None and self.total + size > self.max_bytes:
+            raise ValueError(
+                f"{name} takes the archive over {self.max_bytes} bytes uncompressed"
+            )
+
+    def spool(self, name: str, member: IO[bytes]) -> IO[bytes]:
+        """Copies a member into a new buffer, rewound. Raises ValueError once the archive's
+        members add up to more than the limit, whatever size they declare."""
+        spooled = SpooledTemporaryFile(  # pylint: disable=consider-using-with
+            max_size=spool_bytes(), mode="rb+"
+        )
+        try:
+            while True:
+                chunk = member.read(COPY_CHUNK_BYTES)
+                if not chunk:
+                    break
+                self.check(name, len(chunk))
+                self.total += len(chunk)
+                spooled.write(chunk)
+        except Exception:
+            spooled.close()
+            raise
+        spooled.seek(0)
+        return spooled
+
+
+def named_result(filename: str, result: Dict) -> Dict:
+    """Returns a result with the name of its file, also in the error message of an image that
+    couldn't be read."""
+    if "error" in result:
+        return {"filename": filename, "error": f"{result['error']}: {filename}"}
+    return {"filename": filename, **result}
+
+
+def close_all(uploads: List[Tuple[str, IO[bytes]]]) -> None:
+    """Closes the buffers of spooled archive members."""
+    for _, upload in uploads:
+        upload.close()
+
+
+def read_archive(archive: FileStorage, max_images: int) -> List[Tuple[str, IO[bytes]]]:
+    """Returns (name, buffer) for each image in a zip or tar archive, in archive order. Only
+    one member is decompressed at a time, straight into its buffer."""
+    images: List[Tuple[str, IO[bytes]]] = []
+    spooler = ArchiveSpooler(max_upload_bytes())
+    try:
+        if zipfile.is_zipfile(archive.stream):
+            archive.stream.seek(0)
+            with zipfile.ZipFile(archive.stream) as zip_archive:
+                for info in zip_archive.infolist():
+                    if not info.is_dir() and is_image_name(info.filename):
+                        if len(images) == max_images:
+                            raise ValueError(
+                                f"More than {max_images} images in archive"
+                            )
+                        spooler.check(info.filename, info.file_size)
+                        with zip_archive.open(info) as member:
+                            images.append(
+                                (info.filename, spooler.spool(info.filename, member))
+                            )
+            return images
+        archive.stream.seek(0)
+        with tarfile.open(fileobj=archive.stream, mode="r:*") as tar_archive:
+            for tar_member in tar_archive:
+                if tar_member.isfile() and is_image_name(tar_member.name):
+                    if len(images) == max_images:
+                        raise ValueError(f"More than {max_images} images in archive")
+                    spooler.check(tar_member.name, tar_member.size)
+                    extracted = tar_archive.extractfile(tar_member)
+                    if extracted:
+                        images.append(
+                            (tar_member.name, spooler.spool(tar_member.name, extracted))
+                        )
+        return images
+    except Exception:
+        close_all(images)
+        raise
+
+
+@ns.route("/predict_batch")
+class ModelPredictBatch(Resource):
+    """Implements the /model/predict_batch POST method."""
+
+    @ns.expect(batch_upload_parser)
+    @ns.doc(
+        responses={
+            200: "Success",
+            400: "Input Validation Error",
+            413: "Upload Too Large",
+            500: "Internal Server Error",
+            503: "Overloaded",
+            504: "Deadline Exceeded",
+        }
+    )
+    def post(self):
+        """
+        Returns one prediction per uploaded image, running the images through the model in
+        batched forward passes.
+        """
+        max_images = get_int("PREDICT_BATCH_MAX_IMAGES")
+        uploads: List[Tuple[str, IO[bytes]]] = []
+        spooled: List[Tuple[str, IO[bytes]]] = []  # closed once the results are sent
+        with stage("upload_read"):  # parsing the arguments receives the upload
+            args = batch_upload_parser.parse_args()
+            if args["archive"]:
+                try:
+                    spooled = read_archive(args["archive"], max_images)
+                    uploads = list(spooled)
+                except (ValueError, zipfile.BadZipFile, tarfile.TarError) as exception:
+                    return {"error": f"Unreadable archive: {exception}"}, 400
+            for file in request.files.getlist("files"):
+                if file.filename != "":
+                    uploads.append((file.filename, file.stream))
+        if not uploads:
+            return {"error": "No files or archive in request"}, 400
+        if len(uploads) > max_images:
+            close_all(spooled)
+            return {"error": f"More than {max_images} images in request"}, 400
+
+        model_inputs: List[Dict] = [
+            {"image": upload, "classifiers": args["classifiers"]}
+            for _, upload in uploads
+        ]
+        # All released once the results are sent, which a streamed response does after
+        # returning
+        queue = admission_queues["predict_batch"]
+        try:
+            queue.acquire()
+        except Exception:
+            close_all(spooled)
+            raise
+        try:
+            model = model_registry.acquire(args["model"])
+        except Exception:
+            queue.release()
+            close_all(spooled)
+            raise
+        results: Iterator[Dict] = model.wrapper.run_many(
+            model_inputs, executor=decode_executor
+        )
+        named_results = (
+            named_result(filename, result)
+            for (filename, _), result in zip(uploads, results)
+        )
+        if args["stream"]:
+            response = Response(
+                stream_with_context(
+                    json.dumps(result) + "\n" for result in named_results
+                ),
+                mimetype="application/x-ndjson",
+            )
+            response.call_on_close(lambda: model_registry.release(model))
+            response.call_on_close(queue.release)
+            response.call_on_close(lambda: close_all(spooled))
+            return response
+        try:
+            return {"predictions": list(named_results)}, 200
+        finally:
+            model_registry.release(model)
+            queue.release()
+            close_all(spooled)
@@ -0,0 +1,95 @@
+"""This module implements the ModelRegistryList and ModelRegistryItem classes."""
+from flask_restx import Resource, reqparse
+from ml_rest_api.api.model.predict import ns
+from ml_rest_api.api.restx import api, FlaskApiReturnType
+from ml_rest_api.model_registry import UnknownModelError, model_registry
+from ml_rest_api.settings import get_bool
+
+model_parser = reqparse.RequestParser()
+model_parser.add_argument(
+    "module",
+    location="json",
+    required=True,
+    help="Model module in ml_rest_api/ml_trained_model, e.g. ml_trained_model",
+)
+model_parser.add_argument(
+    "version",
+    location="json",
+    default="",
+    help="Model directory in MODEL_DIR, e.g. garbage_model_v2 (the module's default if empty)",
+)
+
+
+@api.errorhandler(UnknownModelError)
+def unknown_model_error_handler(exception) -> FlaskApiReturnType:
+    """Returns HTTP 400 for requests naming a model that isn't in the registry."""
+    return {
+        "message": "Input payload validation failed",
+        "errors": {"model": f"Unknown model: {exception.args[0]}"},
+    }, 400
+
+
+def admin_disabled() -> FlaskApiReturnType:
+    """Returns the error answering changes to the registry when MODEL_ADMIN is off."""
+    return {"message": "Changing the model registry is disabled (see MODEL_ADMIN)"}, 403
+
+
+@ns.route("/registry")
+class ModelRegistryList(Resource):
+    """Implements the /model/registry GET method."""
+
+    @staticmethod
+    @ns.doc(responses={200: "Success"})
+    def get() -> FlaskApiReturnType:
+        """
+        Lists the models served and loading, with their state and memory use
+        """
+        return model_registry.report(), 200
+
+
+@ns.route("/registry/<name>")
+class ModelRegistryItem(Resource):
+    """Implements the /model/registry/<name> PUT and DELETE methods."""
+
+    @staticmethod
+    @ns.expect(model_parser)
+    @ns.doc(
+        responses={
+            202: "Loading",
+            400: "Input Validation Error",
+            403: "Disabled",
+        }
+    )
+    def put(name: str) -> FlaskApiReturnType:
+        """
+        Loads a model under name in the background, and swaps it in for the model of that
+        name once it is warmed up
+        """
+        if not get_bool("MODEL_ADMIN"):
+            return admin_disabled()
+        args = model_parser.parse_args()
+        try:
+            model_registry.put(name, args["module"], args["version"] or "")
+        except ValueError as exception:
+            return {"message": str(exception)}, 400
+        return model_registry.report(), 202
+
+    @staticmethod
+    @ns.doc(
+        responses={
+            202: "Unloading",
+            400: "Input Validation Error",
+            403: "Disabled",
+        }
+    )
+    def delete(name: str) -> FlaskApiReturnType:
+        """
+        Stops serving the named model, and unloads it once the requests using it finish
+        """
+        if not get_bool("MODEL_ADMIN"):
+            return admin_disabled()
+        try:
+            model_registry.delete(name)
+        except ValueError as exception:
+            return {"message": str(exception)}, 400
+        return model_registry.report(), 202
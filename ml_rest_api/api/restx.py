@@ -1,9 +1,16 @@
 """Module that creates the Api object and declares default error handler."""
 from logging import Logger, getLogger
-from typing import Tuple, Dict
+from typing import Dict, Tuple
 from jsonschema import FormatChecker
-from flask import Blueprint
+from flask import Blueprint, request
 from flask_restx import Api
+from ml_rest_api.admission import (
+    DEADLINE_HEADER,
+    DeadlineExceeded,
+    Overloaded,
+    set_deadline,
+)
+from ml_rest_api.imaging import ImageTooLarge
 from ml_rest_api.settings import get_value
 
 
@@ -39,12 +46,40 @@ api = Api(  # pylint: disable=invalid-name
 
 
 @api.errorhandler(MLRestAPINotReadyException)
-def not_ready_error_handler() -> FlaskApiReturnType:
+def not_ready_error_handler(_exception) -> FlaskApiReturnType:
     """NOT READY error handler that returns HTTP 503 error."""
     log.exception("Server Not Ready")
     return {"message": "Server Not Ready"}, 503
 
 
+@blueprint.before_request
+def start_deadline() -> None:
+    """Sets the request's deadline from its X-Request-Timeout-Ms header."""
+    set_deadline(request.headers.get(DEADLINE_HEADER))
+
+
+@api.errorhandler(Overloaded)
+def overloaded_error_handler(exception) -> Tuple[Dict, int, Dict]:
+    """Returns HTTP 503 with a Retry-After header for requests shed by admission control."""
+    return (
+        {"message": str(exception)},
+        503,
+        {"Retry-After": str(exception.retry_after)},
+    )
+
+
+@api.errorhandler(DeadlineExceeded)
+def deadline_error_handler(exception) -> FlaskApiReturnType:
+    """Returns HTTP 504 for requests whose deadline passed before their work started."""
+    return {"message": str(exception)}, 504
+
+
+@api.errorhandler(ImageTooLarge)
+def image_too_large_error_handler(exception) -> FlaskApiReturnType:
+    """Returns HTTP 413 for images declaring more pixels than UPLOAD_MAX_PIXELS."""
+    return {"message": str(exception)}, 413
+
+
 @api.errorhandler
 def default_error_handler(exception) -> FlaskApiReturnType:
     """Default error handler that returns HTTP 500 error."""
@@ -1,34 +1,67 @@
 """This module implements the SegmentationMasking class."""
-from flask import request, send_file
-from flask_restx import Resource,  reqparse
-import PIL
-from PIL import Image
 import io
 import os
-from ml_rest_api.api.restx import api
-from ml_rest_api.ml_trained_model.ml_trained_model import full_path
-# from ml_rest_api.ml_trained_model.image_segmentation import init, run
+from flask import request, send_file
+from flask_restx import Resource, inputs, reqparse
+from PIL import Image
 from werkzeug.datastructures import FileStorage
-import matplotlib.pyplot as plt
-import tempfile
-import cv2
-import numpy as np
-
-from rembg import remove
-
-# Initialize the model
-from ml_rest_api.ml_trained_model.ml_trained_model import init as model_init
-model_init()
+from ml_rest_api.admission import admission_queues
+from ml_rest_api.api.restx import api, MLRestAPINotReadyException
+from ml_rest_api.imaging import decode_full
+from ml_rest_api.metrics import stage
+from ml_rest_api.output_formats import OUTPUT_FORMATS, encode_output
+from ml_rest_api.rembg_sessions import rembg_session_pool
+from ml_rest_api.result_cache import cache_key, segmentation_cache
+from ml_rest_api.settings import get_int
 
 
 upload_parser = reqparse.RequestParser()
-upload_parser.add_argument('file', location='files', type=FileStorage, required=True)
+upload_parser.add_argument("file", location="files", type=FileStorage, required=True)
+upload_parser.add_argument(
+    "rembg_model",
+    choices=rembg_session_pool.model_names,
+    default=rembg_session_pool.default_model,
+    help="Lighter models (e.g. u2netp, silueta) trade quality for speed",
+)
+upload_parser.add_argument(
+    "max_resolution",
+    type=inputs.natural,
+    default=get_int("REMBG_MAX_RESOLUTION"),
+    help="Compute the mask on a copy scaled down to this many pixels per side, then scale "
+    "it up to the image's size (0 computes it at full size)",
+)
+upload_parser.add_argument(
+    "refine_edges",
+    type=inputs.boolean,
+    default=False,
+    help="Smooth the mask's edges before applying it",
+)
+upload_parser.add_argument(
+    "output_format",
+    choices=OUTPUT_FORMATS,
+    default="png",
+    help="png, the mask alone as a 1-bit PNG (mask_png) or run-length encoded JSON "
+    "(mask_rle), a lossy webp, or a png cropped to the foreground (crop)",
+)
+upload_parser.add_argument(
+    "compression",
+    type=inputs.int_range(0, 9),
+    default=get_int("SEGMENTATION_COMPRESSION"),
+    help="From 0 (fastest) to 9 (smallest output)",
+)
+upload_parser.add_argument(
+    "quality",
+    type=inputs.int_range(1, 100),
+    default=get_int("SEGMENTATION_WEBP_QUALITY"),
+    help="Quality of webp outputs",
+)
 
 ns = api.namespace(
     "segmentation",
     description="Segmentation methods to detect objects in images.",
 )
 
+
 @ns.route("/background_removal")
 class SegmentationBackgroundRemoval(Resource):
     """Implements the /segmentation/background_removal POST method."""
@@ -38,35 +71,65 @@ class SegmentationBackgroundRemoval(Resource):
         responses={
             200: "Success",
             400: "Input Validation Error",
+            413: "Upload Too Large",
             500: "Internal Server Error",
+            503: "Overloaded",
+            504: "Deadline Exceeded",
         }
     )
     def post(self):
         """
         Returns image with background removed.
         """
-        if 'file' not in request.files:
-            return {'error': 'No file part in request'}, 400
+        with stage("upload_read"):  # request.files receives and parses the upload
+            if "file" not in request.files:
+                return {"error": "No file part in request"}, 400
+
+            file = request.files["file"]
+            if file.filename == "":
+                return {"error": "No selected file"}, 400
+            upload = file.stream  # decoded from the request's buffer
 
-        file = request.files['file']
-        if file.filename == '':
-            return {'error': 'No selected file'}, 400
-        
-        img_bytes = file.read()
-        input_image = Image.open(io.BytesIO(img_bytes)).convert("RGBA")
+        args = upload_parser.parse_args()
+        session = rembg_session_pool.get(args["rembg_model"])
+        if session is None:
+            raise MLRestAPINotReadyException()
 
-        # Use rembg to remove the background
-        output_image = remove(input_image)
+        def remove_background() -> Image.Image:
+            with admission_queues["background_removal"].admit():
+                return rembg_session_pool.remove(
+                    decode_full(upload),
+                    session,
+                    args["max_resolution"],
+                    args["refine_edges"],
+                )
 
-        # Save the result image temporarily
-        result_file = tempfile.NamedTemporaryFile(suffix='.png', delete=False)
-        result_file.close()
+        # Use rembg to remove the background, unless this image was processed recently
+        output_image = segmentation_cache.get_or_compute(
+            cache_key(
+                upload,
+                args["rembg_model"],
+                args["max_resolution"],
+                args["refine_edges"],
+            ),
+            remove_background,
+        )
 
-        output_image.save(result_file.name, format="PNG")
+        # Encode the result in memory, nothing is left behind in the tmp dir
+        output = encode_output(
+            output_image, args["output_format"], args["compression"], args["quality"]
+        )
 
-        # Ensure the correct filename with .png extension
+        # Ensure the correct filename with the output format's extension
         original_filename = file.filename
         base_filename = os.path.splitext(original_filename)[0]
-        download_filename = f"bg_removed_{base_filename}.png"
+        download_filename = f"bg_removed_{base_filename}{output.extension}"
 
-        return send_file(result_file.name, mimetype='image/png', as_attachment=True, download_name=download_filename)
+        response = send_file(
+            io.BytesIO(output.content),
+            mimetype=output.mimetype,
+            as_attachment=True,
+            download_name=download_filename,
+        )
+        response.headers.update(output.headers)
+        return response
@@ -2,20 +2,37 @@
 import os
 import warnings
 from logging import Logger, getLogger
-import logging.config
 from typing import List
-from flask import Flask, redirect
-from markupsafe import Markup
-from flask_wtf import CSRFProtect  # pylint: disable=unused-import
-from ml_rest_api.settings import get_value
-from ml_rest_api.ml_trained_model.wrapper import trained_model_wrapper
-from ml_rest_api.api.restx import blueprint
-import ml_rest_api.api.health.liveness  # pylint: disable=unused-import
-import ml_rest_api.api.health.readiness  # pylint: disable=unused-import
-import ml_rest_api.api.model.predict  # pylint: disable=unused-import
-import ml_rest_api.api.segmentation.background_removal  # pylint: disable=unused-import`
-import ml_rest_api.api.model.background_removal_prediction  # pylint: disable=unused-import`
-from flask_cors import CORS
+from ml_rest_api.startup import startup_timeline
+from ml_rest_api.thread_budget import limit_native_threads
+
+# Before NumPy and the libraries rembg uses are imported: their pools are sized on import
+limit_native_threads()
+
+# TensorFlow and rembg are not imported here: the model module and the rembg session pool
+# import them on first use, from their init threads
+with startup_timeline.phase("imports"):
+    # pylint: disable=wrong-import-position
+    from flask import Flask, redirect
+    from markupsafe import Markup
+    from flask_wtf import CSRFProtect  # pylint: disable=unused-import
+    from ml_rest_api.settings import get_bool, get_value
+    from ml_rest_api.model_registry import model_registry
+    from ml_rest_api.rembg_sessions import rembg_session_pool
+    from ml_rest_api.api.restx import blueprint
+    from ml_rest_api.output_formats import CROP_HEADERS
+    from ml_rest_api.request_logging import REQUEST_ID_HEADER, configure_logging
+    from ml_rest_api.uploads import SpooledRequest, max_upload_bytes
+    import ml_rest_api.api.health.liveness  # pylint: disable=unused-import
+    import ml_rest_api.api.health.readiness  # pylint: disable=unused-import
+    import ml_rest_api.api.health.metrics  # pylint: disable=unused-import
+    import ml_rest_api.api.model.predict  # pylint: disable=unused-import
+    import ml_rest_api.api.model.predict_batch  # pylint: disable=unused-import
+    import ml_rest_api.api.model.registry  # pylint: disable=unused-import
+    import ml_rest_api.api.segmentation.background_removal  # pylint: disable=unused-import
+    import ml_rest_api.api.model.background_removal_prediction  # pylint: disable=unused-import
+    import ml_rest_api.api.debug.profile  # pylint: disable=unused-import
+    from flask_cors import CORS
 
 IN_UWSGI: bool = True
 try:
@@ -38,22 +55,54 @@ def configure_app(flask_app: Flask) -> None:
     ]
     for key in flask_settings_to_apply:
         flask_app.config[key] = get_value(key)
+    # Larger requests are answered 413 without being received in full
+    flask_app.config["MAX_CONTENT_LENGTH"] = max_upload_bytes()
+    flask_app.request_class = SpooledRequest
     flask_app.config["SECRET_KEY"] = os.urandom(32)
 
 
 def initialize_app(flask_app: Flask) -> None:
-    """Initialises the app."""
-    configure_app(flask_app)
-    with warnings.catch_warnings():
-        # Temporarily suppressing a warning during registration of the Flask blueprint
-        warnings.filterwarnings(
-            "ignore", message="The setup method", category=UserWarning
+    """Initialises the app. The ML model and the rembg sessions are loaded exactly once, in
+    parallel background threads unless running under uWSGI or MULTITHREADED_INIT is off. With
+    PREFORK_INIT (see gunicorn_prefork.py), only what the workers can share is loaded, inline,
+    and initialize_worker() loads the rest in each worker."""
+    with startup_timeline.phase("configure_app"):
+        configure_app(flask_app)
+        with warnings.catch_warnings():
+            # Temporarily suppressing a warning during registration of the Flask blueprint
+            warnings.filterwarnings(
+                "ignore", message="The setup method", category=UserWarning
+            )
+            flask_app.register_blueprint(blueprint)
+    if get_bool("PREFORK_INIT"):
+        startup_timeline.initialise(
+            {
+                "model_preload": model_registry.preload,
+                "rembg_init": rembg_session_pool.init,
+            },
+            parallel=False,
+            wait=True,
         )
-        flask_app.register_blueprint(blueprint)
-    if get_value("MULTITHREADED_INIT") and not IN_UWSGI:
-        trained_model_wrapper.multithreaded_init()
-    else:
-        trained_model_wrapper.init()
+        return
+    parallel: bool = get_bool("MULTITHREADED_INIT") and not IN_UWSGI
+    startup_timeline.initialise(
+        {
+            "model_init": model_registry.init,
+            "rembg_init": rembg_session_pool.init,
+        },
+        parallel=parallel,
+        wait=not parallel,
+    )
+
+
+def initialize_worker() -> None:
+    """Loads the ML model in a worker process forked from a PREFORK_INIT master, in a
+    background thread (threads are fine once forked)."""
+    startup_timeline.initialise(
+        {"model_init": model_registry.init},
+        parallel=get_bool("MULTITHREADED_INIT"),
+        wait=not get_bool("MULTITHREADED_INIT"),
+    )
 
 
 def main() -> None:
@@ -70,13 +119,16 @@ def main() -> None:
 
 
 APP = Flask(__name__)
-logging.config.fileConfig(
-    os.path.normpath(os.path.join(os.path.dirname(__file__), "../logging.conf"))
-)
+configure_logging(queued=not IN_UWSGI)
 log: Logger = getLogger(__name__)
 
 # Enable CORS for specific origins
-cors = CORS(APP, resources={r"/api/*": {"origins": ["https://www.dwaste.live", "https://dwaste.live"]}})
+CORS_ORIGINS: List[str] = ["https://www.dwaste.live", "https://dwaste.live"]
+cors = CORS(
+    APP,
+    resources={r"/api/*": {"origins": CORS_ORIGINS}},
+    expose_headers=[*CROP_HEADERS, REQUEST_ID_HEADER],
+)
 
 
 initialize_app(APP)
@@ -0,0 +1,489 @@
+"""This module is the ASGI entry point: an alternative to ml_rest_api.app:APP for serving many
+slow uploads from one process, e.g.
+
+    gunicorn -k uvicorn.workers.UvicornWorker ml_rest_api.asgi:APP
+
+The image endpoints and the health probes are served by async handlers. Uploads are received on
+the event loop, without holding a thread per connection, and the CPU-bound work is dispatched to
+bounded executors: decoding to the decode pool, background removal (and inference when
+micro-batching is off) to the inference pool and output encoding to the encode pool. Micro-batched
+inference runs on the MicroBatcher's thread, which the handler awaits. Every other route (Swagger
+UI, /metrics, /model/predict_batch, downloads) is passed on to the Flask app.
+"""
+import asyncio
+import os
+from concurrent.futures import Executor
+from contextvars import copy_context
+from functools import partial, wraps
+from logging import Logger, getLogger
+from time import perf_counter
+from typing import (
+    Any,
+    Awaitable,
+    BinaryIO,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+from a2wsgi import WSGIMiddleware
+from flask_restx import inputs
+from PIL import Image
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.datastructures import FormData, UploadFile
+from starlette.formparsers import MultiPartParser
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route
+from werkzeug.exceptions import RequestEntityTooLarge
+from ml_rest_api.admission import (
+    DEADLINE_HEADER,
+    AdmissionQueue,
+    DeadlineExceeded,
+    Overloaded,
+    admission_queues,
+    set_deadline,
+)
+from ml_rest_api.app import APP as FLASK_APP, CORS_ORIGINS
+from ml_rest_api.api.health.metrics import count_in_flight
+from ml_rest_api.api.health.readiness import readiness_report
+from ml_rest_api.api.model.background_removal_prediction import save_processed_image
+from ml_rest_api.api.restx import MLRestAPINotReadyException
+from ml_rest_api.executors import decode_executor, encode_executor, inference_executor
+from ml_rest_api.imaging import ImageTooLarge, decode_full
+from ml_rest_api.metrics import (
+    REQUEST_SECONDS,
+    STAGE_SECONDS,
+    stage,
+    start_recording,
+    stop_recording,
+)
+from ml_rest_api.ml_trained_model.wrapper import TrainedModelWrapper
+from ml_rest_api.model_registry import UnknownModelError, model_registry
+from ml_rest_api.output_formats import CROP_HEADERS, OUTPUT_FORMATS, encode_output
+from ml_rest_api.rembg_sessions import rembg_session_pool
+from ml_rest_api.request_logging import (
+    REQUEST_ID_HEADER,
+    log_request,
+    start_request_log,
+    stop_request_log,
+)
+from ml_rest_api.result_cache import cache_key, prediction_cache, segmentation_cache
+from ml_rest_api.settings import get_bool, get_int, get_value
+from ml_rest_api.uploads import max_upload_bytes, spool_bytes
+
+T = TypeVar("T")
+MaskOptionsType = Tuple[int, bool]
+OutputOptionsType = Tuple[str, int, int]
+HandlerType = Callable[[Request], Awaitable[Response]]
+
+log: Logger = getLogger(__name__)
+
+# Uploaded files are kept in memory up to this size, then moved to a temporary file
+MultiPartParser.max_file_size = spool_bytes()
+
+
+class FieldError(ValueError):
+    """Raised when a form field of a request is invalid."""
+
+    def __init__(self, field: str, message: str) -> None:
+        """message is reported for the field like Flask-RESTX's help texts."""
+        super().__init__(f"{field}: {message}")
+        self.field = field
+        self.message = message
+
+
+class BoundedExecutor:
+    """Runs blocking calls on a thread pool from coroutines. At most as many calls as the pool
+    has threads are submitted at a time: the others wait on the event loop, where they cost no
+    thread, instead of piling up in the pool's queue."""
+
+    def __init__(self, executor: Executor, max_workers: int) -> None:
+        """Wraps an executor with max_workers threads."""
+        self.executor = executor
+        self.max_workers = max_workers
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def run(self, function: Callable[..., T], *args: Any) -> T:
+        """Calls function(*args) on the pool, in a copy of the current context so that its
+        stages are recorded, and returns its result."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+        async with self._semaphore:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, partial(copy_context().run, function, *args)
+            )
+
+
+decode_pool = BoundedExecutor(decode_executor, get_int("DECODE_THREADS"))
+inference_pool = BoundedExecutor(inference_executor, get_int("INFERENCE_THREADS"))
+encode_pool = BoundedExecutor(encode_executor, get_int("ENCODE_THREADS"))
+
+
+def error(status: int, message: str, **fields: Any) -> JSONResponse:
+    """Returns an error in the same shape as the Flask app's."""
+    return JSONResponse({"message": message, **fields}, status_code=status)
+
+
+def validation_error(field: str, help_text: str) -> JSONResponse:
+    """Returns a 400 error like those of Flask-RESTX's request parsers."""
+    return error(400, "Input payload validation failed", errors={field: help_text})
+
+
+def recorded(route: str) -> Callable[[HandlerType], HandlerType]:
+    """Decorator timing a handler and its stages into the same metrics and access log as the
+    Flask app's requests, tagging its log records with its X-Request-Id, setting its deadline
+    from the X-Request-Timeout-Ms header, and turning MLRestAPINotReadyException and
+    Overloaded into 503, DeadlineExceeded into 504, uploads that are too large into 413 and
+    any other exception into 500 errors."""
+
+    def decorator(handler: HandlerType) -> HandlerType:
+        @wraps(handler)
+        async def timed_handler(request: Request) -> Response:
+            count_in_flight(1)
+            start = perf_counter()
+            recorder = start_recording()
+            request_id = start_request_log(
+                route, request.headers.get(REQUEST_ID_HEADER)
+            )
+            set_deadline(request.headers.get(DEADLINE_HEADER))
+            try:
+                response = await handler(request)
+            except Overloaded as exception:
+                response = error(503, str(exception))
+                response.headers["Retry-After"] = str(exception.retry_after)
+            except DeadlineExceeded as exception:
+                response = error(504, str(exception))
+            except RequestEntityTooLarge as exception:
+                response = error(413, str(exception.description))
+            except ImageTooLarge as exception:
+                response = error(413, str(exception))
+            except MLRestAPINotReadyException:
+                log.exception("Server Not Ready")
+                response = error(503, "Server Not Ready")
+            except UnknownModelError as exception:
+                response = validation_error("model", f"Unknown model: {exception}")
+            except Exception as exception:  # pylint: disable=broad-except
+                log.exception(exception)
+                message = "An unhandled exception occurred"
+                response = error(
+                    500, str(exception) if get_value("FLASK_DEBUG") else message
+                )
+            finally:
+                stop_recording()
+                count_in_flight(-1)
+            status = str(response.status_code)
+            elapsed = perf_counter() - start
+            REQUEST_SECONDS.observe(elapsed, route, status)
+            for name, seconds in recorder.seconds.items():
+                STAGE_SECONDS.observe(seconds, name, route, status)
+            log_request(route, response.status_code, elapsed, recorder.seconds)
+            stop_request_log()
+            response.headers[REQUEST_ID_HEADER] = request_id
+            if get_bool("SERVER_TIMING") and recorder.seconds:
+                response.headers["Server-Timing"] = ", ".join(
+                    f"{name};dur={seconds * 1000:.3f}"
+                    for name, seconds in recorder.seconds.items()
+                )
+            return response
+
+        return timed_handler
+
+    return decorator
+
+
+async def receive_form(request: Request) -> FormData:
+    """Receives a multipart form, its files spooled to disk beyond UPLOAD_SPOOL_MB. Raises
+    RequestEntityTooLarge if the body is larger than UPLOAD_MAX_MB: before receiving it if the
+    request declares its length."""
+    max_bytes = max_upload_bytes()
+    length = request.headers.get("content-length", "")
+    if max_bytes and length.isdigit() and int(length) > max_bytes:
+        raise RequestEntityTooLarge()
+    form = await request.form()
+    if (
+        max_bytes
+        and sum(
+            value.size or 0
+            for _, value in form.multi_items()
+            if isinstance(value, UploadFile)
+        )
+        > max_bytes
+    ):
+        await form.close()
+        raise RequestEntityTooLarge()
+    return form
+
+
+def read_upload(form: FormData) -> Optional[UploadFile]:
+    """Returns the uploaded file, or None if there is none."""
+    file = form.get("file")
+    if not isinstance(file, UploadFile) or not file.filename:
+        return None
+    return file
+
+
+async def predict(
+    wrapper: TrainedModelWrapper, model_dict: Dict, queue: AdmissionQueue
+) -> Dict:
+    """Runs a model on one input once admitted by queue: preprocessing on the decode pool,
+    then inference through the micro-batcher (or on the inference pool if batching is off).
+    """
+    async with queue.admit_async():
+        if not wrapper.batcher:
+            return await inference_pool.run(wrapper.run, model_dict)
+        sample = await decode_pool.run(wrapper.preprocess, model_dict)
+        with stage("inference"):  # includes waiting for the batch to fill
+            row = await asyncio.wrap_future(wrapper.batcher.submit_nowait(sample))
+    return wrapper.postprocess(row, model_dict)
+
+
+async def cached_prediction(
+    model_name: Optional[str],
+    upload: BinaryIO,
+    model_dict: Dict,
+    queue: AdmissionQueue,
+    *key_parts: Any,
+) -> Dict:
+    """Returns the prediction of the registered model model_name (see predict()) for
+    model_dict, unless the upload was predicted recently with the same classifiers and
+    key_parts."""
+    with model_registry.use(model_name) as model:
+        key = await decode_pool.run(
+            cache_key, upload, model_dict["classifiers"], *key_parts, model.cache_id
+        )
+        return await prediction_cache.get_or_compute_async(
+            key, partial(predict, model.wrapper, model_dict, queue)
+        )
+
+
+async def remove_background(
+    upload: BinaryIO, model_name: str, options: MaskOptionsType, queue: AdmissionQueue
+) -> Image.Image:
+    """Removes the background of an image with the pool's session for model_name and the
+    mask options (see mask_options_of()) once admitted by queue, unless it was processed
+    recently."""
+    session = rembg_session_pool.get(model_name)
+    if session is None:
+        raise MLRestAPINotReadyException()
+
+    async def compute() -> Image.Image:
+        async with queue.admit_async():
+            image = await decode_pool.run(decode_full, upload)
+            return await inference_pool.run(
+                rembg_session_pool.remove, image, session, *options
+            )
+
+    key = await decode_pool.run(cache_key, upload, model_name, *options)
+    return await segmentation_cache.get_or_compute_async(key, compute)
+
+
+def rembg_model_of(form: FormData) -> Optional[str]:
+    """Returns the requested rembg model, the default one if none is, or None if the request
+    names an unknown model."""
+    model_name = str(form.get("rembg_model") or rembg_session_pool.default_model)
+    return model_name if model_name in rembg_session_pool.model_names else None
+
+
+def mask_options_of(form: FormData) -> MaskOptionsType:
+    """Returns the requested max_resolution and refine_edges options of background removal.
+    Raises FieldError if one is invalid."""
+    try:
+        max_resolution = inputs.natural(
+            form.get("max_resolution", get_int("REMBG_MAX_RESOLUTION"))
+        )
+    except ValueError as exception:
+        raise FieldError("max_resolution", str(exception)) from exception
+    try:
+        refine_edges = inputs.boolean(form.get("refine_edges", False))
+    except ValueError as exception:
+        raise FieldError("refine_edges", str(exception)) from exception
+    return max_resolution, refine_edges
+
+
+def output_options_of(form: FormData) -> OutputOptionsType:
+    """Returns the requested output_format, compression and quality of background removal
+    (see encode_output()). Raises FieldError if one is invalid."""
+    output_format = str(form.get("output_format") or "png")
+    if output_format not in OUTPUT_FORMATS:
+        raise FieldError("output_format", f"Must be one of {', '.join(OUTPUT_FORMATS)}")
+    try:
+        compression = inputs.int_range(0, 9)(
+            form.get("compression", get_int("SEGMENTATION_COMPRESSION"))
+        )
+    except ValueError as exception:
+        raise FieldError("compression", str(exception)) from exception
+    try:
+        quality = inputs.int_range(1, 100)(
+            form.get("quality", get_int("SEGMENTATION_WEBP_QUALITY"))
+        )
+    except ValueError as exception:
+        raise FieldError("quality", str(exception)) from exception
+    return output_format, compression, quality
+
+
+def model_name_of(form: FormData) -> Optional[str]:
+    """Returns the requested model (see /model/registry), or None for the default one."""
+    return str(form.get("model") or "") or None
+
+
+@recorded("/api/liveness")
+async def liveness(_request: Request) -> Response:
+    """Returns liveness status."""
+    return JSONResponse({"Alive": True})
+
+
+@recorded("/api/readiness")
+async def readiness(_request: Request) -> Response:
+    """Returns readiness status, like the Flask app's /readiness."""
+    report, status = readiness_report()
+    return JSONResponse(report, status_code=status)
+
+
+@recorded("/api/model/predict")
+async def model_predict(request: Request) -> Response:
+    """Returns a prediction using the model, like the Flask app's /model/predict."""
+    with stage("upload_read"):
+        form = await receive_form(request)
+        file = read_upload(form)
+        if file is None:
+            return JSONResponse({"error": "No file part in request"}, status_code=400)
+        upload = file.file  # decoded from the spooled file
+    classifiers: List[str] = [str(value) for value in form.getlist("classifiers")]
+    if not classifiers:
+        return validation_error("classifiers", "Missing required parameter")
+    result = await cached_prediction(
+        model_name_of(form),
+        upload,
+        {"image": upload, "classifiers": classifiers},
+        admission_queues["predict"],
+    )
+    return JSONResponse(result)
+
+
+@recorded("/api/segmentation/background_removal")
+async def background_removal(request: Request) -> Response:
+    """Returns the image with its background removed, like the Flask app's
+    /segmentation/background_removal."""
+    with stage("upload_read"):
+        form = await receive_form(request)
+        file = read_upload(form)
+        if file is None:
+            return JSONResponse({"error": "No file part in request"}, status_code=400)
+        upload = file.file  # decoded from the spooled file
+    model_name = rembg_model_of(form)
+    if model_name is None:
+        return validation_error("rembg_model", "Unknown rembg model")
+    try:
+        options = mask_options_of(form)
+        output_options = output_options_of(form)
+    except FieldError as exception:
+        return validation_error(exception.field, exception.message)
+    output_image = await remove_background(
+        upload, model_name, options, admission_queues["background_removal"]
+    )
+
+    output = await encode_pool.run(encode_output, output_image, *output_options)
+    base_filename = os.path.splitext(file.filename or "")[0]
+    download_filename = f"bg_removed_{base_filename}{output.extension}"
+    return Response(
+        output.content,
+        media_type=output.mimetype,
+        headers={
+            "Content-Disposition": f'attachment; filename="{download_filename}"',
+            **output.headers,
+        },
+    )
+
+
+@recorded("/api/model/background_removal_predict")
+async def background_removal_predict(request: Request) -> Response:
+    """Removes the background of the image and returns a prediction using the model, like
+    the Flask app's /model/background_removal_predict."""
+    with stage("upload_read"):
+        form = await receive_form(request)
+        file = read_upload(form)
+        if file is None:
+            return JSONResponse({"error": "No file part in request"}, status_code=400)
+        upload = file.file  # decoded from the spooled file
+    classifiers: List[str] = [str(value) for value in form.getlist("classifiers")]
+    if not classifiers:
+        return validation_error("classifiers", "Missing required parameter")
+    model_name = rembg_model_of(form)
+    if model_name is None:
+        return validation_error("rembg_model", "Unknown rembg model")
+    try:
+        return_processed_image = inputs.boolean(
+            form.get("return_processed_image", True)
+        )
+    except ValueError as exception:
+        return validation_error("return_processed_image", str(exception))
+    try:
+        options = mask_options_of(form)
+    except FieldError as exception:
+        return validation_error(exception.field, exception.message)
+
+    queue = admission_queues["background_removal_predict"]
+    output_image = await remove_background(upload, model_name, options, queue)
+    prediction_result = await cached_prediction(
+        model_name_of(form),
+        upload,
+        {"image": output_image, "classifiers": classifiers},
+        queue,
+        model_name,
+        *options,
+    )
+
+    response: Dict[str, Any] = {"prediction": prediction_result}
+    if return_processed_image:
+        result_name = save_processed_image(
+            output_image, "/api/model/background_removal_predict"
+        )
+        if result_name is not None:
+            response["processed_image_url"] = (
+                str(request.base_url)
+                + "api/model/download_processed_image/"
+                + result_name
+            )
+    return JSONResponse(response)
+
+
+# CORS preflight requests fall through to the Flask app, which answers them
+CORS = [
+    Middleware(
+        CORSMiddleware,
+        allow_origins=CORS_ORIGINS,
+        expose_headers=[*CROP_HEADERS, REQUEST_ID_HEADER],
+    )
+]
+
+APP = Starlette(
+    routes=[
+        Route("/api/liveness", liveness, methods=["GET"], middleware=CORS),
+        Route("/api/readiness", readiness, methods=["GET"], middleware=CORS),
+        Route("/api/model/predict", model_predict, methods=["POST"], middleware=CORS),
+        Route(
+            "/api/segmentation/background_removal",
+            background_removal,
+            methods=["POST"],
+            middleware=CORS,
+        ),
+        Route(
+            "/api/model/background_removal_predict",
+            background_removal_predict,
+            methods=["POST"],
+            middleware=CORS,
+        ),
+        # Everything else, served by the Flask app on a2wsgi's thread pool. a2wsgi declares
+        # its own WSGI and ASGI callable types, which mypy doesn't match with Flask's and
+        # Starlette's equivalent ones
+        Mount(
+            "/",
+            app=WSGIMiddleware(FLASK_APP),  # type: ignore[arg-type]
+        ),
+    ]
+)
@@ -0,0 +1,134 @@
+"""This module implements the MicroBatcher class."""
+from concurrent.futures import Future
+from logging import Logger, getLogger
+from queue import Empty, Queue
+from threading import Lock, Thread
+from time import monotonic
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+from ml_rest_api.admission import (
+    DeadlineExceeded,
+    count_dropped,
+    deadline as request_deadline,
+)
+from ml_rest_api.forking import after_fork_in_child
+
+log: Logger = getLogger(__name__)
+
+PredictCallableType = Callable[[np.ndarray], np.ndarray]
+PendingItemType = Tuple[np.ndarray, Future, Optional[float]]
+
+
+class MicroBatcher:
+    """MicroBatcher collects samples submitted concurrently by request threads and runs them
+    through the model as a single (N, ...) batch. A batch is dispatched as soon as it holds
+    max_batch_size samples or max_wait seconds have passed since its first sample arrived, and
+    each caller receives its own row of the model output. Samples whose request deadline has
+    passed by the time their batch is dispatched are dropped with DeadlineExceeded.
+    """
+
+    def __init__(
+        self, predict: PredictCallableType, max_batch_size: int, max_wait: float
+    ) -> None:
+        """Stores the batch predict callable and limits. The worker thread starts lazily."""
+        self.predict = predict
+        self.max_batch_size: int = max(1, max_batch_size)
+        self.max_wait: float = max(0.0, max_wait)
+        self._queue: "Queue[PendingItemType]" = Queue()
+        self._lock = Lock()
+        self._thread: Optional[Thread] = None
+        after_fork_in_child(self._after_fork)
+
+    def submit(self, sample: np.ndarray) -> np.ndarray:
+        """Queues a single sample and blocks until its row of the batch output is available."""
+        return self.submit_nowait(sample).result()
+
+    def submit_nowait(self, sample: np.ndarray) -> Future:
+        """Queues a single sample and returns the future of its row of the batch output."""
+        future: Future = Future()
+        self._ensure_started()
+        self._queue.put((sample, future, request_deadline()))
+        return future
+
+    def close(self) -> None:
+        """Stops the worker thread once the samples queued so far have been run, and waits for
+        it. Only call it once no more samples will be submitted."""
+        with self._lock:
+            thread = self._thread
+            if thread is not None:
+                self._queue.put(None)  # type: ignore
+        if thread is not None:
+            thread.join()
+
+    def _ensure_started(self) -> None:
+        """Starts the worker thread the first time a sample is submitted."""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(
+                    target=self._loop, name="micro-batcher", daemon=True
+                )
+                self._thread.start()
+
+    def _after_fork(self) -> None:
+        """Runs in a newly forked child process, where the worker thread (if the parent had
+        started one) no longer exists: starts over with a fresh queue, lock and thread.
+        """
+        self._queue = Queue()
+        self._lock = Lock()
+        self._thread = None
+
+    def _collect(self) -> Optional[List[PendingItemType]]:
+        """Blocks for the first sample, then gathers more until the batch is full or the wait
+        time after the first sample expires. Returns None once close() was called."""
+        first = self._queue.get()
+        if first is None:
+            return None
+        pending: List[PendingItemType] = [first]
+        deadline = monotonic() + self.max_wait
+        while len(pending) < self.max_batch_size:
+            remaining = deadline - monotonic()
+            try:
+                if remaining > 0:
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    item = self._queue.get_nowait()
+            except Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # stop after this batch
+                break
+            pending.append(item)
+        return pending
+
+    def _loop(self) -> None:
+        """Worker thread main loop, until close() is called."""
+        while True:
+            pending = self._collect()
+            if pending is None:
+                return
+            self._dispatch(pending)
+
+    def _dispatch(self, pending: List[PendingItemType]) -> None:
+        """Runs one batch through the model and resolves every caller's future."""
+        pending = [item for item in pending if item[1].set_running_or_notify_cancel()]
+        now = monotonic()
+        for _, future, expires in pending:
+            if expires is not None and now >= expires:
+                count_dropped("batcher", "expired")
+                future.set_exception(DeadlineExceeded("Deadline passed while batching"))
+        pending = [item for item in pending if not item[1].done()]
+        if not pending:
+            return
+        try:
+            outputs = self.predict(np.stack([sample for sample, _, _ in pending]))
+        except Exception as exception:  # pylint: disable=broad-except
+            log.exception("Batch of %d samples failed", len(pending))
+            for _, future, _ in pending:
+                future.set_exception(exception)
+            return
+        log.debug("Ran batch of %d samples", len(pending))
+        for row, (_, future, _) in enumerate(pending):
+            future.set_result(outputs[row])
@@ -0,0 +1,61 @@
+"""Bounded thread pools shared by the request handlers. Threads are only started on first use,
+so importing this module before a fork is safe."""
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import BoundedSemaphore
+from typing import Any, Callable
+from ml_rest_api.admission import Overloaded, count_dropped
+from ml_rest_api.settings import get_int
+from ml_rest_api.thread_budget import record
+
+
+class BoundedThreadPoolExecutor(ThreadPoolExecutor):
+    """A ThreadPoolExecutor whose work queue holds at most max_queued jobs besides the running
+    ones. Jobs submitted beyond that are rejected with Overloaded right away (and counted as
+    shed), so that a burst can't queue up images, kept alive by their jobs, without limit.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queued: int) -> None:
+        """name labels the rejected jobs in the dropped request counts."""
+        super().__init__(max_workers=max_workers, thread_name_prefix=name)
+        self.name = name
+        self._slots = BoundedSemaphore(max_workers + max(0, max_queued))
+
+    def submit(self, fn: Callable[..., Any], /, *args: Any, **kwargs: Any) -> Future:
+        """Schedules fn(*args, **kwargs) like ThreadPoolExecutor.submit(), or raises
+        Overloaded if the queue is full."""
+        if not self._slots.acquire(False):  # pylint: disable=consider-using-with
+            count_dropped(self.name, "shed")
+            raise Overloaded(self.name, get_int("ADMISSION_RETRY_AFTER_SECONDS"))
+        try:
+            future = super().submit(fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+
+def bounded_executor(name: str, setting: str) -> BoundedThreadPoolExecutor:
+    """Returns a pool with the number of threads of a setting, queueing up to
+    EXECUTOR_QUEUE_PER_THREAD jobs per thread."""
+    threads = get_int(setting)
+    record(name, threads)
+    return BoundedThreadPoolExecutor(
+        name, threads, threads * get_int("EXECUTOR_QUEUE_PER_THREAD")
+    )
+
+
+# Image decoding for multi-image requests (Pillow releases the GIL while decoding)
+decode_executor = bounded_executor(  # pylint: disable=invalid-name
+    "decode", "DECODE_THREADS"
+)
+
+# Image encoding that happens off the response-critical path
+encode_executor = bounded_executor(  # pylint: disable=invalid-name
+    "encode", "ENCODE_THREADS"
+)
+
+# Background removal and unbatched inference in ASGI mode (see asgi.py)
+inference_executor = bounded_executor(  # pylint: disable=invalid-name
+    "inference", "INFERENCE_THREADS"
+)
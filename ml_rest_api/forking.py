@@ -0,0 +1,28 @@
+"""This module implements after_fork_in_child(), a weak form of os.register_at_fork()."""
+import os
+import weakref
+from typing import Callable, Set
+
+_hooks: Set["weakref.WeakMethod"] = set()
+
+
+def after_fork_in_child(method: Callable[[], None]) -> None:
+    """Calls a bound method in every newly forked child process, for as long as its object is
+    alive. Unlike os.register_at_fork(), which keeps whatever it is given alive for the life
+    of the process, this doesn't stop the object (e.g. a model that was unloaded) from being
+    freed."""
+    _hooks.add(weakref.WeakMethod(method))
+
+
+def _run_hooks() -> None:
+    """Runs in a newly forked child process: calls the methods of the live objects and forgets
+    those of the freed ones."""
+    for hook in list(_hooks):
+        method = hook()
+        if method is None:
+            _hooks.discard(hook)
+        else:
+            method()
+
+
+os.register_at_fork(after_in_child=_run_hooks)
@@ -0,0 +1,71 @@
+"""Gunicorn configuration for pre-fork mode. The master process imports the app, and with it
+TensorFlow and the rembg ONNX sessions, before forking the workers, which then share those pages
+copy-on-write instead of each loading their own copy. Usage:
+
+    gunicorn -c python:ml_rest_api.gunicorn_prefork ml_rest_api.app:APP
+"""
+import gc
+import os
+from logging import Logger, getLogger
+
+from ml_rest_api.thread_budget import (
+    default_worker_count,
+    limit_native_threads,
+    record,
+    request_threads,
+    worker_count,
+)
+
+# Read by ml_rest_api.app while the master preloads it (see initialize_app)
+os.environ.setdefault("PREFORK_INIT", "True")
+# Read by the workers too, to share the CPUs out between them (see thread_budget.py). Each
+# worker still loads its own TensorFlow model once forked, so by default there are no more
+# workers than WORKER_MEMORY_MB each allows in the memory limit
+os.environ.setdefault("WEB_CONCURRENCY", str(default_worker_count()))
+limit_native_threads()
+
+# pylint: disable=invalid-name
+bind = os.environ.get("BIND", "0.0.0.0:8888")
+workers = worker_count()
+worker_class = "gthread"
+threads = request_threads()
+preload_app = True
+timeout = int(os.environ.get("TIMEOUT", "120"))
+
+log: Logger = getLogger("ml_rest_api.gunicorn_prefork")
+
+
+def when_ready(server) -> None:  # pylint: disable=unused-argument
+    """Logs the memory use of the master once the app is loaded."""
+    # pylint: disable=import-outside-toplevel
+    from ml_rest_api.memory import memory_report
+
+    log.info("Master %s memory after preload: %s", os.getpid(), memory_report())
+
+
+def pre_fork(server, worker) -> None:  # pylint: disable=unused-argument
+    """Moves every object allocated so far into the garbage collector's permanent
+    generation, so that collections in the workers don't write to (and thereby copy) the
+    shared pages."""
+    gc.freeze()
+
+
+def post_fork(server, worker) -> None:  # pylint: disable=unused-argument
+    """Loads the parts of the app that cannot be shared, in the new worker, and starts its
+    own logging thread: the master's didn't survive the fork."""
+    # pylint: disable=import-outside-toplevel
+    from ml_rest_api.app import initialize_worker
+    from ml_rest_api.request_logging import configure_logging
+
+    configure_logging()
+    record("gunicorn", worker.cfg.threads)
+    initialize_worker()
+
+
+def post_worker_init(worker) -> None:
+    """Logs the memory use of the worker right after the fork, when almost all of it is
+    still shared with the master. The startup timeline logs it again once loaded."""
+    # pylint: disable=import-outside-toplevel
+    from ml_rest_api.memory import memory_report
+
+    log.info("Worker %s memory after fork: %s", worker.pid, memory_report())
@@ -0,0 +1,108 @@
+"""Module that decodes uploaded images straight from memory into model inputs."""
+from io import BytesIO
+from typing import BinaryIO, Optional, Tuple, Union
+
+import numpy as np
+from PIL import ExifTags, Image, ImageOps
+from ml_rest_api.metrics import stage
+from ml_rest_api.settings import get_int
+
+ImageSourceType = Union[bytes, str, BinaryIO, np.ndarray, Image.Image]
+
+MODEL_INPUT_SIZE: Tuple[int, int] = (224, 224)  # (width, height), as PIL expects
+
+
+class ImageTooLarge(ValueError):
+    """Raised when an image would decode to more pixels than UPLOAD_MAX_PIXELS."""
+
+
+def open_image(
+    source: Union[bytes, str, BinaryIO], draft_size: Optional[Tuple[int, int]] = None
+) -> Image.Image:
+    """Opens encoded image bytes, a file-like object or a path without decoding pixels yet.
+    With draft_size, JPEGs are set to decode at the smallest DCT scale that is at least that
+    size (see decode_image()). Raises ImageTooLarge if the size the image would then decode
+    to, read from its header, is above UPLOAD_MAX_PIXELS, so that such images are rejected
+    before any memory is allocated for their pixels."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = BytesIO(source)
+    elif hasattr(source, "seek"):
+        source.seek(0)  # e.g. an upload that was hashed first
+    image = Image.open(source)
+    if draft_size:
+        image.draft("RGB", draft_size)
+    max_pixels = get_int("UPLOAD_MAX_PIXELS")
+    width, height = image.size
+    if max_pixels and width * height > max_pixels:
+        raise ImageTooLarge(
+            f"Image of {width}x{height} pixels is larger than {max_pixels} pixels"
+        )
+    return image
+
+
+def upright(image: Image.Image) -> Image.Image:
+    """Returns the image rotated and flipped as its EXIF orientation tag says, e.g. a photo
+    taken with the phone held upright."""
+    if image.getexif().get(ExifTags.Base.Orientation, 1) == 1:
+        return image  # exif_transpose() would return a copy
+    transposed = ImageOps.exif_transpose(image)
+    # Only None when transposing in place, which this doesn't ask for
+    return image if transposed is None else transposed
+
+
+def decode_image(
+    source: Union[bytes, str, BinaryIO], size: Tuple[int, int] = MODEL_INPUT_SIZE
+) -> Image.Image:
+    """Decodes an encoded image to an RGB image of exactly `size`.
+
+    For JPEGs, draft mode lets libjpeg apply DCT scaling while decoding, so a 4000px photo is
+    decompressed at 1/2, 1/4 or 1/8 scale (never smaller than `size`) instead of in full.
+    The image is turned upright according to its EXIF orientation, and the final resize uses
+    nearest-neighbour sampling, like keras' load_img().
+    """
+    with stage("decode"):
+        image = open_image(source, size)
+        return resize_rgb(upright(image), size)
+
+
+def decode_full(
+    source: Union[bytes, str, BinaryIO], mode: str = "RGBA", max_side: int = -1
+) -> Image.Image:
+    """Decodes an encoded image at full resolution, upright, unless one of its sides is longer
+    than max_side pixels (DECODE_MAX_SIDE by default, 0 for no limit): it is then scaled down
+    to fit, JPEGs while they are decoded (see decode_image()). This bounds the memory that the
+    decoded image, and everything computed from it, take."""
+    if max_side < 0:
+        max_side = get_int("DECODE_MAX_SIDE")
+    with stage("decode"):
+        image = upright(open_image(source, (max_side, max_side) if max_side else None))
+        if max_side and max(image.size) > max_side:
+            image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        return image.convert(mode)
+
+
+def resize_rgb(
+    image: Image.Image, size: Tuple[int, int] = MODEL_INPUT_SIZE
+) -> Image.Image:
+    """Converts an already opened image to RGB and resizes it to `size` if needed."""
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    if image.size != size:
+        image = image.resize(size, Image.Resampling.NEAREST)
+    return image
+
+
+def to_model_input(
+    source: ImageSourceType, size: Tuple[int, int] = MODEL_INPUT_SIZE
+) -> np.ndarray:
+    """Returns a float32 (height, width, 3) array from encoded bytes, a file-like object, a
+    path, a decoded array (RGB or RGBA) or a PIL image."""
+    if isinstance(source, np.ndarray):
+        if source.ndim == 3 and source.shape[2] == 3 and source.shape[1::-1] == size:
+            return source.astype(np.float32, copy=False)
+        source = Image.fromarray(source.astype(np.uint8, copy=False))
+    if isinstance(source, Image.Image):
+        image = resize_rgb(source, size)
+    else:
+        image = decode_image(source, size)
+    return np.asarray(image, dtype=np.float32)
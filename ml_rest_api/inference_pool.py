@@ -0,0 +1,549 @@
+"""This module implements the InferencePool class, which runs the model in a few dedicated
+processes shared by every web worker.
+
+Samples travel through a ring of fixed-size slots in one shared memory block rather than
+being pickled: a web worker reserves a free slot, copies its preprocessed image into it as
+uint8, marks it queued and waits on the slot's semaphore. An inference process collects queued
+slots, oldest first, into a batch (up to BATCH_MAX_SIZE, waiting up to BATCH_MAX_WAIT_MS), runs
+the model's predict() on them and writes each output row back into its slot.
+
+A supervisor process starts the inference processes and restarts any that dies, failing the
+slots it was running, so a crash costs the requests in flight but not the web tier. It also
+reclaims the slots of web workers that died. It is started through a short-lived launcher
+process, so that it isn't a multiprocessing child of the process owning the pool: processes
+forked from that one (e.g. gunicorn workers) would otherwise try to join or terminate it as
+they exit. The owner tracks it by pid instead. The only lock shared by the processes (guarding
+the slot headers) is held for a few microseconds at a time; if a process dies holding it, the
+supervisor releases it.
+"""
+import atexit
+import os
+import signal
+import sys
+from contextlib import contextmanager
+from logging import Logger, getLogger
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from time import monotonic, monotonic_ns, sleep
+from types import ModuleType
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from ml_rest_api.admission import (
+    DeadlineExceeded,
+    count_dropped,
+    deadline as request_deadline,
+)
+from ml_rest_api.memory import memory_report
+from ml_rest_api.request_logging import configure_logging
+from ml_rest_api.settings import get_float, get_int
+
+log: Logger = getLogger(__name__)
+
+# Slot states
+FREE, RESERVED, QUEUED, RUNNING, DONE, FAILED, ABANDONED = range(7)
+# Slot header columns: state, owner (inference process number), client (web worker pid),
+# queueing time (monotonic ns), output length, sample shape
+STATE, OWNER, CLIENT, QUEUED_NS, OUTPUT_LEN, NDIM, SHAPE = range(7)
+MAX_NDIM = 4
+HEADER_COLUMNS = SHAPE + MAX_NDIM
+STOP_TIMEOUT_SECONDS = 10.0
+
+# Loads a model module (given its name and model path) and returns its predict()
+PredictLoaderType = Callable[[str, str], Callable[[np.ndarray], Any]]
+
+
+class InferenceProcessError(RuntimeError):
+    """An inference process failed, or died, while running a sample."""
+
+
+class PoolSpec(NamedTuple):
+    """Everything an inference or supervisor process needs to join the pool."""
+
+    module_name: str
+    model_path: str  # "" for the module's default model
+    load_predict: PredictLoaderType  # a module-level function, so that it can be pickled
+    processes: int
+    slots: int
+    slot_bytes: int
+    max_outputs: int
+    max_batch_size: int
+    max_wait: float
+    memory_name: str
+    queued: Any  # Semaphore released whenever a slot is queued
+    lock: Any  # guards the slot headers
+    free: Any  # Semaphore counting free slots
+    done: List[Any]  # one Semaphore per slot, released when its output is ready
+    ready: List[Any]  # one Event per inference process, set once it's warmed up
+
+
+class SlotViews(NamedTuple):
+    """NumPy views over the shared memory block."""
+
+    header: np.ndarray  # (slots, HEADER_COLUMNS) int64
+    inputs: np.ndarray  # (slots, slot_bytes) uint8
+    outputs: np.ndarray  # (slots, max_outputs) float32
+
+
+def memory_size(slots: int, slot_bytes: int, max_outputs: int) -> int:
+    """Returns the size of the shared memory block."""
+    return slots * (HEADER_COLUMNS * 8 + slot_bytes + max_outputs * 4)
+
+
+def slot_views(memory: SharedMemory, spec: PoolSpec) -> SlotViews:
+    """Returns the header, input and output views over the shared memory block."""
+    header_bytes = spec.slots * HEADER_COLUMNS * 8
+    input_bytes = spec.slots * spec.slot_bytes
+    buffer = memory.buf
+    return SlotViews(
+        np.ndarray((spec.slots, HEADER_COLUMNS), np.int64, buffer),
+        np.ndarray((spec.slots, spec.slot_bytes), np.uint8, buffer, header_bytes),
+        np.ndarray(
+            (spec.slots, spec.max_outputs),
+            np.float32,
+            buffer,
+            header_bytes + input_bytes,
+        ),
+    )
+
+
+def attach(spec: PoolSpec) -> Tuple[SharedMemory, SlotViews]:
+    """Attaches a spawned process to the shared memory block. Spawned processes share the
+    resource tracker of the process that created it, which unlinks it when the pool stops.
+    """
+    memory = SharedMemory(spec.memory_name)
+    return memory, slot_views(memory, spec)
+
+
+def free_slot(views: SlotViews, spec: PoolSpec, index: int) -> None:
+    """Returns a slot to the ring. Call with spec.lock held."""
+    views.header[index, STATE] = FREE
+    views.header[index, OWNER] = -1
+    views.header[index, CLIENT] = 0
+    spec.free.release()
+
+
+def take(views: SlotViews, spec: PoolSpec, number: int, limit: int) -> List[int]:
+    """Marks up to `limit` queued slots, oldest first, as run by inference process `number`
+    and returns them."""
+    with spec.lock:
+        queued = np.flatnonzero(views.header[:, STATE] == QUEUED)
+        oldest = queued[np.argsort(views.header[queued, QUEUED_NS])][:limit]
+        views.header[oldest, STATE] = RUNNING
+        views.header[oldest, OWNER] = number
+    return [int(index) for index in oldest]
+
+
+def collect(views: SlotViews, spec: PoolSpec, number: int) -> List[int]:
+    """Waits up to a second for queued slots, then gathers more until the batch is full or
+    the wait time after the first one expires. Slots are also looked for when the wait times
+    out, in case a process died between a release and its take()."""
+    spec.queued.acquire(timeout=1.0)
+    batch = take(views, spec, number, spec.max_batch_size)
+    deadline = monotonic() + spec.max_wait
+    while batch and len(batch) < spec.max_batch_size:
+        remaining = deadline - monotonic()
+        if remaining <= 0 or not spec.queued.acquire(timeout=remaining):
+            break
+        batch += take(views, spec, number, spec.max_batch_size - len(batch))
+    return batch
+
+
+def serve(spec: PoolSpec, number: int) -> None:
+    """Inference process main loop: loads and warms up the model, then runs batches of
+    queued slots through it."""
+    # This process runs the model itself, in process
+    os.environ["INFERENCE_PROCESSES"] = "0"
+    configure_logging()
+    _, views = attach(spec)
+    predict = spec.load_predict(spec.module_name, spec.model_path)
+    spec.ready[number].set()
+    log.info("Inference process %d (pid %d) ready", number, os.getpid())
+    supervisor = os.getppid()
+    while os.getppid() == supervisor:  # exit if the supervisor is gone
+        batch = collect(views, spec, number)
+        if not batch:
+            continue
+        samples = []
+        for index in batch:
+            shape = tuple(
+                views.header[index, SHAPE : SHAPE + views.header[index, NDIM]]
+            )
+            size = int(np.prod(shape))
+            samples.append(views.inputs[index, :size].reshape(shape))
+        try:
+            outputs: Optional[np.ndarray] = np.asarray(
+                predict(np.stack(samples).astype(np.float32))
+            )
+        except Exception:  # pylint: disable=broad-except
+            log.exception("Batch of %d samples failed", len(batch))
+            outputs = None
+        with spec.lock:
+            for row, index in enumerate(batch):
+                if views.header[index, STATE] == ABANDONED:
+                    free_slot(views, spec, index)
+                    continue
+                output = None if outputs is None else outputs[row].ravel()
+                if output is None or output.size > spec.max_outputs:
+                    views.header[index, STATE] = FAILED
+                else:
+                    views.outputs[index, : output.size] = output
+                    views.header[index, OUTPUT_LEN] = output.size
+                    views.header[index, STATE] = DONE
+                spec.done[index].release()
+
+
+def is_running(pid: int) -> bool:
+    """Returns whether a process exists (and isn't a zombie left for us to reap)."""
+    try:
+        if os.waitpid(pid, os.WNOHANG)[0] == pid:
+            return False  # one of our children, which had exited
+    except ChildProcessError:
+        pass  # not one of our children
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # alive, and not ours
+    return True
+
+
+def launch(spec: PoolSpec, owner: int, pid_writer: Any) -> None:
+    """Launcher process: starts the supervisor, sends its pid through pid_writer and exits
+    without waiting for it, leaving it a child of no process of the pool's."""
+    supervisor = get_context("spawn").Process(
+        target=supervise, args=(spec, owner), name="inference-supervisor"
+    )
+    supervisor.start()
+    pid_writer.send(supervisor.pid)
+    pid_writer.close()
+    os._exit(0)  # pylint: disable=protected-access
+
+
+def supervise(spec: PoolSpec, owner: int) -> None:
+    """Supervisor process main loop: starts the inference processes and restarts those that
+    die, failing the slots they were running. Exits, stopping them, when the pool's owner
+    process exits or on SIGTERM."""
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    configure_logging()
+    _, views = attach(spec)
+    context = get_context("spawn")
+
+    def start(number: int) -> Any:
+        spec.ready[number].clear()
+        process = context.Process(
+            target=serve, args=(spec, number), name=f"inference-{number}", daemon=True
+        )
+        process.start()
+        return process
+
+    processes = [start(number) for number in range(spec.processes)]
+    try:
+        while is_running(owner):
+            sleep(0.5)
+            for number, process in enumerate(processes):
+                if not process.is_alive():
+                    log.error(
+                        "Inference process %d (pid %s) exited with code %s, restarting it",
+                        number,
+                        process.pid,
+                        process.exitcode,
+                    )
+                    recover_slots(views, spec, number)
+                    processes[number] = start(number)
+            reclaim_slots(views, spec)
+    finally:
+        for process in processes:
+            process.terminate()
+
+
+def recover_slots(views: SlotViews, spec: PoolSpec, number: int) -> None:
+    """Fails the slots that a dead inference process was running, and releases the header
+    lock if it died holding it."""
+    if spec.lock.acquire(timeout=1.0):
+        spec.lock.release()
+    else:
+        log.warning("Releasing the slot lock held by dead inference process %d", number)
+        spec.lock.release()
+    with spec.lock:
+        for index in np.flatnonzero(views.header[:, OWNER] == number):
+            if views.header[index, STATE] == RUNNING:
+                views.header[index, STATE] = FAILED
+                spec.done[index].release()
+            elif views.header[index, STATE] == ABANDONED:
+                free_slot(views, spec, index)
+
+
+def reclaim_slots(views: SlotViews, spec: PoolSpec) -> None:
+    """Frees the slots of web workers that died, e.g. killed for timing out, waiting for
+    the inference processes to finish with those still running."""
+    with spec.lock:
+        for index in np.flatnonzero(views.header[:, CLIENT] > 0):
+            try:
+                os.kill(int(views.header[index, CLIENT]), 0)
+                continue  # still alive
+            except ProcessLookupError:
+                pass
+            except PermissionError:
+                continue  # alive, and not ours
+            state = views.header[index, STATE]
+            if state == RUNNING:
+                views.header[index, STATE] = ABANDONED
+            elif state != ABANDONED:
+                spec.done[index].acquire(block=False)  # drops an unread result
+                free_slot(views, spec, index)
+
+
+@contextmanager
+def bare_main() -> Iterator[None]:
+    """Hides the __main__ module while starting a spawned process, which would otherwise
+    import it again: e.g. ml_rest_api/app.py run as a script would initialise a whole app in
+    every inference process."""
+    main = sys.modules["__main__"]
+    sys.modules["__main__"] = ModuleType("__main__")
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main
+
+
+class InferencePool:  # pylint: disable=too-many-instance-attributes
+    """InferencePool runs the model's predict() in INFERENCE_PROCESSES dedicated processes. The
+    process that calls start() owns the pool; processes forked from it afterwards (e.g.
+    gunicorn workers in pre-fork mode) share it."""
+
+    def __init__(
+        self, module_name: str, load_predict: PredictLoaderType, model_path: str = ""
+    ) -> None:
+        """Reads the pool settings. Nothing is started until start() is called. The inference
+        processes get the model's predict() from load_predict(module_name, model_path).
+        """
+        self.module_name = module_name
+        self.load_predict = load_predict
+        self.model_path = model_path
+        self.processes = get_int("INFERENCE_PROCESSES")
+        self.slots = max(1, get_int("INFERENCE_SLOTS"))
+        self.slot_bytes = int(get_float("INFERENCE_SLOT_MB") * 1024 * 1024)
+        self.max_outputs = get_int("INFERENCE_MAX_OUTPUTS")
+        self.timeout = get_float("INFERENCE_TIMEOUT_SECONDS")
+        self.spec: Optional[PoolSpec] = None
+        self.views: Optional[SlotViews] = None
+        self._memory: Optional[SharedMemory] = None
+        self.supervisor_pid: Optional[int] = None
+        self._owner: Optional[int] = None
+
+    def start(self) -> None:
+        """Creates the shared memory ring and starts the supervisor, which starts the
+        inference processes. Does nothing if the pool is already started. Starts no thread
+        in this process, so that it can fork afterwards."""
+        if self.spec is not None:
+            return
+        context = get_context("spawn")
+        self._memory = SharedMemory(
+            create=True, size=memory_size(self.slots, self.slot_bytes, self.max_outputs)
+        )
+        self.spec = PoolSpec(
+            module_name=self.module_name,
+            model_path=self.model_path,
+            load_predict=self.load_predict,
+            processes=self.processes,
+            slots=self.slots,
+            slot_bytes=self.slot_bytes,
+            max_outputs=self.max_outputs,
+            max_batch_size=max(1, get_int("BATCH_MAX_SIZE")),
+            max_wait=get_float("BATCH_MAX_WAIT_MS") / 1000,
+            memory_name=self._memory.name,
+            queued=context.Semaphore(0),
+            lock=context.Lock(),
+            free=context.Semaphore(self.slots),
+            done=[context.Semaphore(0) for _ in range(self.slots)],
+            ready=[context.Event() for _ in range(self.processes)],
+        )
+        self.views = slot_views(self._memory, self.spec)
+        self.views.header[:] = 0
+        self.views.header[:, OWNER] = -1
+        pid_reader, pid_writer = context.Pipe(duplex=False)
+        launcher = context.Process(
+            target=launch,
+            args=(self.spec, os.getpid(), pid_writer),
+            name="inference-launcher",
+        )
+        with bare_main():
+            launcher.start()
+        pid_writer.close()
+        try:
+            self.supervisor_pid = int(pid_reader.recv())
+        except EOFError as exception:
+            raise InferenceProcessError(
+                "The inference supervisor could not be started"
+            ) from exception
+        finally:
+            pid_reader.close()
+            launcher.join()
+        self._owner = os.getpid()
+        atexit.register(self.stop)
+        log.info("Started %d inference processes", self.processes)
+
+    def stop(self) -> None:
+        """Stops the supervisor, and with it the inference processes, and releases the
+        shared memory. Does nothing in other processes."""
+        if self._owner != os.getpid():
+            return
+        if self.supervisor_pid is not None:
+            try:
+                os.kill(self.supervisor_pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+            deadline = monotonic() + STOP_TIMEOUT_SECONDS
+            while is_running(self.supervisor_pid) and monotonic() < deadline:
+                sleep(0.05)
+            self.supervisor_pid = None
+        if self._memory is not None:
+            self.views = None
+            self._memory.close()
+            self._memory.unlink()
+            self._memory = None
+        self.spec = None
+
+    def memory(self) -> Dict[str, float]:
+        """Returns the memory_report() of the inference processes, added up."""
+        if self.supervisor_pid is None:
+            return {}
+        pid = self.supervisor_pid
+        try:
+            with open(f"/proc/{pid}/task/{pid}/children", encoding="ascii") as children:
+                pids = children.read().split()
+        except OSError:
+            return {}
+        total: Dict[str, float] = {}
+        for child in pids:
+            for key, value in memory_report(child).items():
+                total[key] = round(total.get(key, 0.0) + value, 1)
+        return total
+
+    def ready(self) -> bool:
+        """Returns whether every inference process is loaded and warmed up."""
+        return self.spec is not None and all(
+            event.is_set() for event in self.spec.ready
+        )
+
+    def wait_ready(self, timeout: Optional[float] = None) -> bool:
+        """Waits until every inference process is ready. Returns False on timeout."""
+        if self.spec is None:
+            return False
+        deadline = None if timeout is None else monotonic() + timeout
+        for event in self.spec.ready:
+            remaining = None if deadline is None else max(0.0, deadline - monotonic())
+            if not event.wait(remaining):
+                return False
+        return True
+
+    def _enqueue(self, sample: np.ndarray, expires: Optional[float] = None) -> int:
+        """Copies a sample into a free slot and queues it. Returns the slot number. Raises
+        DeadlineExceeded if no slot frees up before expires."""
+        spec, views = self.spec, self.views
+        if spec is None or views is None:
+            raise InferenceProcessError("Inference pool not started")
+        pixels = np.asarray(sample)
+        if pixels.ndim > MAX_NDIM or pixels.size > spec.slot_bytes:
+            raise ValueError(f"Sample of shape {pixels.shape} doesn't fit in a slot")
+        if pixels.dtype != np.uint8:
+            # Samples travel as uint8: anything that doesn't convert exactly (values out of
+            # 0-255, fractions, NaN) is rejected rather than wrapped or truncated
+            with np.errstate(invalid="ignore"):
+                converted = pixels.astype(np.uint8)
+            if not np.array_equal(converted, pixels):
+                raise ValueError(
+                    f"Sample of {pixels.dtype} isn't made of 0-255 pixel values"
+                )
+            pixels = converted
+        timeout = self.timeout
+        if expires is not None:
+            timeout = min(timeout, max(0.0, expires - monotonic()))
+        if not spec.free.acquire(timeout=timeout):
+            if expires is not None and monotonic() >= expires:
+                count_dropped("inference_pool", "expired")
+                raise DeadlineExceeded("Deadline passed waiting for an inference slot")
+            raise InferenceProcessError("No free inference slot")
+        with spec.lock:
+            index = int(np.flatnonzero(views.header[:, STATE] == FREE)[0])
+            views.header[index, STATE] = RESERVED
+            views.header[index, CLIENT] = os.getpid()
+        views.inputs[index, : pixels.size] = pixels.ravel()
+        views.header[index, NDIM] = pixels.ndim
+        views.header[index, SHAPE : SHAPE + pixels.ndim] = pixels.shape
+        with spec.lock:
+            views.header[index, QUEUED_NS] = monotonic_ns()
+            views.header[index, STATE] = QUEUED
+        spec.queued.release()
+        return index
+
+    def _result(
+        self, index: int, deadline: float, expires: Optional[float] = None
+    ) -> np.ndarray:
+        """Waits for a queued slot's output, copies it and frees the slot. If expires passes
+        before an inference process has picked the sample up, it is dropped and
+        DeadlineExceeded is raised."""
+        spec, views = self.spec, self.views
+        assert spec is not None and views is not None
+        done = False
+        if expires is not None and expires < deadline:
+            done = spec.done[index].acquire(timeout=max(0.0, expires - monotonic()))
+            if not done:
+                with spec.lock:
+                    if views.header[index, STATE] == QUEUED:
+                        free_slot(views, spec, index)
+                        count_dropped("inference_pool", "expired")
+                        raise DeadlineExceeded(
+                            "Deadline passed while queued for inference"
+                        )
+        if not done and not spec.done[index].acquire(
+            timeout=max(0.0, deadline - monotonic())
+        ):
+            with spec.lock:
+                if views.header[index, STATE] == QUEUED:
+                    free_slot(views, spec, index)
+                    raise InferenceProcessError("Inference timed out")
+                if views.header[index, STATE] == RUNNING:
+                    # The inference process frees the slot once it is done with it
+                    views.header[index, STATE] = ABANDONED
+                    raise InferenceProcessError("Inference timed out")
+            spec.done[index].acquire()  # finished in the meantime
+        with spec.lock:
+            state = views.header[index, STATE]
+            output = views.outputs[index, : views.header[index, OUTPUT_LEN]].copy()
+            free_slot(views, spec, index)
+        if state != DONE:
+            raise InferenceProcessError("Inference process failed")
+        return output
+
+    def submit(self, sample: np.ndarray) -> np.ndarray:
+        """Runs one sample through the model and returns its output row. The sample is dropped
+        if the current request's deadline passes while it is queued."""
+        expires = request_deadline()
+        timeout = monotonic() + self.timeout
+        return self._result(self._enqueue(sample, expires), timeout, expires)
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        """Runs a batch of samples through the model (the inference processes may batch
+        them with other workers' samples) and returns the (N, ...) outputs."""
+        deadline = monotonic() + self.timeout
+        indices: List[int] = []
+        outputs: List[np.ndarray] = []
+        failure: Optional[Exception] = None
+        try:
+            for sample in batch:
+                indices.append(self._enqueue(sample))
+        except (InferenceProcessError, ValueError) as exception:
+            failure = exception
+        # Every queued slot is waited for (and freed) even if another one failed
+        for index in indices:
+            try:
+                outputs.append(self._result(index, deadline))
+            except InferenceProcessError as exception:
+                failure = failure or exception
+        if failure is not None:
+            raise failure
+        return np.stack(outputs)
@@ -0,0 +1,32 @@
+"""This module implements the memory report used to compare per-process unique and shared memory."""
+from typing import Dict, Union
+
+SMAPS_FIELDS = {
+    "Rss": "rss_mb",
+    "Pss": "pss_mb",
+    "Shared_Clean": "shared_mb",
+    "Shared_Dirty": "shared_mb",
+    "Private_Clean": "uss_mb",
+    "Private_Dirty": "uss_mb",
+    "Swap": "swap_mb",
+}
+
+
+def memory_report(pid: Union[int, str] = "self") -> Dict[str, float]:
+    """Returns the resident memory of a process in MB, read from /proc/<pid>/smaps_rollup (Linux
+    4.14+): rss, uss (unique set size, pages only this process maps, i.e. what killing it would
+    free), shared (pages also mapped by other processes, e.g. copy-on-write pages a forked worker
+    has not written to yet), pss (rss with each shared page divided by the number of processes
+    sharing it, so that the pss of all workers adds up to their real footprint) and swap.
+    Returns an empty dictionary where smaps_rollup is not available."""
+    report: Dict[str, float] = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", encoding="ascii") as smaps_file:
+            for line in smaps_file:
+                fields = line.split()
+                key = SMAPS_FIELDS.get(fields[0].rstrip(":"))
+                if key and len(fields) >= 2:
+                    report[key] = report.get(key, 0.0) + int(fields[1]) / 1024
+    except (OSError, ValueError):
+        return {}
+    return {key: round(value, 1) for key, value in sorted(report.items())}
@@ -0,0 +1,228 @@
+"""This module implements the metrics published in Prometheus text format by /api/metrics: latency
+histograms per processing stage, and gauges and counters read from the rest of the app."""
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from time import perf_counter
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+LabelValuesType = Tuple[str, ...]
+
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+def format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    """Returns a Prometheus label set, e.g. {stage="decode",status="200"}."""
+    if not names:
+        return ""
+    escaped = (
+        str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        for value in values
+    )
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+def format_value(value: float) -> str:
+    """Returns a sample value the way Prometheus writes them."""
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Histogram:
+    """A histogram with one set of cumulative buckets per combination of label values."""
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labelnames: Sequence[str],
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> None:
+        """The +Inf bucket is implicit."""
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelValuesType, List[float]] = {}  # counts..., sum, count
+        self._lock = Lock()
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        """Records one observation."""
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0.0] * (len(self.buckets) + 3)
+            series[index] += 1  # index len(buckets) is the +Inf bucket
+            series[-2] += value
+            series[-1] += 1
+
+    def counts(self) -> Dict[LabelValuesType, float]:
+        """Returns the number of observations per combination of label values."""
+        with self._lock:
+            return {labels: values[-1] for labels, values in self._series.items()}
+
+    def render(self) -> Iterator[str]:
+        """Yields the histogram in Prometheus text format."""
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for labelvalues, values in sorted(series.items()):
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), values[:-2]):
+                cumulative += count
+                labels = format_labels(
+                    self.labelnames + ("le",), labelvalues + (format_value(bound),)
+                )
+                yield f"{self.name}_bucket{labels} {format_value(cumulative)}"
+            labels = format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}_sum{labels} {format_value(values[-2])}"
+            yield f"{self.name}_count{labels} {format_value(values[-1])}"
+
+
+class CallbackMetric:
+    """A gauge or counter whose samples are read from the app by a callback at scrape time,
+    e.g. cache counters that are kept elsewhere anyway."""
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        metric_type: str,
+        labelnames: Sequence[str],
+        callback: Callable[[], Dict[LabelValuesType, float]],
+    ) -> None:
+        """metric_type is "gauge" or "counter"."""
+        self.name = name
+        self.description = description
+        self.metric_type = metric_type
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def render(self) -> Iterator[str]:
+        """Yields the metric in Prometheus text format."""
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} {self.metric_type}"
+        for labelvalues, value in sorted(self.callback().items()):
+            labels = format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}{labels} {format_value(value)}"
+
+
+class StageRecorder:
+    """Collects the time a request spends in each processing stage. Each stage is only charged
+    its own time: a stage nested in another (e.g. decode within preprocess) is subtracted from
+    the outer one. Stages that run in several threads on behalf of the same request add up.
+    """
+
+    def __init__(self) -> None:
+        """Starts with no stages recorded."""
+        self.seconds: Dict[str, float] = {}
+        self._lock = Lock()
+
+    def add(self, name: str, seconds: float) -> None:
+        """Adds time to a stage."""
+        with self._lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+
+class _OpenStage:  # pylint: disable=too-few-public-methods
+    """A stage being timed, and the time spent so far in stages nested in it."""
+
+    def __init__(self) -> None:
+        """Starts with no nested time."""
+        self.nested_seconds = 0.0
+
+
+_recorder: ContextVar[Optional[StageRecorder]] = ContextVar("recorder", default=None)
+_open_stage: ContextVar[Optional[_OpenStage]] = ContextVar("open_stage", default=None)
+
+
+def start_recording() -> StageRecorder:
+    """Starts recording stages for the current request and returns the recorder. Code run on
+    other threads is recorded too if it runs in a copy of the request's context (see
+    contextvars.copy_context())."""
+    recorder = StageRecorder()
+    _recorder.set(recorder)
+    _open_stage.set(None)
+    return recorder
+
+
+def stop_recording() -> None:
+    """Stops recording stages for the current request."""
+    _recorder.set(None)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Context manager charging the enclosed block to a stage of the current request. Does
+    nothing (but time) outside of a request, e.g. on the micro-batcher's thread."""
+    recorder = _recorder.get()
+    if recorder is None:
+        yield
+        return
+    parent = _open_stage.get()
+    current = _OpenStage()
+    token = _open_stage.set(current)
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = perf_counter() - start
+        _open_stage.reset(token)
+        if parent is not None:
+            parent.nested_seconds += elapsed
+        recorder.add(name, elapsed - current.nested_seconds)
+
+
+@contextmanager
+def background_stage(name: str, endpoint: str) -> Iterator[None]:
+    """Context manager timing a stage that a request left running after its response was
+    sent (e.g. encoding a result for later download), recorded with status "background".
+    """
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(perf_counter() - start, name, endpoint, "background")
+
+
+STAGE_SECONDS = Histogram(
+    "ml_rest_api_stage_duration_seconds",
+    "Time spent by requests in each processing stage",
+    ("stage", "endpoint", "status"),
+)
+REQUEST_SECONDS = Histogram(
+    "ml_rest_api_request_duration_seconds",
+    "Time spent handling requests, streaming the response included",
+    ("endpoint", "status"),
+)
+
+metrics_registry: List = [
+    STAGE_SECONDS,
+    REQUEST_SECONDS,
+]  # pylint: disable=invalid-name
+
+
+def render() -> str:
+    """Returns every registered metric in Prometheus text format."""
+    lines: List[str] = []
+    for metric in metrics_registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -3,21 +3,20 @@
 from logging import Logger, getLogger
 from datetime import datetime, date
 from os.path import normpath, join, dirname
-from typing import Any, Iterable, Dict
+from typing import Any, Iterable, Dict, List, Tuple
 
 import numpy as np
-import traceback
-import pandas as pd
 import os
-import tensorflow as tf
-from keras import layers
-from tensorflow.keras.models  import load_model
 
-# from tensorflow.keras.models  import load_model
-from tensorflow.keras.preprocessing.image import load_img, img_to_array
-from tensorflow.keras.applications.efficientnet_v2 import preprocess_input
+# TensorFlow/Keras are imported lazily by init(), so that importing this module (e.g. to read
+# sample() while the app is being set up) doesn't pay for them.
+from ml_rest_api.imaging import to_model_input
+from ml_rest_api.settings import get_bool, get_int, get_list
+from ml_rest_api.startup import startup_timeline
+from ml_rest_api.thread_budget import record, threads_for
 
 import ast
+
 # import joblib
 
 log: Logger = getLogger(__name__)
@@ -28,58 +27,171 @@ def full_path(filename: str) -> str:
     return normpath(join(dirname(__file__), filename))
 
 
+# Set by the model registry for other versions
+MODEL_PATH: str = full_path("garbage_model")
 MODEL: Any = None
+# Batch size bucket -> concrete function, with MODEL_COMPILE
+COMPILED: Dict[int, Any] = {}
 # MODEL_SERVING_FUNCTION: Any = None
 
-def init() -> None:
-    """Loads the ML trained model (plus ancillary files) from file."""
-    global MODEL
 
-    from time import sleep  # pylint: disable=import-outside-toplevel
+def preload() -> None:
+    """Imports TensorFlow/Keras, so that worker processes forked afterwards share the imported
+    modules. The model itself is only loaded by init(), in each worker: loading it starts the
+    TensorFlow runtime's thread pools, which don't survive a fork (the first call would hang).
+    """
+    with startup_timeline.phase("tensorflow_import"):
+        import keras  # pylint: disable=import-outside-toplevel,unused-import
+
 
-    model_path = full_path("garbage_model")
+def init() -> None:
+    """Loads the ML trained model (plus ancillary files) from file. With MODEL_COMPILE, its
+    serving signature is wrapped in one compiled tf.function per batch size bucket instead of
+    a TFSMLayer."""
+    global MODEL, COMPILED
+
+    model_path = MODEL_PATH
     log.debug("Initialise model from file %s", model_path)
-    sleep(5)  # Fake delay to emulate a large model that takes a long time to load
-    
+
     if not os.path.exists(model_path):
         log.error(f"Model folder not found: {model_path}")
         raise FileNotFoundError(f"Model folder not found: {model_path}")
 
+    with startup_timeline.phase("tensorflow_import"):
+        from keras import layers  # pylint: disable=import-outside-toplevel
+    set_threads()
+
     try:
-        MODEL = layers.TFSMLayer(model_path, call_endpoint="serving_default")  # Load from folder
+        with startup_timeline.phase("model_load"):
+            if get_bool("MODEL_COMPILE"):
+                MODEL, COMPILED = compile_buckets(model_path, batch_buckets())
+            else:
+                MODEL = layers.TFSMLayer(
+                    model_path, call_endpoint="serving_default"
+                )  # Load from folder
+                COMPILED = {}
         log.info("Model loaded successfully.")
     except Exception as e:
         log.error(f"Failed to load model: {e}")
         raise
 
-def run(input_data: Dict[str, Any]) -> Dict[str, Any]:
-    """Makes a prediction using the trained ML model."""
-    log.info("Received input_data: %s", input_data)
 
+def set_threads() -> None:
+    """Sizes TensorFlow's intra-op pool to MODEL_THREADS, by default the worker's thread budget,
+    with a single inter-op thread: this model's ops run one after the other. TensorFlow only
+    takes them before its runtime starts, so a model loaded later in the same process (e.g. by
+    the model registry) keeps the sizes of the first."""
+    import tensorflow as tf  # pylint: disable=import-outside-toplevel
+
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(
+            threads_for("MODEL_THREADS")
+        )
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    except RuntimeError:
+        log.debug("TensorFlow's thread pools are already running")
+    threading = tf.config.threading
+    record("tensorflow_intra_op", threading.get_intra_op_parallelism_threads())
+    record("tensorflow_inter_op", threading.get_inter_op_parallelism_threads())
+
+
+def batch_buckets() -> List[int]:
+    """Returns the batch sizes compiled by compile_buckets(): MODEL_BATCH_BUCKETS, by default
+    the warmup batch sizes (so that every bucket is warmed up)."""
+    buckets: List[int] = [
+        int(bucket)
+        for bucket in get_list("MODEL_BATCH_BUCKETS") or get_list("WARMUP_BATCH_SIZES")
+    ] or [1, get_int("BATCH_MAX_SIZE")]
+    return sorted({max(1, bucket) for bucket in buckets})
+
+
+def compile_buckets(model_path: str, buckets: List[int]) -> Tuple[Any, Dict[int, Any]]:
+    """Loads the SavedModel and returns it with a concrete function per batch size bucket,
+    each calling its serving signature on a (bucket, 224, 224, 3) float32 input. Their shapes
+    are fixed, so they are traced once, here, and never retraced; with MODEL_JIT_COMPILE they
+    are also compiled by XLA, on their first call (i.e. by warmup())."""
+    import tensorflow as tf  # pylint: disable=import-outside-toplevel
+
+    loaded = tf.saved_model.load(model_path)
+    signature = loaded.signatures["serving_default"]
+    input_name = next(iter(signature.structured_input_signature[1]))
+    output_name = "output_0"
+    if output_name not in signature.structured_outputs:
+        raise KeyError(
+            f"Unexpected model output keys: {signature.structured_outputs.keys()}"
+        )
+
+    def serve(batch: Any) -> Any:
+        return signature(**{input_name: batch})[output_name]
+
+    compiled = {}
+    for bucket in buckets:
+        function = tf.function(serve, jit_compile=get_bool("MODEL_JIT_COMPILE"))
+        compiled[bucket] = function.get_concrete_function(
+            tf.TensorSpec((bucket, *INPUT_SHAPE), tf.float32)
+        )
+    return loaded, compiled
+
+
+INPUT_SHAPE = (224, 224, 3)
+
+
+def preprocess(input_data: Dict[str, Any]) -> np.ndarray:
+    """Decodes the input image and returns it as a single (224, 224, 3) model input.
+    input_data['image'] may hold encoded bytes, a decoded array or PIL image, or a file path.
+    """
+    # No scaling needed: EfficientNetV2 does its own, keras' efficientnet_v2.preprocess_input()
+    # is a pass-through kept for backward compatibility
+    return to_model_input(input_data["image"], size=INPUT_SHAPE[1::-1])
+
+
+def predict(batch: np.ndarray) -> np.ndarray:
+    """Runs the model on a (N, 224, 224, 3) batch and returns the (N, classes) probabilities."""
     if MODEL is None:
         raise ValueError("Model is not loaded. Please call init() first.")
 
-    # Load and preprocess the image
-    img_path = input_data['image']
-    img = load_img(img_path, target_size=(224, 224))  # Adjust size if needed
-    img_array = img_to_array(img)
-    img_array = np.expand_dims(img_array, axis=0)
-    img_array = preprocess_input(img_array)  # Use EfficientNetV2's preprocessing
+    if COMPILED:
+        return predict_compiled(batch)
 
-   
     # Run inference using TFSMLayer
-    predictions_dict = MODEL(img_array)
+    predictions_dict = MODEL(batch)
 
     # 🔍 Extract predictions from the correct key
     if "output_0" in predictions_dict:
-        predictions = predictions_dict["output_0"].numpy()[0]
-    else:
-        raise KeyError(f"Unexpected model output keys: {predictions_dict.keys()}")
-
-    print(f'predictions: {predictions}')
-
+        return predictions_dict["output_0"].numpy()
+    raise KeyError(f"Unexpected model output keys: {predictions_dict.keys()}")
+
+
+def predict_compiled(batch: np.ndarray) -> np.ndarray:
+    """Runs the batch through the smallest bucket that holds it, padded with zeros, or in
+    chunks of the largest bucket if none does."""
+    batch = np.asarray(batch, dtype=np.float32)
+    size = len(batch)
+    largest = max(COMPILED)
+    if size > largest:
+        chunks = [batch[start : start + largest] for start in range(0, size, largest)]
+        return np.concatenate([predict_compiled(chunk) for chunk in chunks])
+    bucket = min(bucket for bucket in COMPILED if bucket >= size)
+    if bucket > size:
+        padding = np.zeros((bucket - size, *batch.shape[1:]), dtype=np.float32)
+        batch = np.concatenate([batch, padding])
+    return COMPILED[bucket](batch).numpy()[:size]
+
+
+def warmup(batch_size: int) -> None:
+    """Runs the model on a synthetic (batch_size, 224, 224, 3) batch, so that the first real
+    request of that size doesn't pay for TensorFlow's one-off work (graph tracing, kernel
+    selection, memory allocation, XLA compilation of the batch size's bucket)."""
+    batch = np.random.default_rng(0).uniform(0, 255, (batch_size, *INPUT_SHAPE))
+    predict(batch.astype(np.float32))
+
+
+def postprocess(predictions: np.ndarray, input_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Turns one row of model probabilities into the label/accuracy response."""
     # Extract label and accuracy
-    waste_types = ast.literal_eval(input_data['classifiers'][0]) # Expecting a list of class names
+    waste_types = ast.literal_eval(
+        input_data["classifiers"][0]
+    )  # Expecting a list of class names
     index = np.argmax(predictions)
     waste_label = waste_types[index]
     accuracy = "{0:.2f}".format(predictions[index] * 100)
@@ -87,6 +199,18 @@ def run(input_data: Dict[str, Any]) -> Dict[str, Any]:
     return {"accuracy": accuracy, "label": waste_label}
 
 
+def run(input_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Makes a prediction using the trained ML model."""
+    log.debug("Received classifiers: %s", input_data.get("classifiers"))
+
+    if MODEL is None:
+        raise ValueError("Model is not loaded. Please call init() first.")
+
+    # Load and preprocess the image
+    img_array = np.expand_dims(preprocess(input_data), axis=0)
+    return postprocess(predict(img_array)[0], input_data)
+
+
 def sample() -> Dict:
     """Returns a sample input vector as a dictionary."""
     return {
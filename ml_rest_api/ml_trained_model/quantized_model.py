@@ -0,0 +1,303 @@
+"""Runs garbage_model through TensorFlow Lite or ONNX Runtime instead of TensorFlow. The
+SavedModel is converted once, optionally quantized, to an artifact cached under
+QUANTIZED_MODEL_CACHE_DIR; the artifact is rebuilt whenever the SavedModel changes. Decoding,
+preprocessing and postprocessing are those of ml_trained_model, so responses only differ by the
+runtime's numerical error. Select it with TRAINED_MODEL_MODULE_NAME=quantized_model, see
+QUANTIZED_MODEL_FORMAT and QUANTIZED_MODEL_PRECISION, and compare it with the SavedModel with
+python -m benchmarks.backends.
+
+The conversion itself needs TensorFlow (plus tf2onnx for ONNX, see requirements-onnx.txt) and
+runs in a subprocess, so that the converter's memory is returned once it is done and the
+process forking the workers doesn't start TensorFlow's threads."""
+import argparse
+import fcntl
+import hashlib
+import os
+import subprocess
+import sys
+import tempfile
+from logging import Logger, getLogger
+from threading import Lock
+from typing import Any, Dict, Tuple
+
+import numpy as np
+
+# preprocess(), postprocess() and sample() are those of ml_trained_model
+from ml_rest_api.ml_trained_model.ml_trained_model import (  # pylint: disable=unused-import
+    INPUT_SHAPE,
+    full_path,
+    postprocess,
+    preprocess,
+    sample,
+)
+from ml_rest_api.settings import get_value
+from ml_rest_api.startup import startup_timeline
+from ml_rest_api.thread_budget import record, threads_for
+
+log: Logger = getLogger(__name__)
+
+FORMATS = ("tflite", "onnx")
+PRECISIONS = ("fp32", "fp16", "int8")
+
+# Set by the model registry for other versions
+MODEL_PATH: str = full_path("garbage_model")
+RUNTIME: Any = None  # a TFLiteRuntime or an OnnxRuntime once init() has run
+
+
+def saved_model_path() -> str:
+    """Returns the path of the SavedModel the artifacts are converted from."""
+    return MODEL_PATH
+
+
+def fingerprint(model_path: str) -> str:
+    """Returns a short hash of the SavedModel's graph and variable index. The variable shards
+    themselves are left out: the index holds a checksum of every tensor they hold."""
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(model_path, followlinks=True):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.startswith("variables.data-"):
+                continue
+            path = os.path.join(root, filename)
+            digest.update(os.path.relpath(path, model_path).encode())
+            with open(path, mode="rb") as file:
+                digest.update(file.read())
+    return digest.hexdigest()[:16]
+
+
+def model_settings() -> Tuple[str, str]:
+    """Returns the validated QUANTIZED_MODEL_FORMAT and QUANTIZED_MODEL_PRECISION settings."""
+    model_format = str(get_value("QUANTIZED_MODEL_FORMAT")).lower()
+    precision = str(get_value("QUANTIZED_MODEL_PRECISION")).lower()
+    if model_format not in FORMATS:
+        raise ValueError(f"QUANTIZED_MODEL_FORMAT must be one of {FORMATS}")
+    if precision not in PRECISIONS:
+        raise ValueError(f"QUANTIZED_MODEL_PRECISION must be one of {PRECISIONS}")
+    return model_format, precision
+
+
+def artifact_path(model_format: str, precision: str) -> str:
+    """Returns where the artifact converted from the current SavedModel is cached."""
+    cache_dir = get_value("QUANTIZED_MODEL_CACHE_DIR") or full_path("converted")
+    model_path = saved_model_path()
+    name = f"{os.path.basename(model_path)}-{fingerprint(model_path)}-{precision}"
+    return os.path.join(cache_dir, f"{name}.{model_format}")
+
+
+def ensure_artifact(model_format: str, precision: str) -> str:
+    """Returns the path of the cached artifact, converting the SavedModel first if needed. A
+    lock file makes concurrent callers (e.g. workers started together) wait for a single
+    conversion."""
+    path = artifact_path(model_format, precision)
+    if os.path.exists(path):
+        return path
+    model_path = saved_model_path()
+    if not os.path.exists(model_path):
+        raise FileNotFoundError(f"Model folder not found: {model_path}")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    lock_path = os.path.join(os.path.dirname(path), ".lock")
+    with open(lock_path, mode="w", encoding="utf-8") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if not os.path.exists(path):
+            log.info("Converting %s to %s", model_path, path)
+            with startup_timeline.phase("model_conversion"):
+                subprocess.run(
+                    [sys.executable, "-m", __name__, "--convert", model_format]
+                    + [precision, path, model_path],
+                    check=True,
+                )
+    return path
+
+
+def convert_tflite(model_path: str, precision: str, output: str) -> None:
+    """Converts a SavedModel to TensorFlow Lite, with float16 weights or int8 dynamic range
+    quantization (int8 weights, float activations) if asked to."""
+    import tensorflow as tf  # pylint: disable=import-outside-toplevel
+
+    converter = tf.lite.TFLiteConverter.from_saved_model(model_path)
+    if precision != "fp32":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if precision == "fp16":
+        converter.target_spec.supported_types = [tf.float16]
+    with open(output, mode="wb") as file:
+        file.write(converter.convert())
+
+
+def convert_onnx(model_path: str, precision: str, output: str) -> None:
+    """Converts a SavedModel to ONNX with tf2onnx, then converts its weights to float16 or
+    quantizes them to int8 (dynamic range) with ONNX Runtime's tools if asked to."""
+    # pylint: disable=import-outside-toplevel
+    subprocess.run(
+        [sys.executable, "-m", "tf2onnx.convert", "--saved-model", model_path]
+        + ["--output", output, "--opset", "17"],
+        check=True,
+    )
+    if precision == "int8":
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        # Unsigned: ONNX Runtime's CPU ConvInteger kernel only takes uint8 weights
+        quantize_dynamic(output, output, weight_type=QuantType.QUInt8)
+    elif precision == "fp16":
+        import onnx  # pylint: disable=import-error
+        from onnxruntime.transformers.float16 import convert_float_to_float16
+
+        # keep_io_types: the inputs and outputs stay float32, like those of the SavedModel
+        model = convert_float_to_float16(onnx.load(output), keep_io_types=True)
+        onnx.save(model, output)
+
+
+def convert(model_format: str, precision: str, output: str, model_path: str) -> None:
+    """Converts the SavedModel at model_path to output, through a temporary file so that an
+    interrupted conversion never leaves a truncated artifact behind."""
+    fd, temp_path = tempfile.mkstemp(
+        suffix=f".{model_format}", dir=os.path.dirname(output)
+    )
+    os.close(fd)
+    try:
+        if model_format == "tflite":
+            convert_tflite(model_path, precision, temp_path)
+        else:
+            convert_onnx(model_path, precision, temp_path)
+        os.chmod(temp_path, 0o644)  # mkstemp() creates it readable by its owner only
+        os.replace(temp_path, output)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def tflite_interpreter_class() -> Any:
+    """Returns the TensorFlow Lite Interpreter class, from the standalone LiteRT or
+    tflite-runtime packages if one is installed, as they are much lighter than TensorFlow.
+    """
+    # pylint: disable=import-outside-toplevel
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite.python.interpreter import Interpreter
+    return Interpreter
+
+
+class TFLiteRuntime:
+    """Runs a TensorFlow Lite model. An interpreter is bound to one input shape and is not
+    thread-safe, so batches are padded to the next power of two and each of these batch sizes
+    gets its own interpreter, created on first use and used under its own lock."""
+
+    def __init__(self, path: str, threads: int) -> None:
+        """Reads the model from path. threads is the number of threads per interpreter (0 for
+        the default)."""
+        self.path = path
+        self.threads = threads or None
+        self.interpreter_class = tflite_interpreter_class()
+        self.interpreters: Dict[int, Tuple[Any, Lock]] = {}
+        self._lock = Lock()
+        self.interpreter(1)
+
+    def interpreter(self, batch_size: int) -> Tuple[Any, Lock]:
+        """Returns the interpreter for batch_size, and its lock."""
+        with self._lock:
+            if batch_size not in self.interpreters:
+                interpreter = self.interpreter_class(
+                    model_path=self.path, num_threads=self.threads
+                )
+                index = interpreter.get_input_details()[0]["index"]
+                interpreter.resize_tensor_input(index, (batch_size, *INPUT_SHAPE))
+                interpreter.allocate_tensors()
+                self.interpreters[batch_size] = (interpreter, Lock())
+            return self.interpreters[batch_size]
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        """Runs the model on a (N, 224, 224, 3) float32 batch."""
+        size = len(batch)
+        padded_size = 1 << (size - 1).bit_length()
+        if padded_size != size:
+            padding = np.zeros((padded_size - size, *batch.shape[1:]), batch.dtype)
+            batch = np.concatenate([batch, padding])
+        interpreter, lock = self.interpreter(padded_size)
+        with lock:
+            interpreter.set_tensor(interpreter.get_input_details()[0]["index"], batch)
+            interpreter.invoke()
+            output = interpreter.get_tensor(
+                interpreter.get_output_details()[0]["index"]
+            )
+        return output[:size]
+
+
+class OnnxRuntime:
+    """Runs an ONNX model in an ONNX Runtime session, which takes any batch size and can be
+    called from several threads at once."""
+
+    def __init__(self, path: str, threads: int) -> None:
+        """Creates a session for the model at path, with threads intra-op threads (0 for
+        ONNX Runtime's default)."""
+        import onnxruntime as ort  # pylint: disable=import-outside-toplevel
+
+        options = ort.SessionOptions()
+        if threads > 0:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(
+            path, options, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        """Runs the model on a (N, 224, 224, 3) float32 batch."""
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+def preload() -> None:
+    """Converts the SavedModel if its artifact isn't cached yet, so that the workers forked
+    afterwards all find it. The model itself is loaded by init(), in each worker: the runtimes'
+    thread pools don't survive a fork."""
+    ensure_artifact(*model_settings())
+
+
+def init() -> None:
+    """Loads the cached artifact (converting the SavedModel first if needed) into its
+    runtime."""
+    global RUNTIME  # pylint: disable=global-statement
+
+    model_format, precision = model_settings()
+    path = ensure_artifact(model_format, precision)
+    runtime_class = TFLiteRuntime if model_format == "tflite" else OnnxRuntime
+    with startup_timeline.phase("model_load"):
+        threads = threads_for("QUANTIZED_MODEL_THREADS")
+        RUNTIME = runtime_class(path, threads)
+    record(f"{model_format}_intra_op", threads)
+    log.info("Model loaded from %s", path)
+
+
+def predict(batch: np.ndarray) -> np.ndarray:
+    """Runs the model on a (N, 224, 224, 3) batch and returns the (N, classes) probabilities."""
+    if RUNTIME is None:
+        raise ValueError("Model is not loaded. Please call init() first.")
+    return RUNTIME.predict(np.ascontiguousarray(batch, dtype=np.float32))
+
+
+def warmup(batch_size: int) -> None:
+    """Runs the model on a synthetic (batch_size, 224, 224, 3) batch, which also creates the
+    interpreter for that batch size."""
+    batch = np.random.default_rng(0).uniform(0, 255, (batch_size, *INPUT_SHAPE))
+    predict(batch.astype(np.float32))
+
+
+def run(input_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Makes a prediction using the converted model."""
+    img_array = np.expand_dims(preprocess(input_data), axis=0)
+    return postprocess(predict(img_array)[0], input_data)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--convert",
+        nargs=4,
+        metavar=("FORMAT", "PRECISION", "OUTPUT", "SAVED_MODEL"),
+        required=True,
+        help="convert SAVED_MODEL to OUTPUT (called by ensure_artifact())",
+    )
+    arguments = parser.parse_args()
+    convert(*arguments.convert)
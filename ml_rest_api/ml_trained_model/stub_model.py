@@ -0,0 +1,78 @@
+"""Deterministic stand-in for the trained model, used by the benchmark suite. It decodes and
+preprocesses images like ml_trained_model, but replaces the network with a cheap fixed function
+of the input, so that predictions only depend on the image and timings on the serving path.
+Select it with TRAINED_MODEL_MODULE_NAME=stub_model."""
+import ast
+from datetime import date, datetime
+from typing import Any, Dict, List
+
+import numpy as np
+
+from ml_rest_api.imaging import to_model_input
+
+INPUT_SHAPE = (224, 224, 3)
+CLASS_COUNT = 6
+
+WEIGHTS: Any = None
+
+
+def init() -> None:
+    """Creates the fixed (3, CLASS_COUNT) weights mapping mean colours to class scores."""
+    global WEIGHTS  # pylint: disable=global-statement
+    WEIGHTS = np.random.default_rng(0).normal(size=(3, CLASS_COUNT)).astype(np.float32)
+
+
+def preprocess(input_data: Dict[str, Any]) -> np.ndarray:
+    """Decodes the input image to a single (224, 224, 3) model input."""
+    return to_model_input(input_data["image"], size=INPUT_SHAPE[1::-1])
+
+
+def predict(batch: np.ndarray) -> np.ndarray:
+    """Returns (N, CLASS_COUNT) softmax scores computed from each image's mean colour."""
+    if WEIGHTS is None:
+        raise ValueError("Model is not loaded. Please call init() first.")
+    logits = (batch.mean(axis=(1, 2)) / 255) @ WEIGHTS * 4
+    scores = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return scores / scores.sum(axis=1, keepdims=True)
+
+
+def warmup(batch_size: int) -> None:
+    """Runs predict() on a blank batch."""
+    predict(np.zeros((batch_size, *INPUT_SHAPE), dtype=np.float32))
+
+
+def class_names(input_data: Dict[str, Any]) -> List[str]:
+    """Returns the class names sent with the request, either as a single list literal (like
+    ml_trained_model expects) or as repeated values."""
+    classifiers = input_data.get("classifiers") or []
+    if len(classifiers) == 1 and classifiers[0].lstrip().startswith("["):
+        return list(ast.literal_eval(classifiers[0]))
+    return list(classifiers)
+
+
+def postprocess(predictions: np.ndarray, input_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Turns one row of scores into the label/accuracy response."""
+    names = class_names(input_data) or [str(index) for index in range(CLASS_COUNT)]
+    index = int(np.argmax(predictions))
+    return {
+        "accuracy": f"{predictions[index] * 100:.2f}",
+        "label": names[index % len(names)],
+    }
+
+
+def run(input_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Makes a prediction for a single input."""
+    batch = np.expand_dims(preprocess(input_data), axis=0)
+    return postprocess(predict(batch)[0], input_data)
+
+
+def sample() -> Dict:
+    """Returns a sample input vector as a dictionary."""
+    return {
+        "int_param": 10,
+        "string_param": "foobar",
+        "float_param": 0.1,
+        "bool_param": True,
+        "datetime_param": datetime.now().isoformat() + "Z",
+        "date_param": date.today().isoformat(),
+    }
@@ -1,31 +1,86 @@
 """This module implements the TrainedModelWrapper class."""
 import os
 import os.path
+import sys
 import importlib
-from threading import Thread
+import importlib.util
+from contextvars import copy_context
+from logging import Logger, getLogger
+from concurrent.futures import Executor, Future
+from threading import Lock, Thread
 from types import ModuleType
-from typing import Optional, Iterable, Callable, Dict
-from ml_rest_api.settings import get_value
+from typing import Optional, Iterable, Iterator, Callable, Dict, List
+import numpy as np
+from ml_rest_api.admission import Overloaded
+from ml_rest_api.settings import get_value, get_bool, get_int, get_float, get_list
+from ml_rest_api.batching import MicroBatcher
+from ml_rest_api.forking import after_fork_in_child
+from ml_rest_api.inference_pool import InferencePool, InferenceProcessError
+from ml_rest_api.metrics import stage
+from ml_rest_api.startup import Warmup
+from ml_rest_api.thread_budget import worker_count
 
 WrapperCallableType = Optional[Callable]
 
+UNREADABLE_INPUT = "Unreadable input"
 
-class TrainedModelWrapper:
+log: Logger = getLogger(__name__)
+
+
+def check_shared_pool() -> None:
+    """Raises ValueError if INFERENCE_PROCESSES is set where several web workers would each
+    start their own inference processes: under gunicorn (or uWSGI) without pre-fork mode, or
+    with WEB_CONCURRENCY above 1. The pool is only shared when the process loading the app
+    forks the workers afterwards (see gunicorn_prefork.py)."""
+    if get_bool("PREFORK_INIT"):
+        return
+    if "gunicorn" in sys.modules or "uwsgi" in sys.modules or worker_count() > 1:
+        raise ValueError(
+            "INFERENCE_PROCESSES needs pre-fork mode (gunicorn -c "
+            "python:ml_rest_api.gunicorn_prefork) or a single web process: each worker "
+            "would start inference processes of its own"
+        )
+
+
+class TrainedModelWrapper:  # pylint: disable=too-many-instance-attributes
     """TrainedModelWrapper class acts as adapter for programmatically chosen ML trained model
     module. The init(), run() and sample() methods call the module's identically named methods.
+    If the module also exposes preprocess(), predict() and postprocess(), run() sends the
+    preprocessed sample through a MicroBatcher so that concurrent requests share forward passes.
+    An optional preload() loads whatever can be shared with worker processes forked afterwards,
+    and an optional warmup(batch_size) runs the model on a synthetic batch once it is loaded.
+    With INFERENCE_PROCESSES, predict() runs in an InferencePool instead of this process.
     """
 
     def __init__(self) -> None:
         """Initialise everything to None, particularly init, run, sample and ready methods."""
+        self._preload: WrapperCallableType = None
         self._init: WrapperCallableType = None
         self._run: WrapperCallableType = None
         self._sample: WrapperCallableType = None
+        self._preprocess: WrapperCallableType = None
+        self._predict: WrapperCallableType = None
+        self._postprocess: WrapperCallableType = None
+        self._warmup: WrapperCallableType = None
+        self.warmup = Warmup("model_warmup")
+        self.batcher: Optional[MicroBatcher] = None
+        self.pool: Optional[InferencePool] = None
+        self.preloaded: bool = False
         self.initialised: bool = False
+        self.forked: bool = False
+        self._init_lock = Lock()
+        after_fork_in_child(self._after_fork)
         self.module_name: Optional[str] = None
         self.module: Optional[ModuleType] = None
 
-    def load(self, module_name: str) -> None:
-        """Loads a Python module, binding the init, run and sample callable methods."""
+    def load(
+        self, module_name: str, model_path: str = "", private: bool = False
+    ) -> None:
+        """Loads a Python module, binding the init, run and sample callable methods. model_path
+        points the module at another version of its model (it must have a MODEL_PATH). A
+        private module is a new instance of the module, whose globals (e.g. the loaded model)
+        are separate from those of the imported module and of other private instances.
+        """
 
         def find_callable(callable_name: str) -> WrapperCallableType:
             """Returns a named attibute if it exists and it's callable"""
@@ -36,18 +91,50 @@ class TrainedModelWrapper:
             return None
 
         self.module_name, _ = os.path.splitext(module_name)
-        self.module = importlib.import_module(
-            "ml_rest_api.ml_trained_model." + self.module_name
-        )
+        qualified_name = "ml_rest_api.ml_trained_model." + self.module_name
+        module: ModuleType
+        if private:
+            spec = importlib.util.find_spec(qualified_name)
+            if spec is None or spec.loader is None:
+                raise ModuleNotFoundError(f"No module named {qualified_name}")
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+        else:
+            module = importlib.import_module(qualified_name)
+        self.module = module
+        if model_path:
+            if not hasattr(module, "MODEL_PATH"):
+                raise ValueError(f"{self.module_name} doesn't take a model path")
+            setattr(module, "MODEL_PATH", model_path)
+        self._preload = find_callable("preload")
         self._init = find_callable("init")
         self._run = find_callable("run")
         self._sample = find_callable("sample")
+        self._preprocess = find_callable("preprocess")
+        self._predict = find_callable("predict")
+        self._postprocess = find_callable("postprocess")
+        self._warmup = find_callable("warmup")
+        self.batcher = None
+        self.pool = None
+        if self._predict and self.supports_batching():
+            if get_int("INFERENCE_PROCESSES") > 0:
+                check_shared_pool()
+                # The inference processes batch samples from every worker themselves
+                self.pool = InferencePool(self.module_name, load_predict, model_path)
+                self._predict = self.pool.predict
+            elif get_int("BATCH_MAX_SIZE") > 1:
+                self.batcher = MicroBatcher(
+                    self._predict,
+                    max_batch_size=get_int("BATCH_MAX_SIZE"),
+                    max_wait=get_float("BATCH_MAX_WAIT_MS") / 1000,
+                )
 
     @staticmethod
     def find_first_module() -> str:
         """Finds first available module (the first Python module found in the current dir that is
-        not this wrapper or starts with __). Returns the name minus .py extension"""
-        for filename in os.listdir(os.path.dirname(__file__)):
+        not this wrapper or starts with __), in alphabetical order. Returns the name minus .py
+        extension"""
+        for filename in sorted(os.listdir(os.path.dirname(__file__))):
             if len(filename) < 2:
                 continue  # too short a filename
             if filename[0:2] == "__":
@@ -70,26 +157,189 @@ class TrainedModelWrapper:
             self.load(env_model_name)
 
     def ready(self) -> bool:
-        """Returns whether the model was initialised and a wrapped run() method can be called"""
-        return bool(self._run) and self.initialised
+        """Returns whether the model was initialised and warmed up and a wrapped run() method can
+        be called"""
+        return (
+            bool(self._run)
+            and self.initialised
+            and self.warmup.warm()
+            and (self.pool is None or self.pool.ready())
+        )
+
+    def supports_batching(self) -> bool:
+        """Returns whether the module splits run() into preprocess(), predict() and
+        postprocess()"""
+        return bool(self._preprocess and self._predict and self._postprocess)
 
     def multithreaded_init(self) -> None:
-        """Calls self.init() to load the model in a separate thread."""
-        if self._init:
+        """Calls self.init() to load the model in a separate thread. With PREFORK_INIT, the
+        process that forks the workers must not start threads (they would not exist in the
+        workers, leaving whatever they hold locked), so it only calls self.preload(), inline,
+        and each worker calls init() once forked."""
+        if get_bool("PREFORK_INIT") and not self.forked:
+            self.preload()
+        elif self._init:
             Thread(target=self.init).start()
 
+    def preload(self) -> None:
+        """Calls the wrapped preload() method if it's assigned, or starts the inference pool,
+        at most once. It must not start threads: it runs before the worker processes are
+        forked."""
+        with self._init_lock:
+            if self.preloaded:
+                return
+            if self.pool:
+                self.pool.start()
+            elif self._preload:
+                self._preload()
+            else:
+                return
+            self.preloaded = True
+
+    def _after_fork(self) -> None:
+        """Runs in a newly forked child process."""
+        self.forked = True
+
+    def close(self) -> None:
+        """Stops the micro-batcher's thread and the inference pool, and drops them and the
+        module, so that the model can be freed once nothing else refers to it. Only call it
+        once no request is using the model any more."""
+        if self.batcher:
+            self.batcher.close()
+        if self.pool:
+            self.pool.stop()
+        self.batcher = None
+        self.pool = None
+        self._preload = self._init = self._run = self._sample = None
+        self._preprocess = self._predict = self._postprocess = self._warmup = None
+        self.module = None
+
     def init(self) -> None:
-        """Calls the wrapped init() method if it's assigned."""
-        if self._init and not self.initialised:
-            self._init()
+        """Calls the wrapped init() method if it's assigned, or starts the inference pool, at
+        most once even if called from several threads, then warms the model up."""
+        with self._init_lock:
+            if self.initialised:
+                return
+            if self.pool:
+                self.pool.start()
+            elif self._init:
+                self._init()
+            else:
+                return
             self.initialised = True
+            self.warmup.run(self.warm_up)
+
+    @staticmethod
+    def warmup_batch_sizes() -> List[int]:
+        """Returns the WARMUP_BATCH_SIZES setting, by default 1 and BATCH_MAX_SIZE (the batch
+        sizes served most often)."""
+        batch_sizes: List[int] = [
+            int(batch_size) for batch_size in get_list("WARMUP_BATCH_SIZES")
+        ] or [1, get_int("BATCH_MAX_SIZE")]
+        return sorted({max(1, batch_size) for batch_size in batch_sizes})
 
-    def run(self, data: Iterable) -> Dict:
-        """Calls the wrapped run() method if it's assigned."""
+    def warm_up(self) -> bool:
+        """Calls the wrapped warmup() method WARMUP_ITERATIONS times for each warmup batch
+        size. Returns False if there is nothing to do. With an inference pool, waits until
+        the inference processes have warmed themselves up instead."""
+        if self.pool:
+            timeout = get_float("INFERENCE_START_TIMEOUT_SECONDS")
+            if not self.pool.wait_ready(timeout):
+                raise InferenceProcessError(
+                    f"Inference processes not ready in {timeout}s"
+                )
+            return True
+        iterations = get_int("WARMUP_ITERATIONS")
+        if not self._warmup or iterations <= 0:
+            return False
+        for batch_size in self.warmup_batch_sizes():
+            for _ in range(iterations):
+                self._warmup(batch_size)
+        return True
+
+    def run(self, data: Dict) -> Dict:
+        """Calls the wrapped run() method if it's assigned, or the batched
+        preprocess() -> predict() -> postprocess() pipeline if batching is enabled."""
+        if self.batcher or self.pool:
+            sample = self.preprocess(data)
+            with stage("inference"):  # includes waiting for the batch to fill
+                if self.batcher:
+                    row = self.batcher.submit(sample)
+                else:
+                    row = self.pool.submit(sample)  # type: ignore
+            return self.postprocess(row, data)
         if self._run:
-            return self._run(data)
+            with stage("inference"):
+                return self._run(data)
         return {}
 
+    def preprocess(self, data: Dict) -> np.ndarray:
+        """Calls the wrapped preprocess() method as the preprocess stage."""
+        with stage("preprocess"):
+            return self._preprocess(data)  # type: ignore
+
+    def postprocess(self, row: np.ndarray, data: Dict) -> Dict:
+        """Calls the wrapped postprocess() method as the postprocess stage."""
+        with stage("postprocess"):
+            return self._postprocess(row, data)  # type: ignore
+
+    def run_many(
+        self, inputs: Iterable[Dict], executor: Optional[Executor] = None
+    ) -> Iterator[Dict]:
+        """Yields one result per input, in order. Inputs are preprocessed in parallel on the
+        executor (if given, and on the calling thread when its queue is full) while earlier ones
+        go through predict() in chunks of up to BATCH_MAX_SIZE, so results become available
+        chunk by chunk. An input that fails to preprocess yields an {"error": UNREADABLE_INPUT}
+        result instead of failing the others (its exception is logged, as it may describe the
+        server's buffers rather than the input)."""
+        inputs = list(inputs)
+        if not self.supports_batching():
+            yield from (self.run(data) for data in inputs)
+            return
+        futures: List[Future] = []
+        for data in inputs:
+            if executor:
+                try:
+                    # In a copy of the request's context, so that its stages are recorded
+                    futures.append(
+                        executor.submit(copy_context().run, self.preprocess, data)
+                    )
+                    continue
+                except Overloaded:
+                    pass  # the executor's queue is full: preprocess it on this thread
+            futures.append(Future())
+            try:
+                futures[-1].set_result(self.preprocess(data))
+            except Exception as exception:  # pylint: disable=broad-except
+                futures[-1].set_exception(exception)
+        chunk_size = max(1, get_int("BATCH_MAX_SIZE"))
+        for start in range(0, len(inputs), chunk_size):
+            results: List[Optional[Dict]] = []
+            samples: List[np.ndarray] = []
+            for index, future in enumerate(futures[start : start + chunk_size]):
+                try:
+                    samples.append(future.result())
+                    results.append(None)  # filled in after the forward pass
+                except Exception as exception:  # pylint: disable=broad-except
+                    log.info(
+                        "Input %d failed to preprocess: %s", start + index, exception
+                    )
+                    results.append({"error": UNREADABLE_INPUT})
+            if samples:
+                with stage("inference"):
+                    outputs = iter(self._predict(np.stack(samples)))  # type: ignore
+                with stage("postprocess"):
+                    for index, result in enumerate(results):
+                        if result is None:
+                            row = next(outputs, None)
+                            if row is None:
+                                raise ValueError(
+                                    f"predict() returned fewer than {len(samples)} rows"
+                                )
+                            data = inputs[start + index]
+                            results[index] = self._postprocess(row, data)  # type: ignore
+            yield from results  # type: ignore
+
     def sample(self) -> Dict:
         """Calls the wrapped sample() method if it's assigned."""
         if self._sample:
@@ -97,5 +347,14 @@ class TrainedModelWrapper:
         return {}
 
 
+def load_predict(module_name: str, model_path: str) -> Callable:
+    """Loads and initialises a model module in an inference process of an InferencePool and
+    returns its predict()."""
+    wrapper = TrainedModelWrapper()
+    wrapper.load(module_name, model_path)
+    wrapper.init()
+    return wrapper.module.predict  # type: ignore
+
+
 trained_model_wrapper = TrainedModelWrapper()  # pylint: disable=invalid-name
 trained_model_wrapper.load_default_module()
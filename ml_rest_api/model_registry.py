@@ -0,0 +1,391 @@
+"""This module implements the ModelRegistry class."""
+import gc
+import importlib.util
+import json
+import os
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from itertools import count
+from logging import Logger, getLogger
+from threading import Lock, Thread
+from time import monotonic
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from ml_rest_api.memory import memory_report
+from ml_rest_api.ml_trained_model.wrapper import (
+    TrainedModelWrapper,
+    trained_model_wrapper,
+)
+from ml_rest_api.settings import get_value
+
+log: Logger = getLogger(__name__)
+
+ModelSpecType = Tuple[str, str]  # (module name, version)
+
+REFRESH_INTERVAL_SECONDS = 1.0
+
+
+class UnknownModelError(LookupError):
+    """A request named a model that isn't in the registry."""
+
+
+def model_dir() -> str:
+    """Returns the directory holding the model versions (MODEL_DIR, by default the model
+    modules' directory, which holds garbage_model)."""
+    return get_value("MODEL_DIR") or os.path.join(
+        os.path.dirname(__file__), "ml_trained_model"
+    )
+
+
+def parse_models(value: str) -> Dict[str, ModelSpecType]:
+    """Parses the MODELS setting: comma-separated name=module or name=module:version entries,
+    the first being the default model."""
+    specs: Dict[str, ModelSpecType] = {}
+    for entry in value.split(","):
+        if not entry.strip():
+            continue
+        name, _, target = entry.partition("=")
+        module_name, _, version = target.partition(":")
+        if not name.strip() or not module_name.strip():
+            raise ValueError(f"Invalid MODELS entry: {entry}")
+        specs[name.strip()] = (module_name.strip(), version.strip())
+    return specs
+
+
+class ModelEntry:
+    """One loaded model: a TrainedModelWrapper with its own module instance, and the number of
+    requests using it."""
+
+    _generations = count(1)
+
+    def __init__(
+        self, name: str, module_name: str, version: str, wrapper: TrainedModelWrapper
+    ) -> None:
+        """Wraps an already loaded (but not initialised) wrapper."""
+        self.name = name
+        self.module_name = module_name
+        self.version = version
+        self.wrapper = wrapper
+        # Tells this model's results apart from those of other models and earlier versions
+        self.cache_id = f"{name}@{next(self._generations)}"
+        self.state = "loading"
+        self.loaded_at: Optional[str] = None
+        self.load_memory: Dict[str, float] = {}
+        self.in_flight = 0
+        self.retired = False
+
+    def init(self) -> None:
+        """Loads and warms up the model, recording how much memory that took (approximate if
+        other models load at the same time)."""
+        before = memory_report()
+        try:
+            self.wrapper.init()
+        except Exception:
+            log.exception("Loading model %s failed", self.cache_id)
+            self.state = "failed"
+            raise
+        after = memory_report()
+        self.load_memory = {
+            key: round(after[key] - before.get(key, 0.0), 1) for key in after
+        }
+        self.loaded_at = datetime.now(timezone.utc).isoformat()
+        self.state = "ready" if self.wrapper.warmup.warm() else "failed"
+
+    def report(self) -> Dict[str, Any]:
+        """Returns the entry's state and memory use, as listed by /model/registry."""
+        report: Dict[str, Any] = {
+            "module": self.module_name,
+            "version": self.version,
+            "id": self.cache_id,
+            "state": self.state,
+            "ready": self.wrapper.ready() if not self.retired else False,
+            "in_flight": self.in_flight,
+            "loaded_at": self.loaded_at,
+            "warmup": self.wrapper.warmup.report(),
+            "load_memory": self.load_memory,
+        }
+        if self.wrapper.pool:
+            report["inference_process_memory"] = self.wrapper.pool.memory()
+        return report
+
+
+class ModelRegistry:
+    """ModelRegistry serves several named models (other modules, or other versions of a
+    model in MODEL_DIR) side by side. Requests pick one by name, the first one by default.
+    Loading a model under an existing name swaps it in once it is loaded and warmed up,
+    while the requests already using the previous one finish on it; that one is then closed.
+    With MODEL_REGISTRY_FILE, the registry is kept in that JSON file, and every worker
+    process applies its changes."""
+
+    def __init__(self) -> None:
+        """Creates the configured entries. Models are loaded by init()."""
+        self.registry_file: str = get_value("MODEL_REGISTRY_FILE") or ""
+        self._file_mtime: Optional[float] = None
+        self._next_refresh = 0.0
+        self._lock = Lock()
+        self.specs: Dict[str, ModelSpecType] = (
+            self.read_registry_file()
+            or parse_models(str(get_value("MODELS") or ""))
+            or {"default": (trained_model_wrapper.module_name or "", "")}
+        )
+        self.entries: Dict[str, ModelEntry] = {}
+        self.loading: Dict[str, ModelEntry] = {}
+        for name, (module_name, version) in self.specs.items():
+            if self.shares_default_wrapper(module_name, version) and not any(
+                entry.wrapper is trained_model_wrapper
+                for entry in self.entries.values()
+            ):
+                # The app's own wrapper, so that pre-fork mode and the inference processes
+                # keep working as they do without a registry
+                wrapper = trained_model_wrapper
+            else:
+                wrapper = self.new_wrapper(module_name, version)
+            self.entries[name] = ModelEntry(name, module_name, version, wrapper)
+
+    @property
+    def default_name(self) -> str:
+        """Returns the name of the default model: the first one served, in the order of the
+        registry (the first one may still be loading)."""
+        return next(
+            (name for name in self.specs if name in self.entries),
+            next(iter(self.specs)),
+        )
+
+    @staticmethod
+    def shares_default_wrapper(module_name: str, version: str) -> bool:
+        """Returns whether a model is the one the app's own wrapper loads."""
+        return not version and module_name == trained_model_wrapper.module_name
+
+    @staticmethod
+    def model_path(module_name: str, version: str) -> str:
+        """Checks that module_name is a model module and version (if given) a directory in
+        MODEL_DIR, and returns the version's path ("" for the module's default model).
+        """
+        if (
+            not module_name.isidentifier()
+            or module_name == "wrapper"
+            or importlib.util.find_spec(f"ml_rest_api.ml_trained_model.{module_name}")
+            is None
+        ):
+            raise ValueError(f"Unknown model module: {module_name}")
+        if not version:
+            return ""
+        if os.path.basename(version) != version or version.startswith("."):
+            raise ValueError(f"Invalid model version: {version}")
+        path = os.path.join(model_dir(), version)
+        if not os.path.isdir(path):
+            raise ValueError(f"Model version not found: {version}")
+        return path
+
+    def new_wrapper(self, module_name: str, version: str) -> TrainedModelWrapper:
+        """Returns a wrapper loading a private instance of module_name, pointed at version if
+        given."""
+        wrapper = TrainedModelWrapper()
+        wrapper.load(module_name, self.model_path(module_name, version), private=True)
+        return wrapper
+
+    def preload(self) -> None:
+        """Calls every model's preload() (see TrainedModelWrapper.preload)."""
+        for entry in list(self.entries.values()):
+            entry.wrapper.preload()
+
+    def init(self) -> None:
+        """Loads and warms up every configured model, one after the other."""
+        for entry in list(self.entries.values()):
+            if entry.state == "loading":
+                entry.init()
+
+    def ready(self) -> bool:
+        """Returns whether every model being served is loaded and warmed up (models loading
+        to replace others don't count: the ones they replace are still served)."""
+        return all(entry.wrapper.ready() for entry in list(self.entries.values()))
+
+    @property
+    def default_wrapper(self) -> TrainedModelWrapper:
+        """Returns the wrapper of the default model."""
+        return self.entries[self.default_name].wrapper
+
+    def acquire(self, name: Optional[str] = None) -> ModelEntry:
+        """Returns the entry of the named model (or of the default one), counting the caller
+        as using it until it calls release(). Raises UnknownModelError if there is none.
+        """
+        self.refresh()
+        with self._lock:
+            entry = self.entries.get(name or self.default_name)
+            if entry is None:
+                raise UnknownModelError(name)
+            entry.in_flight += 1
+            return entry
+
+    def release(self, entry: ModelEntry) -> None:
+        """Stops counting a caller of acquire() as using the entry, and closes the entry if it
+        was the last one using a replaced or unloaded model."""
+        with self._lock:
+            entry.in_flight -= 1
+            close = entry.retired and entry.in_flight == 0
+        if close:
+            self.close(entry)
+
+    @contextmanager
+    def use(self, name: Optional[str] = None) -> Iterator[ModelEntry]:
+        """Context manager around acquire() and release()."""
+        entry = self.acquire(name)
+        try:
+            yield entry
+        finally:
+            self.release(entry)
+
+    def _load(self, name: str, module_name: str, version: str) -> None:
+        """Loads a model in a background thread, to be swapped in by _swap()."""
+        entry = ModelEntry(
+            name, module_name, version, self.new_wrapper(module_name, version)
+        )
+        with self._lock:
+            self.loading[name] = entry
+        Thread(target=self._swap, args=(entry,), name=f"model-load-{name}").start()
+
+    def _swap(self, entry: ModelEntry) -> None:
+        """Loads an entry, then serves it in place of the model of the same name, if it is
+        still wanted and was loaded and warmed up successfully."""
+        try:
+            entry.init()
+        except Exception:  # pylint: disable=broad-except
+            pass  # logged, and recorded in entry.state
+        replaced: Optional[ModelEntry] = None
+        with self._lock:
+            if self.loading.get(entry.name) is entry:
+                del self.loading[entry.name]
+                if entry.state == "ready":
+                    replaced = self.entries.get(entry.name)
+                    self.entries[entry.name] = entry
+        if self.entries.get(entry.name) is not entry:
+            log.error("Model %s not swapped in (%s)", entry.cache_id, entry.state)
+            self.retire(entry)
+        elif replaced is not None:
+            log.info("Model %s replaced by %s", replaced.cache_id, entry.cache_id)
+            self.retire(replaced)
+        else:
+            log.info("Model %s loaded", entry.cache_id)
+
+    def retire(self, entry: ModelEntry) -> None:
+        """Marks an entry as no longer served, closing it now if no request is using it."""
+        with self._lock:
+            entry.retired = True
+            close = entry.in_flight == 0
+        if close:
+            self.close(entry)
+
+    @staticmethod
+    def close(entry: ModelEntry) -> None:
+        """Closes a retired entry's wrapper and collects its model."""
+        entry.state = "unloaded"
+        entry.wrapper.close()
+        gc.collect()
+        log.info("Model %s unloaded", entry.cache_id)
+
+    def apply(self, specs: Dict[str, ModelSpecType]) -> None:
+        """Serves the models in specs, the first one being the default: loads those not
+        served (or loading) as specified yet, and unloads the others."""
+        if not specs:
+            raise ValueError("The registry needs at least one model")
+        with self._lock:
+            removed = [
+                self.entries.pop(name)
+                for name in list(self.entries)
+                if name not in specs
+            ]
+            for name in [name for name in self.loading if name not in specs]:
+                del self.loading[name]  # retired by _swap() once loaded
+            self.specs = dict(specs)
+        for entry in removed:
+            self.retire(entry)
+        for name, spec in specs.items():
+            current = self.loading.get(name) or self.entries.get(name)
+            if current is None or (current.module_name, current.version) != spec:
+                self._load(name, *spec)
+
+    def read_registry_file(self) -> Optional[Dict[str, ModelSpecType]]:
+        """Returns the models in MODEL_REGISTRY_FILE, or None if it isn't set, doesn't exist
+        or didn't change since it was last read."""
+        if not self.registry_file:
+            return None
+        try:
+            mtime = os.stat(self.registry_file).st_mtime
+        except FileNotFoundError:
+            return None
+        if mtime == self._file_mtime:
+            return None
+        self._file_mtime = mtime
+        with open(self.registry_file, encoding="utf-8") as registry_file:
+            models = json.load(registry_file)["models"]
+        if not models:
+            raise ValueError(f"No models in {self.registry_file}")
+        return {
+            name: (spec["module"], spec.get("version", ""))
+            for name, spec in models.items()
+        }
+
+    def write_registry_file(self) -> None:
+        """Writes self.specs to MODEL_REGISTRY_FILE (if set), atomically."""
+        if not self.registry_file:
+            return
+        models = {
+            name: {"module": module_name, "version": version}
+            for name, (module_name, version) in self.specs.items()
+        }
+        temp_path = f"{self.registry_file}.{os.getpid()}.tmp"
+        with open(temp_path, mode="w", encoding="utf-8") as registry_file:
+            json.dump({"models": models}, registry_file, indent=2)
+        os.replace(temp_path, self.registry_file)
+        self._file_mtime = os.stat(self.registry_file).st_mtime
+
+    def refresh(self) -> None:
+        """Applies changes made to MODEL_REGISTRY_FILE by other processes, checking it at
+        most once a second."""
+        if not self.registry_file or monotonic() < self._next_refresh:
+            return
+        self._next_refresh = monotonic() + REFRESH_INTERVAL_SECONDS
+        try:
+            specs = self.read_registry_file()
+            if specs:
+                self.apply(specs)
+        except Exception:  # pylint: disable=broad-except
+            log.exception("Could not apply %s", self.registry_file)
+
+    def update(self, specs: Dict[str, ModelSpecType]) -> None:
+        """Applies specs here and, through MODEL_REGISTRY_FILE, in every other worker."""
+        self.apply(specs)
+        self.write_registry_file()
+
+    def put(self, name: str, module_name: str, version: str = "") -> None:
+        """Loads a model under name, replacing the model of that name once it is warmed up.
+        Does nothing if that model is already the same module and version."""
+        self.model_path(
+            module_name, version
+        )  # fails early on an invalid module or version
+        self.update({**self.specs, name: (module_name, version)})
+
+    def delete(self, name: str) -> None:
+        """Unloads the named model. The default model can be replaced, not unloaded."""
+        if name not in self.specs:
+            raise UnknownModelError(name)
+        if name == next(iter(self.specs)):
+            raise ValueError("The default model can't be unloaded")
+        self.update({key: spec for key, spec in self.specs.items() if key != name})
+
+    def report(self) -> Dict[str, Any]:
+        """Returns every model served or loading, as listed by /model/registry."""
+        with self._lock:
+            entries = list(self.entries.items())
+            loading = list(self.loading.items())
+        return {
+            "default": self.default_name,
+            "models": {name: entry.report() for name, entry in entries},
+            "loading": {name: entry.report() for name, entry in loading},
+        }
+
+    def names(self) -> List[str]:
+        """Returns the names of the models served."""
+        return list(self.entries)
+
+
+model_registry = ModelRegistry()  # pylint: disable=invalid-name
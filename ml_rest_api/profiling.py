@@ -0,0 +1,243 @@
+"""This module implements the ProfileSession class, which profiles a live worker on demand."""
+import cProfile
+import io
+import os
+import pstats
+import re
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from threading import Event, Lock, Thread, get_ident
+from time import monotonic, sleep
+from types import FrameType
+from typing import Dict, List, Optional, Set, Tuple
+from ml_rest_api.metrics import REQUEST_SECONDS
+
+PROFILE_MODES = ("sample", "cprofile")
+# Requests to these routes don't count towards the requests a profile waits for
+UNCOUNTED_ROUTES = (
+    "/api/debug/profile",
+    "/api/liveness",
+    "/api/readiness",
+    "/api/metrics",
+)
+# Innermost Python frames of threads waiting for work, e.g. an idle pool thread blocked in
+# SimpleQueue.get() (C code) from concurrent.futures' _worker()
+IDLE_FRAMES: Set[Tuple[str, str]] = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("socket.py", "accept"),
+    ("thread.py", "_worker"),
+}
+ALLOCATION_FRAMES = 10  # frames kept per traced allocation
+ALLOCATION_LINES = 25  # lines reported, largest first
+STATS_LINES = 60  # pstats lines reported, by cumulative time
+
+_active: Optional["ProfileSession"] = None  # pylint: disable=invalid-name
+_active_lock = Lock()
+
+
+class ProfileBusy(Exception):
+    """Raised when a profile is requested while another one is running in the worker."""
+
+
+def completed_requests() -> int:
+    """Returns the number of requests this worker has answered, probes and the profiling
+    endpoint aside."""
+    return int(
+        sum(
+            count
+            for (endpoint, _status), count in REQUEST_SECONDS.counts().items()
+            if endpoint not in UNCOUNTED_ROUTES
+        )
+    )
+
+
+def frame_label(frame: FrameType) -> str:
+    """Returns a frame's function and where it is defined, e.g. predict (wrapper.py:120)."""
+    code = frame.f_code
+    return (
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    )
+
+
+class ProfileSession:  # pylint: disable=too-many-instance-attributes
+    """ProfileSession profiles the worker until a number of requests have completed or a time
+    window has passed. In "sample" mode, a thread of its own samples the stacks of every other
+    thread each interval, so requests run untouched and the work they hand to other threads
+    (the micro-batcher, the decode and encode pools) is included; the result is collapsed
+    stacks ("thread;outer;...;inner count" lines), which flamegraph.pl and speedscope read.
+    In "cprofile" mode, each Flask request is run under its own cProfile profiler (see
+    start_request()), which counts every call but only on the request's thread; the result is
+    the pstats table by cumulative time. With trace_allocations, the allocations made during
+    the profile and still alive at its end are also reported, per line, by tracemalloc.
+    """
+
+    def __init__(
+        self, mode: str, interval: float, include_idle: bool, trace_allocations: bool
+    ) -> None:
+        """interval is the sampling period in seconds. Threads waiting for work are left
+        out of the samples unless include_idle."""
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode: {mode}")
+        self.mode = mode
+        self.interval = interval
+        self.include_idle = include_idle
+        self.trace_allocations = trace_allocations
+        self.stacks: Counter = Counter()
+        self.samples: int = 0
+        self.stats: Optional[pstats.Stats] = None  # once a request was profiled
+        self.profiled_requests: int = 0
+        self.seconds: float = 0.0
+        self.allocations: List[Dict] = []
+        self._lock = Lock()
+        self._stop = Event()
+
+    def _sample(self, excluded: Set[int]) -> None:
+        """Samples the other threads' stacks until the session stops."""
+        excluded.add(get_ident())
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()  # pylint: disable=protected-access
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in frames.items():
+                if thread_id in excluded:
+                    continue
+                code = frame.f_code
+                if not self.include_idle and (
+                    (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+                ):
+                    continue
+                labels = []
+                current: Optional[FrameType] = frame
+                while current is not None:
+                    labels.append(frame_label(current))
+                    current = current.f_back
+                # Threads of a pool share a name but for their index
+                thread_name = re.sub(r"[-_]\d+$", "", names.get(thread_id, "thread"))
+                labels.append(thread_name)
+                self.stacks[";".join(reversed(labels))] += 1
+            self.samples += 1
+
+    def add(self, request_profile: cProfile.Profile) -> None:
+        """Adds the profile of a request to the session's statistics."""
+        with self._lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(request_profile)
+            else:
+                self.stats.add(request_profile)
+
+    def run(self, requests: int, seconds: float) -> None:
+        """Profiles until `requests` more requests have completed (if above 0) or `seconds`
+        have passed."""
+        started_tracing = self.trace_allocations and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(ALLOCATION_FRAMES)
+        sampler = None
+        if self.mode == "sample":
+            sampler = Thread(
+                target=self._sample,
+                args=({get_ident()},),
+                name="profile-sampler",
+                daemon=True,
+            )
+            sampler.start()
+        start = monotonic()
+        baseline = completed_requests()
+        while monotonic() - start < seconds:
+            if requests and completed_requests() - baseline >= requests:
+                break
+            sleep(0.05)
+        self._stop.set()
+        if sampler is not None:
+            sampler.join()
+        self.seconds = monotonic() - start
+        self.profiled_requests = completed_requests() - baseline
+        if self.trace_allocations:
+            self.allocations = [
+                {
+                    "location": f"{statistic.traceback[0].filename}:"
+                    f"{statistic.traceback[0].lineno}",
+                    "size_kb": round(statistic.size / 1024, 1),
+                    "count": statistic.count,
+                }
+                for statistic in tracemalloc.take_snapshot()
+                .filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+                .statistics("lineno")[:ALLOCATION_LINES]
+            ]
+            if started_tracing:
+                tracemalloc.stop()
+
+    def collapsed(self) -> str:
+        """Returns the sampled stacks in collapsed format, most frequent first."""
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.stacks.most_common()
+        )
+
+    def table(self) -> str:
+        """Returns the cProfile statistics of the profiled requests."""
+        buffer = io.StringIO()
+        with self._lock:
+            if self.stats is not None:
+                stats = pstats.Stats(stream=buffer)
+                stats.add(self.stats)
+                stats.strip_dirs().sort_stats("cumulative").print_stats(STATS_LINES)
+        return buffer.getvalue()
+
+    def text(self) -> str:
+        """Returns the collapsed stacks or the cProfile statistics, depending on the mode."""
+        return self.collapsed() if self.mode == "sample" else self.table()
+
+    def report(self) -> Dict:
+        """Returns the profile as JSON."""
+        report: Dict = {
+            "pid": os.getpid(),
+            "mode": self.mode,
+            "requests": self.profiled_requests,
+            "seconds": round(self.seconds, 3),
+        }
+        if self.mode == "sample":
+            report["samples"] = self.samples
+            report["interval_ms"] = self.interval * 1000
+            report["collapsed"] = self.collapsed()
+        else:
+            report["stats"] = self.table()
+        if self.trace_allocations:
+            report["allocations"] = self.allocations
+        return report
+
+
+def profile(session: ProfileSession, requests: int, seconds: float) -> ProfileSession:
+    """Runs session (see ProfileSession.run()) as the worker's only active profile and returns
+    it. Raises ProfileBusy if another one is running."""
+    global _active  # pylint: disable=global-statement,invalid-name
+    with _active_lock:
+        if _active is not None:
+            raise ProfileBusy(f"A profile is already running in worker {os.getpid()}")
+        _active = session
+    try:
+        session.run(requests, seconds)
+    finally:
+        with _active_lock:
+            _active = None
+    return session
+
+
+def start_request() -> Optional[cProfile.Profile]:
+    """Called as each request starts: returns the profiler it now runs under if a "cprofile"
+    session is active, None (at the cost of reading a global) otherwise."""
+    session = _active
+    if session is None or session.mode != "cprofile":
+        return None
+    request_profile = cProfile.Profile()
+    request_profile.enable()
+    return request_profile
+
+
+def finish_request(request_profile: cProfile.Profile) -> None:
+    """Called, on the same thread, as a request that start_request() profiled ends."""
+    request_profile.disable()
+    session = _active
+    if session is not None:
+        session.add(request_profile)
@@ -0,0 +1,133 @@
+"""This module implements the RembgSessionPool class."""
+from logging import Logger, getLogger
+from threading import Lock, Thread
+from typing import Any, Dict, List, Optional
+from ml_rest_api.metrics import stage
+from ml_rest_api.settings import get_bool, get_int, get_list
+from ml_rest_api.startup import Warmup, startup_timeline
+from ml_rest_api.thread_budget import record, threads_for
+
+log: Logger = getLogger(__name__)
+
+
+def new_session(model_name: str, intra_op_threads: int) -> Any:
+    """Creates a rembg session whose ONNX Runtime thread pool size we control (rembg's own
+    new_session() only honours OMP_NUM_THREADS). 0 threads keeps ONNX Runtime's default.
+    """
+    # rembg pulls in onnxruntime, OpenCV and SciPy, so it is only imported once it is needed
+    with startup_timeline.phase("rembg_import"):
+        # pylint: disable=import-outside-toplevel
+        import onnxruntime as ort
+        from rembg.sessions import sessions_class
+
+    session_class = next((sc for sc in sessions_class if sc.name() == model_name), None)
+    if session_class is None:
+        raise ValueError(f"Unknown rembg model: {model_name}")
+    sess_opts = ort.SessionOptions()
+    if intra_op_threads > 0:
+        sess_opts.intra_op_num_threads = intra_op_threads
+        sess_opts.inter_op_num_threads = 1
+    return session_class(model_name, sess_opts)
+
+
+class RembgSessionPool:
+    """RembgSessionPool creates one ONNX session per configured rembg model once per worker, so
+    that remove() calls reuse them instead of building a new u2net session on every request.
+    """
+
+    def __init__(self) -> None:
+        """Reads the model list from settings. Sessions are created by init()."""
+        self.model_names: List[str] = get_list("REMBG_MODELS")
+        self.default_model: str = self.model_names[0] if self.model_names else ""
+        self.sessions: Dict[str, Any] = {}
+        self.initialised: bool = False
+        self.warmup = Warmup("rembg_warmup")
+        self._lock = Lock()
+
+    def ready(self) -> bool:
+        """Returns whether every configured session was created and warmed up."""
+        return self.initialised and self.warmup.warm()
+
+    def multithreaded_init(self) -> None:
+        """Calls self.init() to create the sessions in a separate thread."""
+        Thread(target=self.init).start()
+
+    def init(self) -> None:
+        """Creates a session for each model in REMBG_MODELS (downloading it if needed). With
+        PREFORK_INIT the sessions are created before the workers are forked, and share their
+        weights with them: they then run on the calling thread only, as a session that owns a
+        thread pool is not safe to use in a forked child."""
+        with self._lock:
+            if self.initialised:
+                return
+            threads = (
+                1 if get_bool("PREFORK_INIT") else threads_for("REMBG_INTRA_OP_THREADS")
+            )
+            record("rembg_intra_op", threads)
+            for model_name in self.model_names:
+                log.debug("Initialise rembg session %s", model_name)
+                with startup_timeline.phase(f"rembg_session:{model_name}"):
+                    self.sessions[model_name] = new_session(model_name, threads)
+            self.initialised = True
+            log.info("rembg sessions loaded: %s", ", ".join(self.model_names))
+            self.warmup.run(self.warm_up)
+
+    def warm_up(self) -> bool:
+        """Runs each session WARMUP_ITERATIONS times on a synthetic image, so that the first
+        request doesn't pay for ONNX Runtime's first run. Returns False if there is nothing to
+        do."""
+        iterations = get_int("WARMUP_ITERATIONS")
+        if not self.sessions or iterations <= 0:
+            return False
+        from PIL import Image  # pylint: disable=import-outside-toplevel
+
+        image = Image.effect_noise((320, 320), 64).convert("RGB")
+        for model_name, session in self.sessions.items():
+            with startup_timeline.phase(f"rembg_warmup:{model_name}"):
+                for _ in range(iterations):
+                    session.predict(image)
+        return True
+
+    def get(self, model_name: Optional[str] = None) -> Any:
+        """Returns the session for model_name (or the default model), or None if the pool
+        has not been initialised yet."""
+        return self.sessions.get(model_name or self.default_model)
+
+    @staticmethod
+    def remove(
+        image: Any, session: Any, max_resolution: int = 0, refine_edges: bool = False
+    ) -> Any:
+        """Calls rembg's remove() with one of the pool's sessions. With max_resolution, the
+        mask is computed on a copy of the image scaled down so that neither side is larger,
+        then scaled back up (bilinearly) and applied to the full-resolution image. The model
+        itself runs at a fixed size (320x320 for u2net), so this doesn't save model time but
+        the Lanczos resampling of the full-size image and mask that rembg does around it.
+        refine_edges smooths the mask with rembg's post-processing (a morphological opening
+        and a blur) before it is applied.
+        """
+        # pylint: disable=import-outside-toplevel
+        from PIL import Image
+        from rembg import remove
+
+        with stage("rembg"):
+            if not max_resolution or max(image.size) <= max_resolution:
+                return remove(image, session=session, post_process_mask=refine_edges)
+            scale = max_resolution / max(image.size)
+            working = image.resize(
+                (
+                    max(1, round(image.width * scale)),
+                    max(1, round(image.height * scale)),
+                ),
+                Image.Resampling.BILINEAR,
+                reducing_gap=2.0,
+            )
+            mask = remove(
+                working, session=session, only_mask=True, post_process_mask=refine_edges
+            )
+            mask = mask.resize(image.size, Image.Resampling.BILINEAR)
+            # Like rembg's naive_cutout(): transparent where the mask is 0
+            image = image if image.mode == "RGBA" else image.convert("RGBA")
+            return Image.composite(image, Image.new("RGBA", image.size, 0), mask)
+
+
+rembg_session_pool = RembgSessionPool()  # pylint: disable=invalid-name
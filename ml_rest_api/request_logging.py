@@ -0,0 +1,220 @@
+"""This module configures logging: records are queued by the threads that log them and written
+out, as JSON lines tagged with the ID of the request that logged them, by a listener thread."""
+import atexit
+import copy
+import json
+import logging
+import os
+import random
+import re
+import sys
+import uuid
+from contextvars import ContextVar
+from logging import Filter, Formatter, Logger, LogRecord, StreamHandler, getLogger
+from logging.handlers import QueueHandler, QueueListener
+from queue import Full, Queue
+from threading import Lock
+from time import gmtime
+from typing import Dict, Optional
+from ml_rest_api.settings import get_float, get_int, get_list, get_value
+
+REQUEST_ID_HEADER = "X-Request-Id"
+# Request IDs sent by clients are kept if they look like one, e.g. a UUID
+REQUEST_ID_PATTERN = re.compile(r"[\w.:-]{1,128}")
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(request_id)s - %(message)s"
+# LogRecord attributes that aren't extra fields passed by the caller
+RECORD_ATTRIBUTES = set(vars(LogRecord("", 0, "", 0, "", None, None))) | {
+    "message",
+    "asctime",
+    "request_id",
+}
+
+access_log: Logger = getLogger("ml_rest_api.access")
+
+_request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+_sampled: ContextVar[bool] = ContextVar("sampled", default=True)
+_listener: Optional[QueueListener] = None  # pylint: disable=invalid-name
+_listener_pid: int = 0  # pylint: disable=invalid-name
+_dropped: int = 0  # pylint: disable=invalid-name
+_dropped_lock = Lock()
+
+
+def sample_rate(route: str) -> float:
+    """Returns the fraction of requests to a route whose records below WARNING are logged:
+    its rate in LOG_ROUTE_SAMPLE_RATES (route=rate entries), else LOG_SAMPLE_RATE."""
+    for entry in get_list("LOG_ROUTE_SAMPLE_RATES"):
+        name, _, rate = entry.partition("=")
+        if name.strip() == route:
+            return float(rate)
+    return get_float("LOG_SAMPLE_RATE")
+
+
+def start_request_log(route: str, header: Optional[str]) -> str:
+    """Sets the ID of the current request from its X-Request-Id header, or a new one if it
+    has none (or not a valid one), decides whether its verbose records are sampled, and
+    returns the ID. Code run on other threads in a copy of the request's context (see
+    contextvars.copy_context()) is tagged with it too."""
+    request_id = (
+        header if header and REQUEST_ID_PATTERN.fullmatch(header) else uuid.uuid4().hex
+    )
+    _request_id.set(request_id)
+    rate = sample_rate(route)
+    _sampled.set(rate >= 1 or random.random() < rate)
+    return request_id
+
+
+def log_request(
+    route: str, status: int, seconds: float, stages: Dict[str, float]
+) -> None:
+    """Logs a completed request with its duration and the time spent in each stage, in
+    milliseconds. Server errors are logged as warnings, so they aren't sampled out."""
+    access_log.log(
+        logging.WARNING if status >= 500 else logging.INFO,
+        "%s %d %.1fms",
+        route,
+        status,
+        seconds * 1000,
+        extra={
+            "route": route,
+            "status": status,
+            "duration_ms": round(seconds * 1000, 3),
+            "stages_ms": {
+                name: round(stage_seconds * 1000, 3)
+                for name, stage_seconds in stages.items()
+            },
+        },
+    )
+
+
+def stop_request_log() -> None:
+    """Stops tagging records with the current request's ID."""
+    _request_id.set(None)
+    _sampled.set(True)
+
+
+class RequestFilter(Filter):  # pylint: disable=too-few-public-methods
+    """Tags records with the ID of the request logging them, and drops those below WARNING
+    from requests that weren't sampled (see start_request_log())."""
+
+    def filter(self, record: LogRecord) -> bool:
+        """Runs on the thread that logs the record, where the request's context is."""
+        record.request_id = _request_id.get()
+        return record.levelno >= logging.WARNING or _sampled.get()
+
+
+class DroppingQueueHandler(QueueHandler):
+    """A QueueHandler that drops records when its queue is full, rather than blocking the
+    thread that logs them or reporting an error for each."""
+
+    def prepare(self, record: LogRecord) -> LogRecord:
+        """Merges the message with its arguments and formats the exception, if any, as the
+        listener thread may see the arguments after they changed. Unlike QueueHandler's, keeps
+        the exception apart from the message."""
+        message = record.getMessage()
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = Formatter().formatException(record.exc_info)
+        record = copy.copy(record)
+        record.msg, record.args, record.message = message, None, message
+        record.exc_info, record.exc_text = None, exc_text
+        return record
+
+    def enqueue(self, record: LogRecord) -> None:
+        """Queues a record, or counts it as dropped if the queue is full."""
+        global _dropped  # pylint: disable=global-statement,invalid-name
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            with _dropped_lock:
+                _dropped += 1
+
+
+class JsonFormatter(Formatter):
+    """Formats records as JSON objects on one line, with the fields passed as extra."""
+
+    def __init__(self) -> None:
+        """Formats times in UTC."""
+        super().__init__()
+        self.converter = gmtime
+
+    def format(self, record: LogRecord) -> str:
+        """Returns the record as JSON."""
+        entry = {
+            "time": f"{self.formatTime(record, '%Y-%m-%dT%H:%M:%S')}."
+            f"{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "process": record.process,
+            "thread": record.threadName,
+        }
+        entry.update(
+            (key, value)
+            for key, value in vars(record).items()
+            if key not in RECORD_ATTRIBUTES
+        )
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class DrainingQueueListener(QueueListener):
+    """A QueueListener whose stop() waits for room in a full queue, rather than failing."""
+
+    def __init__(
+        self, records: "Queue[Optional[LogRecord]]", *handlers: logging.Handler
+    ) -> None:
+        """Writes the records queued in records out to handlers."""
+        super().__init__(records, *handlers)
+        self.records = records
+
+    def enqueue_sentinel(self) -> None:
+        """Queues the sentinel stopping the listener (None), once it has written out the
+        rest."""
+        self.records.put(None)
+
+
+def dropped_records() -> int:
+    """Returns the number of records dropped because the queue was full."""
+    with _dropped_lock:
+        return _dropped
+
+
+def configure_logging(queued: bool = True) -> None:
+    """Logs to stdout through a queue of LOG_QUEUE_SIZE records, as JSON lines (LOG_FORMAT
+    json) or text, from LOG_LEVEL up. Records are written out by a listener thread, so a slow
+    stdout reader doesn't hold up requests, unless not queued (e.g. under uWSGI, which only
+    runs threads with enable-threads). Called again (e.g. in a forked worker, whose listener
+    thread didn't survive the fork), replaces the previous listener."""
+    global _listener, _listener_pid  # pylint: disable=global-statement,invalid-name
+    stop_listener()
+    output = StreamHandler(sys.stdout)
+    if get_value("LOG_FORMAT") == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(Formatter(TEXT_FORMAT))
+    handler: logging.Handler = output
+    if queued:
+        handler = DroppingQueueHandler(Queue(get_int("LOG_QUEUE_SIZE")))
+    handler.addFilter(RequestFilter())
+    root = getLogger()
+    for previous in list(root.handlers):
+        root.removeHandler(previous)
+    root.addHandler(handler)
+    root.setLevel(str(get_value("LOG_LEVEL")).upper())
+    if queued:
+        _listener = DrainingQueueListener(handler.queue, output)  # type: ignore
+        _listener_pid = os.getpid()
+        _listener.start()
+
+
+@atexit.register
+def stop_listener() -> None:
+    """Writes out the records still queued and stops the listener thread, at exit or when
+    logging is configured again. A listener inherited through a fork is left alone: its
+    thread and perhaps its queue's lock stayed in the parent."""
+    global _listener  # pylint: disable=global-statement,invalid-name
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+    _listener = None
@@ -0,0 +1,257 @@
+"""This module implements the ResultCache class and the prediction/segmentation caches."""
+import asyncio
+import hashlib
+import json
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from threading import Lock
+from time import monotonic
+from typing import (
+    Any,
+    Awaitable,
+    BinaryIO,
+    Callable,
+    Dict,
+    NamedTuple,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
+from ml_rest_api.admission import check_deadline, deadline
+from ml_rest_api.settings import get_float, get_int
+
+T = TypeVar("T")
+
+HASH_CHUNK_BYTES = 1024 * 1024
+
+# Passed on to the callers waiting for a computation that failed, instead of its exception
+_FAILED = object()
+
+
+class CacheEntry(NamedTuple):
+    """A cached value with its estimated size in bytes and expiry time (monotonic clock)."""
+
+    value: Any
+    size: int
+    expires: float
+
+
+def cache_key(image: Union[bytes, BinaryIO], *params: Any) -> str:
+    """Returns a content-addressed key: a hash of the image bytes plus any request
+    parameters that change the result (e.g. the parsed classifier list). An uploaded file is
+    hashed in chunks, from its start."""
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        digest = hashlib.sha256(image)
+    else:
+        digest = hashlib.sha256()
+        image.seek(0)
+        for chunk in iter(lambda: image.read(HASH_CHUNK_BYTES), b""):  # type: ignore
+            digest.update(chunk)
+        image.seek(0)
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def estimate_size(value: Any) -> int:
+    """Returns a rough size in bytes for the values we cache: arrays, PIL images and
+    JSON-serialisable results."""
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    if hasattr(value, "getbands") and hasattr(value, "size"):
+        width, height = value.size
+        return width * height * len(value.getbands())
+    return len(json.dumps(value, default=str))
+
+
+def time_left(expires: Optional[float]) -> Optional[float]:
+    """Returns the seconds left until expires (in time.monotonic() seconds), None if None."""
+    return None if expires is None else max(0.0, expires - monotonic())
+
+
+class ResultCache:  # pylint: disable=too-many-instance-attributes
+    """Bounded LRU cache with a TTL and a total size limit, with request coalescing: concurrent
+    callers asking for a key that is still being computed wait for that computation instead
+    of starting their own. Only successful results are shared: if the computation fails, one
+    of its waiters computes the value in turn, under its own admission and deadline."""
+
+    def __init__(
+        self, max_entries: int, max_bytes: int, ttl: float, name: str = "cache"
+    ) -> None:
+        """A cache with max_entries or max_bytes of 0 is disabled but still coalesces. name
+        labels the callers whose deadline passes while they wait (see dropped_stats()).
+        """
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = Lock()
+
+    @classmethod
+    def from_settings(cls, prefix: str) -> "ResultCache":
+        """Builds a cache from the <prefix>_MAX_ENTRIES, <prefix>_MAX_MB and
+        RESULT_CACHE_TTL_SECONDS settings."""
+        return cls(
+            max_entries=get_int(f"{prefix}_MAX_ENTRIES"),
+            max_bytes=int(get_float(f"{prefix}_MAX_MB") * 1024 * 1024),
+            ttl=get_float("RESULT_CACHE_TTL_SECONDS"),
+            name=prefix.lower(),
+        )
+
+    def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], T],
+        sizeof: Callable[[Any], int] = estimate_size,
+    ) -> T:
+        """Returns the cached value for key, or computes, caches and returns it. Waiting for a
+        computation in flight raises DeadlineExceeded once the request's deadline passes.
+        """
+        expires = deadline()
+        while True:
+            value, future, owner = self._claim(key)
+            if value is not None:
+                return value
+            if owner:
+                break
+            try:
+                value = future.result(time_left(expires))
+            except FutureTimeoutError:
+                check_deadline(self.name, expires)
+                continue
+            if value is not _FAILED:
+                return value
+        try:
+            value = compute()
+        except BaseException:
+            self._settle(key, future, _FAILED)
+            raise
+        self._settle(key, future, value, sizeof(value))
+        return value
+
+    async def get_or_compute_async(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[T]],
+        sizeof: Callable[[Any], int] = estimate_size,
+    ) -> T:
+        """Same as get_or_compute() for a coroutine function: waiting for a computation in
+        flight doesn't block the event loop."""
+        expires = deadline()
+        while True:
+            value, future, owner = self._claim(key)
+            if value is not None:
+                return value
+            if owner:
+                break
+            try:
+                # Shielded: giving up mustn't cancel the computation the others wait for
+                value = await asyncio.wait_for(
+                    asyncio.shield(asyncio.wrap_future(future)), time_left(expires)
+                )
+            except asyncio.TimeoutError:
+                check_deadline(self.name, expires)
+                continue
+            if value is not _FAILED:
+                return value
+        try:
+            value = await compute()
+        except BaseException:
+            self._settle(key, future, _FAILED)
+            raise
+        self._settle(key, future, value, sizeof(value))
+        return value
+
+    def _claim(self, key: str) -> Tuple[Any, Future, bool]:
+        """Returns the cached value for key if there is one. Otherwise returns the future of
+        the computation in flight for key, and whether the caller just started it (and must
+        settle it)."""
+        with self._lock:
+            value = self._get(key)
+            if value is not None:
+                self.hits += 1
+                return value, Future(), False
+            waiting: Optional[Future] = self._in_flight.get(key)
+            if waiting is not None:
+                self.coalesced += 1
+                return None, waiting, False
+            self.misses += 1
+            future: Future = Future()
+            self._in_flight[key] = future
+            return None, future, True
+
+    def _settle(self, key: str, future: Future, value: Any, size: int = 0) -> None:
+        """Caches the value computed for key and passes it on to the callers waiting for it,
+        or, if value is _FAILED, tells them to compute it themselves."""
+        with self._lock:
+            del self._in_flight[key]
+            if value is not _FAILED:
+                self._put(key, value, size)
+        future.set_result(value)
+
+    def _get(self, key: str) -> Any:
+        """Returns a live cached value and marks it as recently used. Call with lock held."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires <= monotonic():
+            self._remove(key)
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry.value
+
+    def _put(self, key: str, value: Any, size: int) -> None:
+        """Stores a value, evicting least recently used entries to stay within the limits.
+        Values bigger than the whole cache are not stored. Call with lock held."""
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+        if key in self._entries:
+            self._remove(key)
+        while self._entries and (
+            len(self._entries) >= self.max_entries
+            or self.size_bytes + size > self.max_bytes
+        ):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+        self._entries[key] = CacheEntry(value, size, monotonic() + self.ttl)
+        self.size_bytes += size
+
+    def _remove(self, key: str) -> None:
+        """Drops an entry. Call with lock held."""
+        self.size_bytes -= self._entries.pop(key).size
+
+    def clear(self) -> None:
+        """Drops every cached entry."""
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the cache counters and current size."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "entries": len(self._entries),
+                "size_bytes": self.size_bytes,
+            }
+
+
+prediction_cache = ResultCache.from_settings(  # pylint: disable=invalid-name
+    "PREDICTION_CACHE"
+)
+segmentation_cache = ResultCache.from_settings(  # pylint: disable=invalid-name
+    "SEGMENTATION_CACHE"
+)
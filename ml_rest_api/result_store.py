@@ -0,0 +1,159 @@
+"""This module implements the ResultStore class, which keeps processed images for download."""
+import os
+import re
+import secrets
+import tempfile
+from concurrent.futures import Executor, Future
+from logging import Logger, getLogger
+from threading import Lock
+from time import sleep, time
+from typing import BinaryIO, Callable, NamedTuple, Optional
+from ml_rest_api.settings import get_float, get_value
+
+log: Logger = getLogger(__name__)
+
+RESULT_NAME_PATTERN = re.compile(r"[A-Za-z0-9_-]{16,64}\.png")
+PARTIAL_SUFFIX = ".partial"
+
+
+class StoredResult(NamedTuple):
+    """A stored result file. The name is unique and never reused, so it doubles as ETag."""
+
+    name: str
+    path: str
+    size: int
+
+
+class ResultStore:
+    """ResultStore keeps processed images on disk under opaque, unguessable names. Entries
+    expire after `ttl` seconds without being downloaded, and the least recently used entries
+    are evicted once the store grows beyond `max_bytes`. All state lives in the directory
+    itself (the file mtime is the last access time), so every worker process sees the same
+    entries."""
+
+    def __init__(self, directory: str, ttl: float, max_bytes: int) -> None:
+        """Creates the store directory if it doesn't exist."""
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_settings(cls) -> "ResultStore":
+        """Builds the store from the RESULT_STORE_* settings."""
+        return cls(
+            directory=get_value("RESULT_STORE_DIR")
+            or os.path.join(tempfile.gettempdir(), "ml_rest_api_results"),
+            ttl=get_float("RESULT_STORE_TTL_SECONDS"),
+            max_bytes=int(get_float("RESULT_STORE_MAX_MB") * 1024 * 1024),
+        )
+
+    def reserve(self) -> str:
+        """Returns a new entry name and marks the entry as pending until save() fills it in,
+        so that downloads arriving in the meantime (in any worker) wait for it."""
+        name = f"{secrets.token_urlsafe(24)}.png"
+        with open(os.path.join(self.directory, name + PARTIAL_SUFFIX), mode="wb"):
+            pass
+        return name
+
+    def save(
+        self, write: Callable[[BinaryIO], None], name: Optional[str] = None
+    ) -> str:
+        """Calls write() with a file to write the result to and returns the entry name (a
+        new one unless a reserved name is given). The entry only becomes visible once it has
+        been written completely."""
+        name = name or f"{secrets.token_urlsafe(24)}.png"
+        path = os.path.join(self.directory, name)
+        partial_path = path + PARTIAL_SUFFIX
+        try:
+            with open(partial_path, mode="wb") as partial_file:
+                write(partial_file)
+            os.replace(partial_path, path)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        self.enforce_limits()
+        return name
+
+    def save_in_background(
+        self, write: Callable[[BinaryIO], None], executor: Executor
+    ) -> str:
+        """Reserves an entry name and runs save() on the executor, returning the name right
+        away. If the executor rejects the job (e.g. with Overloaded), the reservation is
+        dropped and its exception raised."""
+
+        def log_failure(future: Future) -> None:
+            if future.exception() is not None:
+                log.error("Failed to save %s: %s", name, future.exception())
+
+        name = self.reserve()
+        try:
+            future = executor.submit(self.save, write, name)
+        except BaseException:
+            self._remove(os.path.join(self.directory, name + PARTIAL_SUFFIX))
+            raise
+        future.add_done_callback(log_failure)
+        return name
+
+    def get(self, name: str, wait: float = 0.0) -> Optional[StoredResult]:
+        """Returns a live entry and marks it as recently used, or None if the name is
+        invalid, unknown or expired. If the entry is still being saved, waits up to `wait`
+        seconds for it."""
+        if not RESULT_NAME_PATTERN.fullmatch(name):
+            return None
+        path = os.path.join(self.directory, name)
+        deadline = time() + wait
+        while (
+            not os.path.exists(path)
+            and os.path.exists(path + PARTIAL_SUFFIX)
+            and time() < deadline
+        ):
+            sleep(0.05)
+        try:
+            stat = os.stat(path)
+            if stat.st_mtime + self.ttl < time():
+                os.remove(path)
+                return None
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return StoredResult(name, path, stat.st_size)
+
+    def enforce_limits(self) -> None:
+        """Removes expired entries (and partial ones left behind by a crashed worker), then
+        least recently used ones until the store fits in max_bytes."""
+        with self._lock:
+            now = time()
+            entries = []
+            with os.scandir(self.directory) as scan:
+                for entry in scan:
+                    partial = entry.name.endswith(PARTIAL_SUFFIX)
+                    name = entry.name[: -len(PARTIAL_SUFFIX)] if partial else entry.name
+                    if not RESULT_NAME_PATTERN.fullmatch(name):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue  # removed by another worker
+                    if stat.st_mtime + self.ttl < now:
+                        self._remove(entry.path)
+                    elif not partial:
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        """Deletes an entry, ignoring entries already deleted by another worker."""
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+result_store = ResultStore.from_settings()  # pylint: disable=invalid-name
@@ -1,6 +1,6 @@
 """Settings file."""
 import os
-from typing import Any, Dict
+from typing import Any, Dict, List
 
 
 def get_value(key: str) -> Any:
@@ -21,7 +21,111 @@ def get_value(key: str) -> Any:
         "WTF_CSRF_ENABLED": True,
         # Trained ML/AI model settings
         "TRAINED_MODEL_MODULE_NAME": "ml_trained_model",
+        # Model registry settings ("" serves TRAINED_MODEL_MODULE_NAME as "default")
+        "MODELS": "",  # e.g. default=ml_trained_model,v2=ml_trained_model:garbage_model_v2
+        "MODEL_DIR": "",  # "" looks for model versions in ml_rest_api/ml_trained_model
+        "MODEL_REGISTRY_FILE": "",
+        "MODEL_ADMIN": False,  # allow PUT/DELETE on /model/registry
         # Module settings
         "MULTITHREADED_INIT": True,
+        "STARTUP_REPORT_PATH": "",  # write the startup timeline as JSON to this file
+        "PREFORK_INIT": False,  # set by gunicorn_prefork.py, see README
+        "SERVER_TIMING": False,  # return per-stage timings in a Server-Timing header
+        # Logging settings (records below WARNING are logged for a sample of requests)
+        "LOG_LEVEL": "INFO",
+        "LOG_FORMAT": "json",  # json or text
+        "LOG_QUEUE_SIZE": 10000,  # records queued for the log thread, then dropped
+        "LOG_SAMPLE_RATE": 1.0,
+        "LOG_ROUTE_SAMPLE_RATES": "/api/liveness=0,/api/readiness=0,/api/metrics=0",
+        # Profiling endpoint settings ("" token lets anyone reaching it profile)
+        "DEBUG_PROFILE": False,  # enable POST /api/debug/profile
+        "DEBUG_PROFILE_TOKEN": "",  # required in an X-Debug-Token header if set
+        "DEBUG_PROFILE_MAX_SECONDS": 60,
+        # CPU thread settings (0 threads uses the thread budget)
+        "THREAD_BUDGET": 0,  # compute threads per worker, 0 shares the CPU quota out
+        "MODEL_THREADS": 0,  # TensorFlow intra-op threads
+        "WORKER_MEMORY_MB": 768,  # caps the default WEB_CONCURRENCY, 0 for no cap
+        # Inference batching settings
+        "BATCH_MAX_SIZE": 8,  # 1 disables micro-batching
+        "BATCH_MAX_WAIT_MS": 5,
+        "DECODE_THREADS": 4,
+        "PREDICT_BATCH_MAX_IMAGES": 64,
+        "ENCODE_THREADS": 2,
+        "INFERENCE_THREADS": 2,  # rembg and unbatched inference under ASGI
+        "EXECUTOR_QUEUE_PER_THREAD": 4,  # beyond that, jobs are rejected
+        # Inference process settings (0 processes runs the model in each web worker)
+        "INFERENCE_PROCESSES": 0,
+        "INFERENCE_SLOTS": 32,
+        "INFERENCE_SLOT_MB": 1,
+        "INFERENCE_MAX_OUTPUTS": 1024,
+        "INFERENCE_TIMEOUT_SECONDS": 30,
+        "INFERENCE_START_TIMEOUT_SECONDS": 300,
+        # Upload settings (0 MB or 0 pixels for no limit)
+        "UPLOAD_MAX_MB": 20,
+        "UPLOAD_SPOOL_MB": 1,  # larger uploads are buffered on disk
+        "UPLOAD_MAX_PIXELS": 25_000_000,
+        "DECODE_MAX_SIDE": 0,  # larger images are scaled down, 0 for full size
+        # Admission control settings (0 concurrency admits every request)
+        "ADMISSION_CONCURRENCY": 8,  # per endpoint, at least BATCH_MAX_SIZE
+        "ADMISSION_QUEUE_SIZE": 32,
+        "ADMISSION_RETRY_AFTER_SECONDS": 1,
+        "REQUEST_TIMEOUT_MS": 0,  # default deadline, 0 for none
+        # Compiled SavedModel settings ("" buckets are the warmup batch sizes)
+        "MODEL_COMPILE": True,
+        "MODEL_JIT_COMPILE": False,
+        "MODEL_BATCH_BUCKETS": "",
+        # Converted model settings (TRAINED_MODEL_MODULE_NAME=quantized_model)
+        "QUANTIZED_MODEL_FORMAT": "tflite",  # tflite or onnx
+        "QUANTIZED_MODEL_PRECISION": "fp32",  # fp32, fp16 or int8
+        "QUANTIZED_MODEL_CACHE_DIR": "",  # "" caches artifacts next to the SavedModel
+        "QUANTIZED_MODEL_THREADS": 0,
+        # Warmup settings ("" warms up batch sizes 1 and BATCH_MAX_SIZE)
+        "WARMUP_ITERATIONS": 2,  # 0 disables warmup
+        "WARMUP_BATCH_SIZES": "",
+        # Result cache settings (0 entries or 0 MB disables a cache)
+        "RESULT_CACHE_TTL_SECONDS": 60,
+        "PREDICTION_CACHE_MAX_ENTRIES": 1024,
+        "PREDICTION_CACHE_MAX_MB": 1,
+        "SEGMENTATION_CACHE_MAX_ENTRIES": 16,
+        "SEGMENTATION_CACHE_MAX_MB": 64,
+        # Background removal settings (the first model is the default)
+        "REMBG_MODELS": "u2net,u2netp,silueta",
+        "REMBG_INTRA_OP_THREADS": 0,
+        "REMBG_MAX_RESOLUTION": 0,  # default max_resolution, 0 computes masks at full size
+        "SEGMENTATION_COMPRESSION": 6,  # default compression, 0 (fastest) to 9 (smallest)
+        "SEGMENTATION_WEBP_QUALITY": 80,  # default quality of webp outputs, 1 to 100
+        # Processed image store settings ("" stores them under the system tmp dir)
+        "RESULT_STORE_DIR": "",
+        "RESULT_STORE_TTL_SECONDS": 900,
+        "RESULT_STORE_MAX_MB": 100,
+        "RESULT_STORE_PENDING_WAIT_SECONDS": 10,
     }
     return os.environ[key] if key in os.environ else settings.get(key, False)
+
+
+def get_bool(key: str) -> bool:
+    """Returns a setting as a bool, parsing env var strings such as "False" or "0"."""
+    value = get_value(key)
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+def get_int(key: str) -> int:
+    """Returns a setting as an int."""
+    return int(get_value(key))
+
+
+def get_float(key: str) -> float:
+    """Returns a setting as a float."""
+    return float(get_value(key))
+
+
+def get_list(key: str) -> List[str]:
+    """Returns a comma-separated setting as a list of stripped, non-empty strings."""
+    value = get_value(key)
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    return [str(item).strip() for item in value if str(item).strip()]
@@ -0,0 +1,180 @@
+"""This module implements the StartupTimeline class, which runs and times the boot sequence, and
+the Warmup class."""
+import json
+import os
+from contextlib import contextmanager
+from logging import Logger, getLogger
+from threading import Lock, Thread, current_thread
+from time import perf_counter, time
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from ml_rest_api.memory import memory_report
+from ml_rest_api.settings import get_value
+
+log: Logger = getLogger(__name__)
+
+
+def process_start_time() -> Optional[float]:
+    """Returns when this process started (epoch seconds), read from /proc on Linux, so that
+    interpreter start-up shows up in the timeline too. Returns None elsewhere."""
+    try:
+        with open("/proc/self/stat", encoding="ascii") as stat_file:
+            # The command name may contain spaces, fields are counted after its closing ")"
+            fields = stat_file.read().rsplit(")", 1)[1].split()
+        with open("/proc/stat", encoding="ascii") as stat_file:
+            boot_time = next(
+                int(line.split()[1]) for line in stat_file if line.startswith("btime")
+            )
+        return boot_time + int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, StopIteration):
+        return None
+
+
+class StartupTimeline:
+    """StartupTimeline records named, possibly overlapping, phases of the boot sequence and
+    runs subsystem initialisers in parallel threads."""
+
+    def __init__(self) -> None:
+        """Starts the timeline when the process started (or now if that is unknown)."""
+        self.origin: float = time()
+        self.phases: List[Dict] = []
+        self.ready_at: Optional[float] = None
+        self._lock = Lock()
+        started = process_start_time()
+        if started is not None and started < self.origin:
+            created, self.origin = self.origin, started
+            self.record("interpreter", started, created)
+
+    def record(self, name: str, start: float, end: float, status: str = "done") -> None:
+        """Adds a finished phase (epoch seconds)."""
+        with self._lock:
+            self.phases.append(
+                {
+                    "phase": name,
+                    "start_s": round(start - self.origin, 3),
+                    "duration_s": round(end - start, 3),
+                    "thread": current_thread().name,
+                    "status": status,
+                }
+            )
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Context manager that records the enclosed block as a phase."""
+        start = time()
+        status = "failed"
+        try:
+            yield
+            status = "done"
+        finally:
+            self.record(name, start, time(), status)
+
+    def initialise(
+        self, tasks: Dict[str, Callable[[], None]], parallel: bool, wait: bool
+    ) -> None:
+        """Runs each task as a phase, all at once on their own threads if parallel. Unless
+        wait is set, returns straight away and the report is emitted once all tasks end.
+        """
+
+        def run(name: str, task: Callable[[], None]) -> None:
+            try:
+                with self.phase(name):
+                    task()
+            except Exception:  # pylint: disable=broad-except
+                log.exception("Initialisation of %s failed", name)
+
+        def run_all() -> None:
+            if parallel:
+                threads = [
+                    Thread(target=run, args=item, name=f"init-{item[0]}")
+                    for item in tasks.items()
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            else:
+                for name, task in tasks.items():
+                    run(name, task)
+            self.ready_at = time()
+            self.emit_report()
+
+        if wait:
+            run_all()
+        else:
+            Thread(target=run_all, name="init").start()
+
+    def report(self) -> Dict:
+        """Returns the timeline as a dictionary, phases sorted by start time, with the current
+        memory use of this process."""
+        with self._lock:
+            phases = sorted(self.phases, key=lambda phase: phase["start_s"])
+        return {
+            "pid": os.getpid(),
+            "ready_s": round(self.ready_at - self.origin, 3) if self.ready_at else None,
+            "phases": phases,
+            "memory": memory_report(),
+        }
+
+    def emit_report(self) -> None:
+        """Logs the timeline and writes it as JSON to STARTUP_REPORT_PATH if set ({pid} in the
+        path is replaced with the process ID, to keep one report per worker)."""
+        report = self.report()
+        lines = [
+            f"  {phase['start_s']:>8.3f}s +{phase['duration_s']:>7.3f}s  "
+            f"{phase['phase']:<28} [{phase['thread']}] {phase['status']}"
+            for phase in report["phases"]
+        ]
+        log.info(
+            "Startup timeline of process %s (ready after %ss, memory %s):\n%s",
+            report["pid"],
+            report["ready_s"],
+            report["memory"],
+            "\n".join(lines),
+        )
+        report_path = get_value("STARTUP_REPORT_PATH")
+        if report_path:
+            report_path = report_path.replace("{pid}", str(report["pid"]))
+            with open(report_path, mode="w", encoding="utf-8") as report_file:
+                json.dump(report, report_file, indent=2)
+
+
+class Warmup:
+    """Warmup runs and tracks a subsystem's warmup (synthetic inferences that pay for graph
+    tracing, kernel selection and allocations before real requests arrive), for /readiness.
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    SKIPPED = "skipped"
+
+    def __init__(self, name: str) -> None:
+        """Starts out pending."""
+        self.name = name
+        self.status: str = self.PENDING
+        self.seconds: Optional[float] = None
+
+    def run(self, warm_up: Callable[[], bool]) -> None:
+        """Times warm_up() as a startup phase. warm_up() returns False if it had nothing to
+        do. A failure is logged, not raised: it leaves the subsystem not warm."""
+        self.status = self.RUNNING
+        start = perf_counter()
+        try:
+            with startup_timeline.phase(self.name):
+                self.status = self.DONE if warm_up() else self.SKIPPED
+        except Exception:  # pylint: disable=broad-except
+            log.exception("Warmup %s failed", self.name)
+            self.status = self.FAILED
+        self.seconds = round(perf_counter() - start, 3)
+
+    def warm(self) -> bool:
+        """Returns whether the warmup finished (or was skipped)."""
+        return self.status in (self.DONE, self.SKIPPED)
+
+    def report(self) -> Dict[str, Any]:
+        """Returns the status and duration, as reported by /readiness."""
+        return {"status": self.status, "seconds": self.seconds}
+
+
+startup_timeline = StartupTimeline()  # pylint: disable=invalid-name
@@ -0,0 +1,148 @@
+"""This module sizes the thread pools of each worker from the CPUs the container may use, and
+the number of workers from its CPUs and memory."""
+import math
+import os
+from logging import Logger, getLogger
+from threading import Lock
+from typing import Dict, Optional
+from ml_rest_api.settings import get_float, get_int
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+log: Logger = getLogger(__name__)
+
+_effective: Dict[str, int] = {}
+_effective_lock = Lock()
+
+
+def cgroup_cpu_quota(root: Optional[str] = None) -> Optional[float]:
+    """Returns the CPU quota of the process's cgroup in CPUs (cgroup v2's cpu.max or v1's
+    cpu.cfs_quota_us under root, by default CGROUP_ROOT), or None if it has none."""
+    root = root or CGROUP_ROOT
+    try:
+        with open(os.path.join(root, "cpu.max"), encoding="utf-8") as cpu_max:
+            quota, period = cpu_max.read().split()[:2]
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open(
+            os.path.join(root, "cpu", "cpu.cfs_quota_us"), encoding="utf-8"
+        ) as quota_file:
+            quota_us = int(quota_file.read())
+        with open(
+            os.path.join(root, "cpu", "cpu.cfs_period_us"), encoding="utf-8"
+        ) as period_file:
+            period_us = int(period_file.read())
+    except (OSError, ValueError):
+        return None
+    return quota_us / period_us if quota_us > 0 and period_us > 0 else None
+
+
+def cpu_limit() -> float:
+    """Returns the number of CPUs the process may use: its cgroup CPU quota, or the number of
+    CPUs it may run on if that is lower. os.cpu_count() counts the host's cores, whatever the
+    container is given."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # not on Linux
+        cpus = os.cpu_count() or 1
+    quota = cgroup_cpu_quota()
+    return min(float(cpus), quota) if quota else float(cpus)
+
+
+def cgroup_memory_limit(root: Optional[str] = None) -> Optional[int]:
+    """Returns the memory limit of the process's cgroup in bytes (cgroup v2's memory.max or
+    v1's memory.limit_in_bytes under root, by default CGROUP_ROOT), or None if it has none.
+    """
+    root = root or CGROUP_ROOT
+    for path in (
+        os.path.join(root, "memory.max"),
+        os.path.join(root, "memory", "memory.limit_in_bytes"),
+    ):
+        try:
+            with open(path, encoding="utf-8") as limit_file:
+                limit = limit_file.read().strip()
+        except OSError:
+            continue
+        # cgroup v1 reports no limit as a huge number rather than "max"
+        if limit == "max" or not limit.isdigit() or int(limit) >= 2**60:
+            return None
+        return int(limit)
+    return None
+
+
+def memory_limit() -> Optional[int]:
+    """Returns the memory the process may use in bytes: its cgroup memory limit, or the
+    host's physical memory if that is lower. None if neither is known."""
+    try:
+        physical: Optional[int] = os.sysconf("SC_PAGE_SIZE") * os.sysconf(
+            "SC_PHYS_PAGES"
+        )
+    except (AttributeError, OSError, ValueError):  # not on Linux
+        physical = None
+    limits = [limit for limit in (cgroup_memory_limit(), physical) if limit]
+    return min(limits) if limits else None
+
+
+def default_worker_count() -> int:
+    """Returns the number of gunicorn workers to start if WEB_CONCURRENCY isn't set: one per
+    CPU, but no more than fit in the memory limit at WORKER_MEMORY_MB each (each worker
+    loads its own model, even in pre-fork mode), and at least 1."""
+    workers = math.floor(cpu_limit())
+    memory = memory_limit()
+    worker_memory = get_float("WORKER_MEMORY_MB") * 1024 * 1024
+    if memory and worker_memory > 0:
+        workers = min(workers, math.floor(memory / worker_memory))
+    return max(1, workers)
+
+
+def worker_count() -> int:
+    """Returns the number of web workers sharing the CPUs: WEB_CONCURRENCY, by default 1 (a
+    single process, e.g. the development server or uvicorn)."""
+    return int(os.environ.get("WEB_CONCURRENCY", 0)) or 1
+
+
+def thread_budget() -> int:
+    """Returns the number of threads each worker may keep busy computing: THREAD_BUDGET, by
+    default the CPUs shared out between the workers (at least 1)."""
+    return get_int("THREAD_BUDGET") or max(1, math.floor(cpu_limit() / worker_count()))
+
+
+def request_threads() -> int:
+    """Returns the number of gunicorn threads per worker: THREADS, by default 4 per thread of
+    the budget, as requests spend most of their time waiting on I/O and queues."""
+    return int(os.environ.get("THREADS", 0)) or 4 * thread_budget()
+
+
+def threads_for(setting: str) -> int:
+    """Returns the threads a runtime's pool should use: the given setting if it is above 0,
+    else the thread budget."""
+    return get_int(setting) or thread_budget()
+
+
+def limit_native_threads() -> None:
+    """Sizes the OpenMP and BLAS pools (used by NumPy, SciPy and OpenCV through rembg) to the
+    budget, unless they are configured already. Only effective before those libraries are
+    imported."""
+    for variable in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ.setdefault(variable, str(thread_budget()))
+
+
+def record(pool: str, threads: int) -> None:
+    """Records the number of threads a pool was given, for the readiness report."""
+    with _effective_lock:
+        _effective[pool] = threads
+    log.debug("%s threads: %d", pool, threads)
+
+
+def thread_report() -> Dict:
+    """Returns the CPU limit, the budget derived from it and the threads of each pool."""
+    with _effective_lock:
+        pools = dict(sorted(_effective.items()))
+    return {
+        "cpu_limit": cpu_limit(),
+        "workers": worker_count(),
+        "budget": thread_budget(),
+        "pools": pools,
+    }
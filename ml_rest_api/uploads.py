@@ -0,0 +1,36 @@
+"""This module implements the SpooledRequest class and the upload size limits."""
+from tempfile import SpooledTemporaryFile
+from typing import IO, Optional
+from flask import Request
+from ml_rest_api.settings import get_float
+
+MB = 1024 * 1024
+
+
+def max_upload_bytes() -> Optional[int]:
+    """Returns the largest request body accepted (UPLOAD_MAX_MB), or None for no limit."""
+    return int(get_float("UPLOAD_MAX_MB") * MB) or None
+
+
+def spool_bytes() -> int:
+    """Returns the size above which an uploaded file is moved from memory to disk."""
+    return int(get_float("UPLOAD_SPOOL_MB") * MB)
+
+
+class SpooledRequest(Request):
+    """Request that receives each uploaded file into a buffer that stays in memory up to
+    UPLOAD_SPOOL_MB and moves to a temporary file beyond, whether or not the client sent a
+    Content-Length. Handlers then decode from that buffer instead of reading the upload into
+    a bytes object of its own."""
+
+    def _get_file_stream(
+        self,
+        total_content_length: Optional[int],
+        content_type: Optional[str],
+        filename: Optional[str] = None,
+        content_length: Optional[int] = None,
+    ) -> IO[bytes]:
+        """Returns the buffer a file of the multipart body is written to."""
+        return SpooledTemporaryFile(  # pylint: disable=consider-using-with
+            max_size=spool_bytes(), mode="rb+"
+        )
@@ -0,0 +1,126 @@
+"""Unit tests for ml_rest_api.admission."""
+
+import asyncio
+from contextvars import copy_context
+from threading import Event, Thread
+from time import sleep
+
+import numpy as np
+import pytest
+
+from ml_rest_api.admission import (
+    AdmissionQueue,
+    DeadlineExceeded,
+    Overloaded,
+    dropped_stats,
+    set_deadline,
+)
+from ml_rest_api.batching import MicroBatcher
+
+
+def test_full_queue_sheds_and_slots_are_handed_on_in_order():
+    """Verify that requests beyond concurrency wait in arrival order, that those beyond the
+    queue are shed and that a waiter whose deadline passes leaves the queue."""
+    queue = AdmissionQueue("test_order", concurrency=1, max_queued=2)
+    set_deadline(None)
+    queue.acquire()
+    order = []
+    release = Event()
+
+    def waiter(name):
+        with queue.admit():
+            order.append(name)
+            release.wait()
+
+    threads = [Thread(target=waiter, args=(name,)) for name in "ab"]
+    for thread in threads:
+        thread.start()
+        sleep(0.05)
+    assert queue.stats() == {"running": 1, "queued": 2}
+    with pytest.raises(Overloaded):
+        queue.acquire()
+
+    queue.release()
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert order == ["a", "b"]
+    assert queue.stats() == {"running": 0, "queued": 0}
+
+    queue.acquire()
+    set_deadline("50")
+    with pytest.raises(DeadlineExceeded):
+        queue.acquire()
+    assert queue.stats() == {"running": 1, "queued": 0}
+    stats = dropped_stats()
+    assert stats[("test_order", "shed")] == 1
+    assert stats[("test_order", "expired")] == 1
+
+
+def test_async_waiters_are_admitted_from_other_threads():
+    """Verify that a coroutine waiting for a slot is woken up when a thread releases it."""
+    queue = AdmissionQueue("test_async", concurrency=1, max_queued=1)
+    set_deadline(None)
+    queue.acquire()
+
+    async def admitted():
+        async with queue.admit_async():
+            return queue.stats()
+
+    async def main():
+        task = asyncio.ensure_future(admitted())
+        await asyncio.sleep(0.05)
+        Thread(target=queue.release).start()
+        return await asyncio.wait_for(task, 5)
+
+    assert asyncio.run(main()) == {"running": 1, "queued": 0}
+    assert queue.stats() == {"running": 0, "queued": 0}
+
+
+def test_async_waiter_whose_timer_fires_early_is_dropped(monkeypatch):
+    """Verify that a coroutine whose wait times out is dropped with DeadlineExceeded, even
+    if the event loop's timer fired early, instead of running without a slot."""
+    queue = AdmissionQueue("test_early_timer", concurrency=1, max_queued=1)
+    set_deadline("60000")
+    queue.acquire()
+
+    async def early_timeout(awaitable, _timeout):
+        awaitable.cancel()
+        raise asyncio.TimeoutError()
+
+    async def admitted():
+        async with queue.admit_async():
+            pass
+
+    monkeypatch.setattr(asyncio, "wait_for", early_timeout)
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(admitted())
+    assert queue.stats() == {"running": 1, "queued": 0}
+    assert dropped_stats()[("test_early_timer", "expired")] == 1
+    queue.release()
+    set_deadline(None)
+
+
+def test_batcher_drops_expired_samples():
+    """Verify that a sample whose deadline has passed by the time its batch runs is dropped,
+    while the others in the batch still run."""
+    batch_sizes = []
+
+    def predict(batch):
+        batch_sizes.append(len(batch))
+        return batch
+
+    batcher = MicroBatcher(predict, max_batch_size=2, max_wait=0.2)
+
+    def submit(timeout_ms):
+        set_deadline(timeout_ms)
+        return batcher.submit_nowait(np.zeros(1, dtype=np.float32))
+
+    expired = copy_context().run(submit, "1")
+    sleep(0.02)
+    alive = copy_context().run(submit, None)
+    assert alive.result(5)[0] == 0
+    with pytest.raises(DeadlineExceeded):
+        expired.result(5)
+    assert batch_sizes == [1]
+    batcher.close()
@@ -0,0 +1,91 @@
+"""Unit tests for ml_rest_api.asgi, against the Flask app it mounts."""
+
+import io
+
+import pytest
+from PIL import Image
+
+pytest.importorskip("starlette")
+pytest.importorskip("a2wsgi")
+
+# pylint: disable=wrong-import-position
+from starlette.testclient import TestClient
+
+from ml_rest_api.app import APP as FLASK_APP
+from ml_rest_api.asgi import APP
+from ml_rest_api.request_logging import REQUEST_ID_HEADER
+
+CLASSIFIERS = "['cardboard', 'glass', 'metal', 'paper', 'plastic', 'trash']"
+
+
+def _jpeg(colour):
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), colour).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def _request_count(client, endpoint):
+    """Returns the number of requests to endpoint that /metrics has counted."""
+    prefix = f'ml_rest_api_request_duration_seconds_count{{endpoint="{endpoint}",'
+    return sum(
+        float(line.rsplit(" ", 1)[1])
+        for line in client.get("/api/metrics").text.splitlines()
+        if line.startswith(prefix)
+    )
+
+
+@pytest.fixture(name="client", scope="module")
+def fixture_client():
+    """A test client of the ASGI app, on one event loop for the whole module."""
+    with TestClient(APP) as client:
+        yield client
+
+
+def test_predict_answers_like_the_flask_app(client):
+    """Verify that the native /model/predict returns what the Flask one does, and rejects
+    the same invalid requests."""
+    for colour in ((200, 30, 30), (30, 200, 30)):
+        asgi = client.post(
+            "/api/model/predict",
+            files={"file": ("image.jpg", _jpeg(colour), "image/jpeg")},
+            data={"classifiers": CLASSIFIERS},
+        )
+        flask = FLASK_APP.test_client().post(
+            "/api/model/predict",
+            data={
+                "file": (io.BytesIO(_jpeg(colour)), "image.jpg"),
+                "classifiers": CLASSIFIERS,
+            },
+            content_type="multipart/form-data",
+        )
+        assert asgi.status_code == flask.status_code == 200
+        assert asgi.json() == flask.get_json()
+    missing = client.post("/api/model/predict", data={"classifiers": CLASSIFIERS})
+    assert missing.status_code == 400
+
+
+def test_readiness_and_metrics(client):
+    """Verify that the native /readiness reports the same state as the Flask app's, and that
+    the mounted /metrics counts the requests served by the native handlers."""
+    before = _request_count(client, "/api/readiness")
+    asgi = client.get("/api/readiness")
+    assert _request_count(client, "/api/readiness") == before + 1
+    flask = FLASK_APP.test_client().get("/api/readiness")
+    assert asgi.status_code == flask.status_code == 200
+    assert asgi.json()["Ready"] is flask.get_json()["Ready"] is True
+
+    metrics = client.get("/api/metrics")
+    assert metrics.status_code == 200
+    assert metrics.headers["content-type"].startswith("text/plain")
+
+
+def test_request_id_is_returned_by_native_and_mounted_routes(client):
+    """Verify that a client's X-Request-Id is echoed back, and that one is generated if it
+    sends none, whether the route is served natively or by the mounted Flask app."""
+    for path in ("/api/liveness", "/api/metrics"):
+        sent = client.get(path, headers={REQUEST_ID_HEADER: "client-id-1"})
+        assert sent.status_code == 200
+        assert sent.headers[REQUEST_ID_HEADER] == "client-id-1"
+        generated = client.get(path)
+        assert generated.headers[REQUEST_ID_HEADER]
+        assert generated.headers[REQUEST_ID_HEADER] != "client-id-1"
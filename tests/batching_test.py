@@ -0,0 +1,69 @@
+"""Unit tests for ml_rest_api.batching."""
+
+import os
+import signal
+from threading import Thread
+from typing import List
+
+import numpy as np
+import pytest
+
+from ml_rest_api.batching import MicroBatcher
+
+
+def test_concurrent_samples_share_a_batch_and_get_their_own_row():
+    """Verify that concurrent submissions are stacked into one batch and each caller gets back
+    the row computed from its own sample."""
+    batch_sizes: List[int] = []
+
+    def predict(batch):
+        batch_sizes.append(len(batch))
+        return batch.reshape(len(batch), -1).sum(axis=1, keepdims=True)
+
+    batcher = MicroBatcher(predict, max_batch_size=4, max_wait=0.5)
+    results = {}
+
+    def client(value):
+        results[value] = batcher.submit(np.full((2, 2), value, dtype=np.float32))
+
+    threads = [Thread(target=client, args=(value,)) for value in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert batch_sizes == [4]
+    assert {value: row[0] for value, row in results.items()} == {
+        value: value * 4 for value in range(4)
+    }
+
+
+def test_model_exception_is_raised_in_the_caller():
+    """Verify that an exception raised by predict() reaches the submitting thread."""
+
+    def predict(batch):
+        raise RuntimeError("boom")
+
+    batcher = MicroBatcher(predict, max_batch_size=2, max_wait=0)
+    with pytest.raises(RuntimeError, match="boom"):
+        batcher.submit(np.zeros(3))
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork()")
+def test_batcher_works_in_a_forked_child():
+    """Verify that a child forked after the batcher thread started gets a working batcher of
+    its own instead of queueing for a thread that doesn't exist in the child."""
+    batcher = MicroBatcher(lambda batch: batch * 2, max_batch_size=2, max_wait=0)
+    assert batcher.submit(np.ones(1))[0] == 2
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:  # child
+        signal.alarm(10)  # fail rather than hang the test run
+        try:
+            os.write(write_fd, str(batcher.submit(np.full(1, 3.0))[0]).encode())
+        finally:
+            os._exit(0)  # pylint: disable=protected-access
+    os.close(write_fd)
+    with os.fdopen(read_fd) as pipe:
+        assert pipe.read() == "6.0"
+    os.waitpid(pid, 0)
@@ -0,0 +1,33 @@
+"""Test settings, applied before any test module imports the app: the deterministic stub model
+stands in for the TensorFlow network and no rembg session is created, so that the app can be
+imported and served without the trained model or rembg's downloads."""
+
+import os
+import tempfile
+
+import pytest
+
+os.environ.setdefault("TRAINED_MODEL_MODULE_NAME", "stub_model")
+os.environ.setdefault("REMBG_MODELS", "")
+os.environ.setdefault("MULTITHREADED_INIT", "False")  # ready before the first request
+os.environ.setdefault("PREDICTION_CACHE_MAX_ENTRIES", "0")
+os.environ.setdefault("RESULT_STORE_DIR", tempfile.mkdtemp(prefix="ml_rest_api_tests_"))
+
+
+@pytest.fixture(name="saved_model_path", scope="session")
+def fixture_saved_model_path(tmp_path_factory):
+    """A tiny SavedModel standing in for garbage_model: a serving_default signature mapping
+    (N, 224, 224, 3) images to (N, 6) probabilities as output_0."""
+    keras = pytest.importorskip("keras")
+    keras.utils.set_random_seed(0)
+    model = keras.Sequential(
+        [
+            keras.Input((224, 224, 3)),
+            keras.layers.Conv2D(4, 3, strides=4, activation="relu"),
+            keras.layers.GlobalAveragePooling2D(),
+            keras.layers.Dense(6, activation="softmax"),
+        ]
+    )
+    path = str(tmp_path_factory.mktemp("models") / "tiny_model")
+    model.export(path, verbose=False)
+    return path
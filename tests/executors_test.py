@@ -0,0 +1,22 @@
+"""Unit tests for ml_rest_api.executors."""
+
+from threading import Event
+
+import pytest
+
+from ml_rest_api.admission import Overloaded
+from ml_rest_api.executors import BoundedThreadPoolExecutor
+
+
+def test_jobs_beyond_the_queue_are_rejected_until_one_finishes():
+    """Verify that the pool holds at most max_workers running plus max_queued waiting jobs,
+    rejects the next one with Overloaded, and takes jobs again once one has finished."""
+    release = Event()
+    with BoundedThreadPoolExecutor("test", max_workers=1, max_queued=2) as executor:
+        futures = [executor.submit(release.wait, 5) for _ in range(3)]
+        with pytest.raises(Overloaded):
+            executor.submit(release.wait, 5)
+        release.set()
+        for future in futures:
+            future.result(5)
+        assert executor.submit(lambda: "done").result(5) == "done"
@@ -0,0 +1,42 @@
+"""Unit tests for ml_rest_api.imaging."""
+
+import io
+
+import pytest
+from PIL import Image
+
+from ml_rest_api.imaging import ImageTooLarge, decode_full, decode_image
+
+
+def encode(image: Image.Image, image_format: str, **params) -> bytes:
+    """Returns an image encoded in memory."""
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **params)
+    return buffer.getvalue()
+
+
+def test_large_images_are_rejected_from_their_header(monkeypatch):
+    """Verify that an image that would decode to more than UPLOAD_MAX_PIXELS pixels is
+    rejected, and that a smaller one is decoded."""
+    monkeypatch.setenv("UPLOAD_MAX_PIXELS", "10000")
+    with pytest.raises(ImageTooLarge):
+        decode_full(encode(Image.new("RGB", (101, 100)), "PNG"))
+    assert decode_full(encode(Image.new("RGB", (100, 100)), "PNG")).size == (100, 100)
+
+    # A JPEG counts at the scale it is decoded at, here 1/4
+    jpeg = encode(Image.new("RGB", (200, 200)), "JPEG")
+    with pytest.raises(ImageTooLarge):
+        decode_full(jpeg, max_side=0)
+    assert decode_image(jpeg, (50, 50)).size == (50, 50)
+
+
+def test_images_are_decoded_upright_and_scaled_down():
+    """Verify that the EXIF orientation is applied and that the longer side is scaled down to
+    max_side, keeping the aspect ratio."""
+    exif = Image.Exif()
+    exif[0x0112] = 6  # rotated 90 degrees clockwise
+    jpeg = encode(Image.new("RGB", (800, 400)), "JPEG", exif=exif.tobytes())
+    assert decode_full(jpeg, max_side=0).size == (400, 800)
+    image = decode_full(jpeg, max_side=200)
+    assert image.size == (100, 200)
+    assert image.mode == "RGBA"
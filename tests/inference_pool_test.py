@@ -0,0 +1,111 @@
+"""Unit tests for ml_rest_api.inference_pool."""
+
+import multiprocessing
+import os
+import signal
+from threading import Thread
+from time import monotonic, sleep
+
+import numpy as np
+import pytest
+
+from ml_rest_api.inference_pool import InferencePool
+from ml_rest_api.ml_trained_model.wrapper import load_predict
+
+
+@pytest.fixture(name="pool")
+def fixture_pool(monkeypatch):
+    """An inference pool of two processes running the stub model."""
+    monkeypatch.setenv("INFERENCE_PROCESSES", "2")
+    monkeypatch.setenv("INFERENCE_SLOTS", "8")
+    monkeypatch.setenv("INFERENCE_TIMEOUT_SECONDS", "30")
+    pool = InferencePool("stub_model", load_predict)
+    pool.start()
+    assert pool.wait_ready(60)
+    yield pool
+    pool.stop()
+
+
+def test_outputs_match_the_in_process_model(pool):
+    """Verify that samples sent through shared memory, alone or concurrently with other
+    callers, come back with the outputs the model computes in process."""
+    # pylint: disable=import-outside-toplevel
+    from ml_rest_api.ml_trained_model import stub_model
+
+    stub_model.init()
+    samples = np.random.default_rng(1).integers(0, 256, (12, 224, 224, 3))
+    expected = stub_model.predict(samples.astype(np.float32))
+    results = {}
+
+    def client(index):
+        results[index] = pool.submit(samples[index])
+
+    threads = [Thread(target=client, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    np.testing.assert_allclose([results[index] for index in range(8)], expected[:8])
+    np.testing.assert_allclose(pool.predict(samples[8:]), expected[8:], rtol=1e-6)
+
+
+def test_samples_that_are_not_pixel_values_are_rejected(pool):
+    """Verify that samples only travel as uint8 if they convert exactly: 0-255 floats are
+    accepted, values out of range or with fractions are rejected instead of wrapping."""
+    pixels = np.full((224, 224, 3), 255.0, dtype=np.float32)
+    assert pool.submit(pixels).shape == (6,)
+    for value in (256.0, -1.0, 0.5, np.nan):
+        pixels[0, 0, 0] = value
+        with pytest.raises(ValueError):
+            pool.submit(pixels)
+        with pytest.raises(ValueError):
+            pool.predict(np.stack([pixels]))
+    assert pool.submit(np.zeros((224, 224, 3), dtype=np.uint8)).shape == (6,)
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork()")
+def test_forked_child_uses_the_pool_without_owning_its_processes(pool):
+    """Verify that a process forked from the pool's owner (e.g. a gunicorn worker) uses the
+    pool, and has no multiprocessing child that it would terminate or join as it exits.
+    """
+    sample = np.zeros((224, 224, 3), dtype=np.uint8)
+    pid = os.fork()
+    if pid == 0:  # the child, which must not return into pytest
+        code = 1
+        try:
+            if (
+                pool.submit(sample).shape == (6,)
+                and not multiprocessing.active_children()
+            ):
+                code = 0
+        finally:
+            os._exit(code)  # pylint: disable=protected-access
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert not multiprocessing.active_children()  # the owner doesn't either
+    assert len(inference_processes(pool)) == 2
+
+
+def inference_processes(pool):
+    """Returns the pids of the supervisor's children, i.e. the inference processes."""
+    supervisor = pool.supervisor_pid
+    with open(
+        f"/proc/{supervisor}/task/{supervisor}/children", encoding="ascii"
+    ) as file:
+        return [int(pid) for pid in file.read().split()]
+
+
+def test_dead_inference_process_is_restarted(pool):
+    """Verify that the supervisor replaces a killed inference process while the other one
+    keeps serving."""
+    sample = np.zeros((224, 224, 3), dtype=np.uint8)
+    killed = inference_processes(pool)[0]
+    os.kill(killed, signal.SIGKILL)
+    assert pool.submit(sample).shape == (6,)
+    deadline = monotonic() + 30
+    while killed in inference_processes(pool) or len(inference_processes(pool)) < 2:
+        assert monotonic() < deadline
+        sleep(0.1)
+    assert pool.wait_ready(60)
+    for _ in range(4):
+        assert pool.submit(sample).shape == (6,)
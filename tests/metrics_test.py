@@ -0,0 +1,37 @@
+"""Unit tests for ml_rest_api.metrics."""
+
+from time import sleep
+
+from ml_rest_api.metrics import Histogram, stage, start_recording, stop_recording
+
+
+def test_histogram_renders_cumulative_buckets():
+    """Verify the Prometheus text format of a histogram: cumulative buckets, sum and count."""
+    histogram = Histogram("test_seconds", "Test", ("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value, "decode")
+    lines = list(histogram.render())
+    assert 'test_seconds_bucket{stage="decode",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{stage="decode",le="1"} 2' in lines
+    assert 'test_seconds_bucket{stage="decode",le="+Inf"} 3' in lines
+    assert 'test_seconds_sum{stage="decode"} 5.55' in lines
+    assert 'test_seconds_count{stage="decode"} 3' in lines
+
+
+def test_nested_stage_is_not_charged_to_the_outer_one():
+    """Verify that time spent in a nested stage is only charged to that stage."""
+    recorder = start_recording()
+    try:
+        with stage("preprocess"):
+            with stage("decode"):
+                sleep(0.05)
+    finally:
+        stop_recording()
+    assert recorder.seconds["decode"] >= 0.05
+    assert recorder.seconds["preprocess"] < 0.01
+
+
+def test_stage_outside_a_request_records_nothing():
+    """Verify that stages are ignored when no request is being recorded."""
+    with stage("inference"):
+        pass
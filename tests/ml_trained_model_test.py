@@ -0,0 +1,49 @@
+"""Unit tests for ml_rest_api.ml_trained_model's compiled path, against a tiny SavedModel."""
+
+import numpy as np
+import pytest
+
+pytest.importorskip("tensorflow")
+
+# pylint: disable=wrong-import-position
+from ml_rest_api.ml_trained_model import ml_trained_model
+
+
+def _predictions(monkeypatch, saved_model_path, batch, compile_model):
+    """Returns the predictions for batch one image at a time, three at a time and all at
+    once, with the model loaded with or without MODEL_COMPILE (and buckets of 1 and 4).
+    """
+    monkeypatch.setattr(ml_trained_model, "MODEL_PATH", saved_model_path)
+    monkeypatch.setattr(ml_trained_model, "MODEL", None)
+    monkeypatch.setattr(ml_trained_model, "COMPILED", {})
+    monkeypatch.setenv("MODEL_COMPILE", str(compile_model))
+    monkeypatch.setenv("MODEL_BATCH_BUCKETS", "1,4")
+    ml_trained_model.init()
+    assert sorted(ml_trained_model.COMPILED) == ([1, 4] if compile_model else [])
+    return [
+        np.concatenate([ml_trained_model.predict(image[None]) for image in batch]),
+        ml_trained_model.predict(batch[:3]),
+        ml_trained_model.predict(batch),
+    ]
+
+
+def test_compiled_path_gives_the_eager_output(monkeypatch, saved_model_path):
+    """Verify that the compiled buckets, padding a batch to a bucket or splitting it beyond
+    the largest one, return what calling the SavedModel through TFSMLayer does."""
+    batch = np.random.default_rng(0).uniform(0, 255, (5, 224, 224, 3))
+    batch = batch.astype(np.float32)
+    eager = _predictions(monkeypatch, saved_model_path, batch, compile_model=False)
+    compiled = _predictions(monkeypatch, saved_model_path, batch, compile_model=True)
+    for eager_output, compiled_output in zip(eager, compiled):
+        assert compiled_output.shape == eager_output.shape
+        np.testing.assert_allclose(compiled_output, eager_output, rtol=1e-5, atol=1e-6)
+
+
+def test_buckets_default_to_the_warmup_batch_sizes(monkeypatch):
+    """Verify that without MODEL_BATCH_BUCKETS every warmup batch size gets a bucket."""
+    monkeypatch.setenv("MODEL_BATCH_BUCKETS", "")
+    monkeypatch.setenv("WARMUP_BATCH_SIZES", "8, 2,0")
+    assert ml_trained_model.batch_buckets() == [1, 2, 8]
+    monkeypatch.setenv("WARMUP_BATCH_SIZES", "")
+    monkeypatch.setenv("BATCH_MAX_SIZE", "16")
+    assert ml_trained_model.batch_buckets() == [1, 16]
@@ -0,0 +1,71 @@
+"""Unit tests for ml_rest_api.model_registry."""
+
+import gc
+import weakref
+from time import monotonic, sleep
+
+import pytest
+
+from ml_rest_api.model_registry import ModelRegistry, UnknownModelError
+
+SAMPLE = {"image": "test-images/cans.jpeg", "classifiers": ["a", "b", "c"]}
+
+
+@pytest.fixture(name="registry")
+def fixture_registry(monkeypatch):
+    """A registry of two instances of the stub model, loaded."""
+    monkeypatch.setenv("MODELS", "a=stub_model,b=stub_model")
+    monkeypatch.setenv("BATCH_MAX_SIZE", "4")
+    registry = ModelRegistry()
+    registry.init()
+    return registry
+
+
+def test_models_are_separate_and_routed_by_name(registry):
+    """Verify that each model has its own module instance, that requests without a model go
+    to the first one and that unknown models are rejected."""
+    assert registry.ready()
+    with registry.use() as default, registry.use("b") as other:
+        assert default.name == "a"
+        assert default.wrapper.module is not other.wrapper.module
+        assert default.wrapper.run(SAMPLE) == other.wrapper.run(SAMPLE)
+    with pytest.raises(UnknownModelError):
+        registry.acquire("c")
+    with pytest.raises(ValueError):
+        registry.delete("a")  # the default model
+
+
+def test_swap_waits_for_in_flight_requests(registry):
+    """Verify that a new version is only served once loaded, and that the previous one is
+    closed once the last request using it is done."""
+    old = registry.acquire("b")
+    registry._load("b", "stub_model", "")  # pylint: disable=protected-access
+    deadline = monotonic() + 10
+    while registry.entries["b"] is old and monotonic() < deadline:
+        sleep(0.01)
+    new = registry.entries["b"]
+    assert new is not old and new.cache_id != old.cache_id
+    assert old.wrapper.run(SAMPLE)  # still usable by the request holding it
+    assert old.state == "ready"
+    registry.release(old)
+    assert old.state == "unloaded" and old.wrapper.module is None
+    with registry.use("b") as entry:
+        assert entry is new and entry.wrapper.run(SAMPLE)
+
+    registry.delete("b")
+    assert registry.names() == ["a"]
+    assert new.state == "unloaded"
+
+
+def test_delete_frees_the_model(registry):
+    """Verify that an unloaded model's wrapper, module and weights are garbage collected once
+    the last request using it is done (nothing, e.g. a fork hook, keeps them alive)."""
+    with registry.use("b") as entry:
+        assert entry.wrapper.run(SAMPLE)  # starts the micro-batcher's thread
+        wrapper = weakref.ref(entry.wrapper)
+        weights = weakref.ref(entry.wrapper.module.WEIGHTS)
+    del entry
+    registry.delete("b")
+    gc.collect()
+    assert wrapper() is None
+    assert weights() is None
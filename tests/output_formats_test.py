@@ -0,0 +1,30 @@
+"""Unit tests for ml_rest_api.output_formats."""
+
+import io
+import json
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from ml_rest_api.output_formats import encode_output
+
+
+def test_masks_and_crops_match_the_foreground():
+    """Verify that the run-length encoded and 1-bit masks decode to the image's foreground,
+    and that a crop holds the foreground's bounding box."""
+    image = Image.new("RGBA", (40, 30))
+    ImageDraw.Draw(image).rectangle((5, 6, 14, 20), fill=(255, 0, 0, 255))
+    expected = np.asarray(image.getchannel("A")) > 127
+
+    rle = json.loads(encode_output(image, "mask_rle", 6, 80).content)
+    assert rle["size"] == [30, 40]
+    flat = np.repeat(np.arange(len(rle["counts"])) % 2 == 1, rle["counts"])
+    assert (flat.reshape((40, 30)).T == expected).all()
+
+    mask = Image.open(io.BytesIO(encode_output(image, "mask_png", 9, 80).content))
+    assert mask.mode == "1"
+    assert (np.asarray(mask) == expected).all()
+
+    output = encode_output(image, "crop", 0, 80)
+    assert output.headers == {"X-Crop-Box": "5,6,15,21", "X-Image-Size": "40,30"}
+    assert Image.open(io.BytesIO(output.content)).size == (10, 15)
@@ -0,0 +1,153 @@
+"""Unit tests for /model/predict_batch, against the stub model."""
+
+import io
+import json
+import tarfile
+import zipfile
+
+import pytest
+from PIL import Image
+
+from ml_rest_api.app import APP
+
+CLASSIFIERS = "['cardboard', 'glass', 'metal', 'paper', 'plastic', 'trash']"
+COLOURS = ((200, 30, 30), (30, 200, 30), (30, 30, 200), (200, 200, 30), (30, 200, 200))
+
+
+def _jpeg(colour):
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 48), colour).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def _zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def _tar(members):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def _predict(client, colour):
+    """Returns the /model/predict result for an image of one colour."""
+    response = client.post(
+        "/api/model/predict",
+        data={
+            "file": (io.BytesIO(_jpeg(colour)), "image.jpg"),
+            "classifiers": CLASSIFIERS,
+        },
+        content_type="multipart/form-data",
+    )
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def _predict_batch(client, data):
+    return client.post(
+        "/api/model/predict_batch",
+        data={"classifiers": CLASSIFIERS, **data},
+        content_type="multipart/form-data",
+    )
+
+
+@pytest.fixture(name="client")
+def fixture_client(monkeypatch):
+    """A test client, running the images through the model two at a time so that every
+    request spans several forward passes."""
+    monkeypatch.setenv("BATCH_MAX_SIZE", "2")
+    return APP.test_client()
+
+
+@pytest.fixture(name="expected")
+def fixture_expected(client):
+    """The /model/predict result of each colour."""
+    return [_predict(client, colour) for colour in COLOURS]
+
+
+def test_files_are_predicted_in_upload_order(client, expected):
+    """Verify that each uploaded file gets the prediction /model/predict gives it."""
+    files = [
+        (io.BytesIO(_jpeg(colour)), f"{index}.jpg")
+        for index, colour in enumerate(COLOURS)
+    ]
+    response = _predict_batch(client, {"files": files})
+    assert response.status_code == 200
+    assert response.get_json()["predictions"] == [
+        {"filename": f"{index}.jpg", **result} for index, result in enumerate(expected)
+    ]
+
+
+@pytest.mark.parametrize("pack", [_zip, _tar], ids=["zip", "tar"])
+def test_archive_images_are_predicted_in_archive_order(client, expected, pack):
+    """Verify that the images of a zip or tar archive are predicted in archive order, and
+    that its other members are skipped."""
+    members = [
+        (f"photos/{index}.jpg", _jpeg(colour)) for index, colour in enumerate(COLOURS)
+    ]
+    members[2:2] = [("photos/notes.txt", b"not an image"), ("__MACOSX/._0.jpg", b"")]
+    archive = pack(members)
+    response = _predict_batch(client, {"archive": (io.BytesIO(archive), "photos")})
+    assert response.status_code == 200
+    assert response.get_json()["predictions"] == [
+        {"filename": f"photos/{index}.jpg", **result}
+        for index, result in enumerate(expected)
+    ]
+
+
+def test_stream_returns_one_line_per_image_in_order(client, expected):
+    """Verify that stream=true returns the predictions as NDJSON lines, in upload order."""
+    files = [
+        (io.BytesIO(_jpeg(colour)), f"{index}.jpg")
+        for index, colour in enumerate(COLOURS)
+    ]
+    response = _predict_batch(client, {"files": files, "stream": "true"})
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {"filename": f"{index}.jpg", **result} for index, result in enumerate(expected)
+    ]
+
+
+def test_unreadable_image_gets_an_error_entry(client, expected):
+    """Verify that an image that can't be decoded gets an error naming it, without failing
+    the others or describing the server's buffers."""
+    members = [
+        ("a.jpg", _jpeg(COLOURS[0])),
+        ("broken.jpg", b"garbage"),
+        ("b.jpg", _jpeg(COLOURS[1])),
+    ]
+    archive = _zip(members)
+    response = _predict_batch(client, {"archive": (io.BytesIO(archive), "photos.zip")})
+    assert response.status_code == 200
+    assert response.get_json()["predictions"] == [
+        {"filename": "a.jpg", **expected[0]},
+        {"filename": "broken.jpg", "error": "Unreadable input: broken.jpg"},
+        {"filename": "b.jpg", **expected[1]},
+    ]
+
+
+def test_too_many_images_are_rejected(client, monkeypatch):
+    """Verify that more than PREDICT_BATCH_MAX_IMAGES images are answered 400, whether they
+    are uploaded as files or in an archive."""
+    monkeypatch.setenv("PREDICT_BATCH_MAX_IMAGES", "3")
+    images = [_jpeg(colour) for colour in COLOURS[:4]]
+    files = [(io.BytesIO(image), f"{index}.jpg") for index, image in enumerate(images)]
+    response = _predict_batch(client, {"files": files})
+    assert response.status_code == 400
+    assert "More than 3 images" in response.get_json()["error"]
+
+    archive = _zip([(f"{index}.jpg", image) for index, image in enumerate(images)])
+    response = _predict_batch(client, {"archive": (io.BytesIO(archive), "photos.zip")})
+    assert response.status_code == 400
+    assert "More than 3 images" in response.get_json()["error"]
@@ -0,0 +1,36 @@
+"""Unit tests for ml_rest_api.profiling."""
+
+from threading import Event, Thread
+
+import pytest
+
+from ml_rest_api.profiling import ProfileBusy, ProfileSession, profile
+
+
+def test_sampled_stacks_are_collapsed_per_thread():
+    """Verify that a busy thread shows up in the collapsed stacks, outermost frame first, and
+    that a second profile can't start while one is running."""
+    stop = Event()
+
+    def busy_loop():
+        while not stop.is_set():
+            sum(range(1000))
+
+    worker = Thread(target=busy_loop, name="busy_1")
+    worker.start()
+    session = ProfileSession("sample", 0.005, False, False)
+    second = ProfileSession("sample", 0.005, False, False)
+    starter = Thread(target=profile, args=(session, 0, 0.3))
+    starter.start()
+    while not session.samples:
+        stop.wait(0.01)
+    with pytest.raises(ProfileBusy):
+        profile(second, 0, 0.1)
+    starter.join()
+    stop.set()
+    worker.join()
+
+    lines = session.collapsed().splitlines()
+    busy = [line for line in lines if line.startswith("busy;")]
+    assert busy and "busy_loop (profiling_test.py:" in busy[0]
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in busy) <= session.samples
@@ -0,0 +1,42 @@
+"""Unit tests for ml_rest_api.ml_trained_model.quantized_model, against a tiny SavedModel."""
+
+import numpy as np
+import pytest
+
+pytest.importorskip("tensorflow")
+
+# pylint: disable=wrong-import-position
+from ml_rest_api.ml_trained_model import ml_trained_model, quantized_model
+
+
+@pytest.mark.parametrize(
+    "model_format, precision",
+    [("tflite", "fp32"), ("tflite", "int8"), ("onnx", "fp32")],
+)
+def test_predictions_are_shaped_like_the_float_model(
+    monkeypatch, tmp_path, saved_model_path, model_format, precision
+):
+    """Verify that the converted model returns one probability row per image, like the
+    SavedModel, with the same values at full precision."""
+    if model_format == "onnx":
+        pytest.importorskip("tf2onnx")
+    batch = np.random.default_rng(0).uniform(0, 255, (3, 224, 224, 3))
+    batch = batch.astype(np.float32)
+    monkeypatch.setattr(ml_trained_model, "MODEL_PATH", saved_model_path)
+    monkeypatch.setattr(ml_trained_model, "MODEL", None)
+    monkeypatch.setattr(ml_trained_model, "COMPILED", {})
+    monkeypatch.setenv("MODEL_COMPILE", "False")
+    ml_trained_model.init()
+    expected = ml_trained_model.predict(batch)
+
+    monkeypatch.setattr(quantized_model, "MODEL_PATH", saved_model_path)
+    monkeypatch.setattr(quantized_model, "RUNTIME", None)
+    monkeypatch.setenv("QUANTIZED_MODEL_FORMAT", model_format)
+    monkeypatch.setenv("QUANTIZED_MODEL_PRECISION", precision)
+    monkeypatch.setenv("QUANTIZED_MODEL_CACHE_DIR", str(tmp_path))
+    quantized_model.init()
+    predictions = quantized_model.predict(batch)
+    assert predictions.shape == expected.shape == (3, 6)
+    np.testing.assert_allclose(predictions.sum(axis=1), 1, rtol=1e-3)
+    if precision == "fp32":
+        np.testing.assert_allclose(predictions, expected, rtol=1e-4, atol=1e-5)
@@ -0,0 +1,58 @@
+"""Unit tests for ml_rest_api.rembg_sessions."""
+
+import pytest
+from PIL import Image
+
+from ml_rest_api.rembg_sessions import RembgSessionPool
+
+
+@pytest.fixture(autouse=True)
+def require_rembg():
+    """Skips the tests without rembg. It is imported by the tests rather than by the module:
+    once rembg (pymatting) is imported, a process that forks hangs at exit, and other test
+    modules fork."""
+    pytest.importorskip("rembg")
+
+
+class LeftHalfSession:  # pylint: disable=too-few-public-methods
+    """Stands in for a rembg session: the foreground is the left half of the image."""
+
+    def __init__(self):
+        self.sizes = []
+
+    def predict(self, image, *_args, **_kwargs):
+        """Returns a mask keeping the left half, and records the size it was computed at."""
+        self.sizes.append(image.size)
+        mask = Image.new("L", image.size, 0)
+        mask.paste(255, (0, 0, image.width // 2, image.height))
+        return [mask]
+
+
+def _image(width, height):
+    """An image whose left half is red and right half blue."""
+    image = Image.new("RGB", (width, height), (0, 0, 255))
+    image.paste((255, 0, 0), (0, 0, width // 2, height))
+    return image
+
+
+def test_mask_is_computed_on_a_scaled_down_copy_and_applied_at_full_size():
+    """Verify that with max_resolution the session sees a copy no larger than it, while the
+    mask is applied to the image at its original resolution."""
+    session = LeftHalfSession()
+    output = RembgSessionPool.remove(_image(800, 400), session, max_resolution=200)
+    assert session.sizes == [(200, 100)]
+    assert output.mode == "RGBA" and output.size == (800, 400)
+    assert output.getpixel((10, 200)) == (255, 0, 0, 255)
+    assert output.getpixel((390, 200)) == (255, 0, 0, 255)
+    assert output.getpixel((410, 200))[3] == 0
+    assert output.getpixel((790, 200))[3] == 0
+
+
+def test_small_images_are_not_scaled():
+    """Verify that an image within max_resolution goes to the session at its own size."""
+    session = LeftHalfSession()
+    output = RembgSessionPool.remove(_image(160, 80), session, max_resolution=200)
+    assert session.sizes == [(160, 80)]
+    assert output.size == (160, 80)
+    assert output.getpixel((10, 40)) == (255, 0, 0, 255)
+    assert output.getpixel((150, 40))[3] == 0
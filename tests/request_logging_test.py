@@ -0,0 +1,49 @@
+"""Unit tests for ml_rest_api.request_logging."""
+
+import json
+import logging
+from queue import Queue
+
+from ml_rest_api.request_logging import (
+    DroppingQueueHandler,
+    JsonFormatter,
+    RequestFilter,
+    dropped_records,
+    start_request_log,
+    stop_request_log,
+)
+
+
+def test_records_are_tagged_sampled_and_dropped_when_queued(monkeypatch):
+    """Verify that records carry the request's ID and extra fields as JSON, that a request
+    sampled out only logs warnings and above, and that records beyond the queue's size are
+    dropped and counted rather than blocking."""
+    monkeypatch.setenv("LOG_ROUTE_SAMPLE_RATES", "/api/liveness=0")
+    handler = DroppingQueueHandler(Queue(2))
+    handler.addFilter(RequestFilter())
+    logger = logging.getLogger("request_logging_test")
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(handler)
+    try:
+        assert start_request_log("/api/model/predict", "abc-123") == "abc-123"
+        logger.debug("decoded %s", "image", extra={"stages_ms": {"decode": 1.5}})
+        assert len(start_request_log("/api/liveness", "not a valid id")) == 32
+        logger.info("sampled out")
+        logger.warning("kept")
+        stop_request_log()
+        dropped = dropped_records()
+        logger.error("dropped")
+        assert dropped_records() == dropped + 1
+    finally:
+        stop_request_log()
+        logger.removeHandler(handler)
+
+    entries = [
+        json.loads(JsonFormatter().format(handler.queue.get())) for _ in range(2)
+    ]
+    assert entries[0]["request_id"] == "abc-123"
+    assert entries[0]["message"] == "decoded image"
+    assert entries[0]["stages_ms"] == {"decode": 1.5}
+    assert entries[1]["message"] == "kept"
+    assert entries[1]["level"] == "WARNING"
@@ -0,0 +1,186 @@
+"""Unit tests for ml_rest_api.result_cache."""
+
+import asyncio
+from threading import Event, Thread
+
+from ml_rest_api.admission import DeadlineExceeded, set_deadline
+from ml_rest_api.result_cache import ResultCache, cache_key
+
+
+def test_key_depends_on_image_bytes_and_parameters():
+    """Verify that the cache key changes with the image bytes and with the classifier list."""
+    key = cache_key(b"image", ["['glass', 'metal']"])
+    assert key == cache_key(b"image", ["['glass', 'metal']"])
+    assert key != cache_key(b"other image", ["['glass', 'metal']"])
+    assert key != cache_key(b"image", ["['metal', 'glass']"])
+
+
+def test_hit_skips_computation():
+    """Verify that a second lookup returns the cached value without recomputing it."""
+    cache = ResultCache(max_entries=10, max_bytes=1024, ttl=60)
+    calls = []
+    for _ in range(2):
+        assert cache.get_or_compute("k", lambda: calls.append(1) or {"label": "glass"})
+    assert len(calls) == 1
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_entry_is_evicted_by_size():
+    """Verify that the byte limit evicts the least recently used entry first."""
+    cache = ResultCache(max_entries=10, max_bytes=30, ttl=60)
+    for key in ("a", "b"):
+        cache.get_or_compute(key, lambda key=key: key, sizeof=lambda _: 10)
+    cache.get_or_compute("a", lambda: "recomputed", sizeof=lambda _: 10)  # touch "a"
+    cache.get_or_compute("c", lambda: "c", sizeof=lambda _: 20)
+    assert cache.stats()["evictions"] == 1
+    assert cache.get_or_compute("a", lambda: "recomputed") == "a"
+    assert cache.get_or_compute("b", lambda: "recomputed") == "recomputed"
+
+
+def test_expired_entry_is_recomputed():
+    """Verify that entries older than the TTL are not served."""
+    cache = ResultCache(max_entries=10, max_bytes=1024, ttl=0)
+    cache.get_or_compute("k", lambda: "old")
+    assert cache.get_or_compute("k", lambda: "new") == "new"
+    assert cache.stats()["expirations"] == 1
+
+
+def test_identical_concurrent_requests_are_coalesced():
+    """Verify that callers asking for a key that is being computed wait for that computation
+    instead of running their own."""
+    cache = ResultCache(max_entries=10, max_bytes=1024, ttl=60)
+    started, release = Event(), Event()
+    calls = []
+    results = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "result"
+
+    first = Thread(target=lambda: results.append(cache.get_or_compute("k", slow)))
+    first.start()
+    started.wait(5)
+    second = Thread(target=lambda: results.append(cache.get_or_compute("k", slow)))
+    second.start()
+    while cache.stats()["coalesced"] == 0:
+        pass
+    release.set()
+    first.join()
+    second.join()
+    assert results == ["result", "result"]
+    assert len(calls) == 1
+
+
+def test_async_requests_are_coalesced():
+    """Verify that concurrent coroutines share one computation and its cached result."""
+    cache = ResultCache(max_entries=10, max_bytes=1024, ttl=60)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"label": "glass"}
+
+    async def lookups():
+        return await asyncio.gather(
+            *(cache.get_or_compute_async("k", compute) for _ in range(4))
+        )
+
+    assert asyncio.run(lookups()) == [{"label": "glass"}] * 4
+    assert cache.get_or_compute("k", lambda: "recomputed") == {"label": "glass"}
+    assert len(calls) == 1
+    assert cache.stats()["coalesced"] == 3
+
+
+def test_failed_computation_is_retried_by_a_waiter():
+    """Verify that a caller waiting for a computation that fails computes the value itself,
+    instead of getting the other caller's exception."""
+    cache = ResultCache(max_entries=10, max_bytes=1024, ttl=60)
+    started, release = Event(), Event()
+    outcomes = []
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise ValueError("failed")
+
+    def first_caller():
+        try:
+            cache.get_or_compute("k", failing)
+        except ValueError as exception:
+            outcomes.append(str(exception))
+
+    first = Thread(target=first_caller)
+    first.start()
+    started.wait(5)
+    second = Thread(
+        target=lambda: outcomes.append(cache.get_or_compute("k", lambda: "own"))
+    )
+    second.start()
+    while cache.stats()["coalesced"] == 0:
+        pass
+    release.set()
+    first.join()
+    second.join()
+    assert sorted(outcomes) == ["failed", "own"]
+    assert cache.get_or_compute("k", lambda: "recomputed") == "own"
+
+
+def test_waiter_gives_up_at_its_deadline():
+    """Verify that a caller waiting for a computation raises DeadlineExceeded once its own
+    deadline passes, while the computation goes on for the others."""
+    cache = ResultCache(max_entries=10, max_bytes=1024, ttl=60)
+    started, release = Event(), Event()
+    outcomes = []
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return "result"
+
+    def impatient_caller():
+        set_deadline("50")
+        try:
+            cache.get_or_compute("k", slow)
+        except DeadlineExceeded:
+            outcomes.append("expired")
+
+    first = Thread(target=lambda: outcomes.append(cache.get_or_compute("k", slow)))
+    first.start()
+    started.wait(5)
+    second = Thread(target=impatient_caller)
+    second.start()
+    second.join(5)
+    assert outcomes == ["expired"]
+    release.set()
+    first.join()
+    assert outcomes == ["expired", "result"]
+
+
+def test_async_waiter_retries_a_failed_computation():
+    """Verify that coroutines waiting for a computation that fails compute the value again
+    (once), instead of getting its exception."""
+    cache = ResultCache(max_entries=10, max_bytes=1024, ttl=60)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        if len(calls) == 1:
+            raise ValueError("failed")
+        return {"label": "glass"}
+
+    async def lookups():
+        return await asyncio.gather(
+            *(cache.get_or_compute_async("k", compute) for _ in range(3)),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(lookups())
+    assert [str(result) for result in results if isinstance(result, ValueError)] == [
+        "failed"
+    ]
+    assert results.count({"label": "glass"}) == 2
+    assert len(calls) == 2
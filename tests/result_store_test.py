@@ -0,0 +1,98 @@
+"""Unit tests for ml_rest_api.result_store."""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Timer
+
+import pytest
+
+from ml_rest_api.admission import Overloaded
+from ml_rest_api.executors import BoundedThreadPoolExecutor
+from ml_rest_api.result_store import ResultStore
+
+
+def _write(size):
+    return lambda result_file: result_file.write(b"x" * size)
+
+
+def test_saved_result_can_be_read_back(tmp_path):
+    """Verify that a saved entry is returned by name with its size."""
+    store = ResultStore(str(tmp_path), ttl=60, max_bytes=1024)
+    name = store.save(_write(10))
+    result = store.get(name)
+    assert result is not None and result.size == 10
+    assert not [entry for entry in os.listdir(tmp_path) if entry.endswith(".partial")]
+
+
+def test_unknown_or_malformed_names_are_not_served(tmp_path):
+    """Verify that names outside the store's naming scheme (e.g. path traversal) are rejected."""
+    store = ResultStore(str(tmp_path), ttl=60, max_bytes=1024)
+    assert store.get("../../etc/passwd") is None
+    assert store.get("a" * 32 + ".png") is None
+
+
+def test_least_recently_used_entries_are_evicted_beyond_max_bytes(tmp_path):
+    """Verify that the size cap evicts the entry that was accessed least recently."""
+    store = ResultStore(str(tmp_path), ttl=60, max_bytes=25)
+    first, second = store.save(_write(10)), store.save(_write(10))
+    os.utime(os.path.join(tmp_path, first), (1, 1))
+    os.utime(os.path.join(tmp_path, second), (2, 2))
+    store.ttl = 1e12  # keep the back-dated entries alive
+    store.get(first)  # first becomes the most recently used
+    store.save(_write(10))
+    assert store.get(first) is not None
+    assert store.get(second) is None
+
+
+def test_expired_entries_are_removed(tmp_path):
+    """Verify that entries not accessed within the TTL are no longer served."""
+    store = ResultStore(str(tmp_path), ttl=60, max_bytes=1024)
+    name = store.save(_write(10))
+    os.utime(os.path.join(tmp_path, name), (1, 1))
+    assert store.get(name) is None
+    assert not os.listdir(tmp_path)
+
+
+def test_download_waits_for_a_result_saved_in_the_background(tmp_path):
+    """Verify that an entry saved in the background is reserved immediately and served once
+    its writer finishes."""
+    store = ResultStore(str(tmp_path), ttl=60, max_bytes=1024)
+    release = Event()
+
+    def slow_write(result_file):
+        release.wait(5)
+        result_file.write(b"x" * 10)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        name = store.save_in_background(slow_write, executor)
+        assert store.get(name) is None
+        Timer(0.1, release.set).start()
+        result = store.get(name, wait=5)
+    assert result is not None and result.size == 10
+
+
+def test_interrupted_write_leaves_nothing_behind(tmp_path):
+    """Verify that an entry whose writer fails halfway is neither served nor left on disk as
+    a partial file."""
+    store = ResultStore(str(tmp_path), ttl=60, max_bytes=1024)
+
+    def failing_write(result_file):
+        result_file.write(b"x" * 10)
+        raise OSError("disk full")
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        name = store.save_in_background(failing_write, executor)
+    assert store.get(name, wait=1) is None
+    assert not os.listdir(tmp_path)
+
+
+def test_rejected_background_save_drops_its_reservation(tmp_path):
+    """Verify that an entry whose save is rejected by the executor isn't left pending."""
+    store = ResultStore(str(tmp_path), ttl=60, max_bytes=1024)
+    release = Event()
+    with BoundedThreadPoolExecutor("test", max_workers=1, max_queued=0) as executor:
+        executor.submit(release.wait, 5)
+        with pytest.raises(Overloaded):
+            store.save_in_background(_write(10), executor)
+        release.set()
+    assert not os.listdir(tmp_path)
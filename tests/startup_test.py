@@ -0,0 +1,26 @@
+"""Unit tests for ml_rest_api.startup."""
+
+from ml_rest_api.startup import Warmup
+
+
+def test_warmup_reports_done_or_skipped_as_warm():
+    """Verify that a warmup that ran, or had nothing to do, counts as warm and is timed."""
+    done, skipped = Warmup("done"), Warmup("skipped")
+    assert not done.warm()
+    done.run(lambda: True)
+    skipped.run(lambda: False)
+    assert done.warm() and done.report()["status"] == "done"
+    assert skipped.warm() and skipped.report()["status"] == "skipped"
+    assert done.report()["seconds"] is not None
+
+
+def test_failed_warmup_is_not_warm():
+    """Verify that an exception in the warmup is recorded instead of raised."""
+
+    def fail():
+        raise RuntimeError("boom")
+
+    warmup = Warmup("failing")
+    warmup.run(fail)
+    assert warmup.report()["status"] == "failed"
+    assert not warmup.warm()
@@ -0,0 +1,48 @@
+"""Unit tests for ml_rest_api.thread_budget."""
+
+from ml_rest_api import thread_budget
+
+
+def test_budget_follows_the_cgroup_cpu_quota(tmp_path, monkeypatch):
+    """Verify that cgroup v2 and v1 quotas are read, and that the budget shares the quota out
+    between the workers unless THREAD_BUDGET is set."""
+    (tmp_path / "cpu.max").write_text("max 100000\n")
+    assert thread_budget.cgroup_cpu_quota(str(tmp_path)) is None
+    (tmp_path / "cpu.max").write_text("50000 100000\n")
+    assert thread_budget.cgroup_cpu_quota(str(tmp_path)) == 0.5
+
+    (tmp_path / "v1" / "cpu").mkdir(parents=True)
+    (tmp_path / "v1" / "cpu" / "cpu.cfs_quota_us").write_text("200000\n")
+    (tmp_path / "v1" / "cpu" / "cpu.cfs_period_us").write_text("100000\n")
+    assert thread_budget.cgroup_cpu_quota(str(tmp_path / "v1")) == 2.0
+
+    monkeypatch.setattr(thread_budget, "CGROUP_ROOT", str(tmp_path))
+    monkeypatch.setenv("WEB_CONCURRENCY", "2")
+    assert thread_budget.cpu_limit() == 0.5
+    assert thread_budget.thread_budget() == 1
+    assert thread_budget.request_threads() == 4
+    monkeypatch.setenv("THREAD_BUDGET", "3")
+    assert thread_budget.threads_for("REMBG_INTRA_OP_THREADS") == 3
+    monkeypatch.setenv("REMBG_INTRA_OP_THREADS", "2")
+    assert thread_budget.threads_for("REMBG_INTRA_OP_THREADS") == 2
+
+
+def test_default_worker_count_fits_the_memory_limit(tmp_path, monkeypatch):
+    """Verify that the default number of workers is one per CPU, capped by the cgroup memory
+    limit at WORKER_MEMORY_MB per worker."""
+    (tmp_path / "cpu.max").write_text("400000 100000\n")
+    (tmp_path / "memory.max").write_text("max\n")
+    assert thread_budget.cgroup_memory_limit(str(tmp_path)) is None
+    (tmp_path / "v1" / "memory").mkdir(parents=True)
+    (tmp_path / "v1" / "memory" / "memory.limit_in_bytes").write_text("536870912\n")
+    assert thread_budget.cgroup_memory_limit(str(tmp_path / "v1")) == 512 * 1024 * 1024
+
+    monkeypatch.setattr(thread_budget, "CGROUP_ROOT", str(tmp_path))
+    monkeypatch.setattr(thread_budget.os, "sched_getaffinity", lambda _: range(8))
+    monkeypatch.setenv("WORKER_MEMORY_MB", "0")
+    assert thread_budget.default_worker_count() == 4
+    (tmp_path / "memory.max").write_text(f"{1024 * 1024 * 1024}\n")
+    monkeypatch.setenv("WORKER_MEMORY_MB", "768")
+    assert thread_budget.default_worker_count() == 1
+    monkeypatch.setenv("WORKER_MEMORY_MB", "300")
+    assert thread_budget.default_worker_count() == 3